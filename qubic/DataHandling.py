@@ -207,7 +207,7 @@ def get_mode(y, nbinsmin=51):
     return mymode
 def cut_tod(tod, azt, elt, t, elmin=30, elmax=50):
     index_el=np.where((elt > elmin) & (elt < elmax))[0]
-    tod_cut=tod[index_el].copy()
+    tod_cut=tod[..., index_el].copy()
     newazt=azt[index_el].copy()
     newelt=elt[index_el].copy()
     myt=t-t[0]
@@ -278,49 +278,35 @@ class DirtyMaps:
 
         return mymap
 
-    def make_healpix_map(self, d, elmin=30, elmax=50, countcut=0):
+    def make_healpix_map(self, d, elmin=30, elmax=50, countcut=0, partial=False):
+
+        """
+        d can be the TOD of one detector or an array (nTES, nsamples). If partial
+        is True, only the seen pixels are returned, together with their indices.
+        """
 
         d, newazt, newelt, _ = cut_tod(d, self.azt, self.elt, self.tt, elmin=elmin, elmax=elmax)
 
-        unseen_val=hp.UNSEEN
         ips = hp.ang2pix(self.nside, newazt, newelt, lonlat=True)
-        mymap = np.zeros(12*self.nside**2)
-        mapcount = np.zeros(12*self.nside**2)
-        for i in range(len(newazt)):
-            mymap[ips[i]] -= d[i]
-            mapcount[ips[i]] += 1
-        unseen = mapcount <= countcut
-        mymap[unseen] = unseen_val
-        mapcount[unseen] = unseen_val
-        mymap[~unseen] = mymap[~unseen] / mapcount[~unseen]
-        return mymap
+        return _bin_healpix(-d, ips, self.nside, countcut, partial)
 
 
 
-    def make_healpix_map_radec(self, d, st, elmin=30, elmax=50, countcut=0, latitude=-24.731358, longitude=-65.409535):
+    def make_healpix_map_radec(self, d, st, elmin=30, elmax=50, countcut=0, latitude=-24.731358, longitude=-65.409535,
+                               partial=False):
 
         '''
         This function allow to create healpix map in RADEC coordinates.
-            - d is your TOD
+            - d is your TOD, of one detector or an array (nTES, nsamples)
             - st is the date when the observation started (exemple : st = '2022-07-14 23:54:19.113000')
             - latitude and longitude are set to be in Salta lab
+            - if partial is True, only the seen pixels are returned, together with their indices
         '''
 
         d, newazt, newelt, newt = cut_tod(d, self.azt, self.elt, self.tt, elmin=elmin, elmax=elmax)
-        mymap = np.zeros(12*self.nside**2)
-        mapcount = np.zeros(12*self.nside**2)
         myra, mydec = qubic.hor2equ(newazt+120, newelt, time=newt, date_obs=st, longitude=longitude, latitude=latitude)
         ips=hp.ang2pix(self.nside, np.deg2rad(myra-180), np.deg2rad(mydec))
-        unseen_val=hp.UNSEEN
-        for i in range(len(d)):
-            mymap[ips[i]] -= d[i]
-            mapcount[ips[i]] += 1
-        unseen = mapcount <= countcut
-        mymap[unseen] = unseen_val
-        mapcount[unseen] = unseen_val
-        mymap[~unseen] = mymap[~unseen] / mapcount[~unseen]
-
-        return mymap
+        return _bin_healpix(-d, ips, self.nside, countcut, partial)
 
 
 class BeamMapsAnalysis(object):
@@ -450,19 +436,9 @@ class BeamMapsAnalysis(object):
 
 
         return -mymap
-    def make_healpix_map(self, azt, elt, tod, countcut=0):
-        unseen_val=hp.UNSEEN
+    def make_healpix_map(self, azt, elt, tod, countcut=0, partial=False):
         ips = hp.ang2pix(self.nside, azt, elt, lonlat=True)
-        mymap = np.zeros(12*self.nside**2)
-        mapcount = np.zeros(12*self.nside**2)
-        for i in range(len(azt)):
-            mymap[ips[i]] -= tod[i]
-            mapcount[ips[i]] += 1
-        unseen = mapcount <= countcut
-        mymap[unseen] = unseen_val
-        mapcount[unseen] = unseen_val
-        mymap[~unseen] = mymap[~unseen] / mapcount[~unseen]
-        return mymap
+        return _bin_healpix(-tod, ips, self.nside, countcut, partial)
     def remove_noise(self, tt, tod):
 
         hf_noise = hf_noise_estimate(tt, tod) / np.sqrt(2)
@@ -785,3 +761,14 @@ def _read_fits_beam_maps(TESNum):
     header = hdulist[0].header
 
     return hdulist[0].data
+
+
+def _bin_healpix(tod, ips, nside, countcut, partial):
+    """
+    Bin the TOD of one or several detectors into a healpix map. If partial is
+    True, return the seen pixels and their indices instead of the full map.
+    """
+    out = dl.bin_map(tod, ips, 12 * nside ** 2, countcut=countcut, partial=partial)
+    if partial:
+        return out[0], out[2]
+    return out[0]
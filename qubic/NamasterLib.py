@@ -1,13 +1,16 @@
+import os
 import numpy as np
 import healpy as hp
 import pymaster as nmt
 
+from qubic.utils import _atomic_write, _digest
+
 __all__ = ['Namaster']
 
 
 class Namaster(object):
 
-    def __init__(self, weight_mask, lmin, lmax, delta_ell, aposize=10.0, apotype='C1'):
+    def __init__(self, weight_mask, lmin, lmax, delta_ell, aposize=10.0, apotype='C1', workspace_cache=None):
         """
 
         Parameters
@@ -24,6 +27,10 @@ class Namaster(object):
         apotype: apodization type.
             Three methods implemented: C1, C2 and Smooth.
             'C1' by default.
+        workspace_cache: str, optional
+            Directory in which the NmtWorkspaces are stored, so that their
+            coupling matrices are read instead of recomputed when the same
+            mask, binning, purification and beam are used again.
         """
 
         lmin = int(lmin)
@@ -54,6 +61,8 @@ class Namaster(object):
         self.f2bis = None
         self.w = None
         self.cw = None
+        self.workspace_cache = workspace_cache
+        self._workspaces = {}
 
     def get_binning(self, nside):
         """
@@ -211,7 +220,8 @@ class Namaster(object):
             Note that generally it's not a good idea to purify both,
             since you'll lose sensitivity on E
         w: list with Namaster workspace [w00, w22, w02]
-            If None the workspaces will be created.
+            If None the workspaces are returned by get_workspaces, which computes them
+            once for given mask, binning, purification and beam.
         beam_correction: bool, optional
             None by default.
             If True, a correction by the Qubic beam at 150GHz is applied.
@@ -256,20 +266,13 @@ class Namaster(object):
 
         # Make workspaces
         if w is None:
-            w00 = nmt.NmtWorkspace()
-            w00.compute_coupling_matrix(f0, f0bis, b)
-
-            w22 = nmt.NmtWorkspace()
-            w22.compute_coupling_matrix(f2, f2bis, b)
-
-            w02 = nmt.NmtWorkspace()
-            w02.compute_coupling_matrix(f0, f2bis, b)
-            w = [w00, w22, w02]
+            w = self.get_workspaces(f0, f2, b, mask_apo=mask_apo,
+                                    purify_e=purify_e,
+                                    purify_b=purify_b,
+                                    beam_correction=beam_correction,
+                                    verbose=verbose)
             self.w = w
-        else:
-            w00 = w[0]
-            w22 = w[1]
-            w02 = w[2]
+        w00, w22, w02 = w
 
         # Get Cls
         c00 = self.compute_master(f0, f0bis, w00)
@@ -290,6 +293,100 @@ class Namaster(object):
 
         return self.ell_binned, spectra, w
 
+    def get_spectra_batch(self, maps_list, mask_apo=None, maps2_list=None, purify_e=False, purify_b=True,
+                          w=None, beam_correction=None, pixwin_correction=False, verbose=True):
+        """
+        Get spectra from a sequence of IQU maps, such as Monte-Carlo realisations.
+        The workspaces are computed (or read from the cache) once and reused for all the maps.
+        Parameters
+        ----------
+        maps_list: sequence of arrays
+            IQU maps, each of shape (3, #pixels)
+        maps2_list: sequence of arrays, optional
+            IQU maps, each of shape (3, #pixels) for Cross-Spectra with the maps of maps_list
+        mask_apo, purify_e, purify_b, w, beam_correction, pixwin_correction, verbose:
+            See get_spectra.
+        Returns
+        -------
+        ell_binned
+        spectra: array of shape (#maps, #bins, 4) with the TT, EE, BB, TE spectra
+        w: List containing the NmtWorkspaces [w00, w22, w02]
+
+        """
+        if maps2_list is None:
+            maps2_list = [None] * len(maps_list)
+        elif len(maps2_list) != len(maps_list):
+            raise ValueError('The lists of maps do not have the same length.')
+
+        spectra = []
+        for i, (map, map2) in enumerate(zip(maps_list, maps2_list)):
+            ell_binned, spec, w = self.get_spectra(map, mask_apo=mask_apo, map2=map2,
+                                                   purify_e=purify_e,
+                                                   purify_b=purify_b,
+                                                   w=w,
+                                                   beam_correction=beam_correction,
+                                                   pixwin_correction=pixwin_correction,
+                                                   verbose=verbose and i == 0)
+            spectra.append(spec)
+
+        return ell_binned, np.array(spectra), w
+
+    def get_workspaces(self, f0, f2, b, mask_apo=None, purify_e=False, purify_b=True, beam_correction=None,
+                       verbose=True):
+        """
+        Return the workspaces [w00, w22, w02] of the fields. Their coupling matrices only depend on the mask,
+        the binning, the purification and the beam, so they are computed once for these parameters, kept
+        by the object and, if the workspace_cache directory is set, written to disk.
+        Parameters
+        ----------
+        f0, f2: spin-0 and spin-2 Namaster fields, as returned by get_fields
+        b: NmtBin object
+        mask_apo, purify_e, purify_b, beam_correction:
+            The parameters used to build the fields.
+        verbose: bool, optional
+            True by default.
+        Returns
+        -------
+        w: List containing the NmtWorkspaces [w00, w22, w02]
+
+        """
+        if mask_apo is None:
+            mask_apo = self.mask_apo
+        nside = hp.npix2nside(len(mask_apo))
+        key = self._get_workspace_key(nside, mask_apo, purify_e, purify_b, beam_correction)
+        if key in self._workspaces:
+            return self._workspaces[key]
+
+        filenames = [None] * 3
+        if self.workspace_cache is not None:
+            filenames = [os.path.join(self.workspace_cache, '{}_{}.fits'.format(key, spins))
+                         for spins in ('00', '22', '02')]
+
+        if all(f is not None and os.path.exists(f) for f in filenames):
+            if verbose:
+                print('Reading the workspaces from {}.'.format(self.workspace_cache))
+            w = []
+            for filename in filenames:
+                wsp = nmt.NmtWorkspace()
+                wsp.read_from(filename)
+                w.append(wsp)
+        else:
+            w00 = nmt.NmtWorkspace()
+            w00.compute_coupling_matrix(f0, f0, b)
+
+            w22 = nmt.NmtWorkspace()
+            w22.compute_coupling_matrix(f2, f2, b)
+
+            w02 = nmt.NmtWorkspace()
+            w02.compute_coupling_matrix(f0, f2, b)
+            w = [w00, w22, w02]
+            if self.workspace_cache is not None:
+                for wsp, filename in zip(w, filenames):
+                    _atomic_write(filename, wsp.write_to, suffix='.fits')
+
+        self._workspaces[key] = w
+        return w
+
     def get_pixwin_correction(self, nside):
         """Return the binned pixel window function multiplied by 2pi/(l(l+1))
         for temperature and polarization """
@@ -300,6 +397,18 @@ class Namaster(object):
 
         return pwb
 
+    def _get_workspace_key(self, nside, mask_apo, purify_e, purify_b, beam_correction):
+        """
+        Return the hexadecimal digest identifying the workspaces of a mask, a binning, a purification
+        and a beam correction.
+        """
+        if beam_correction is True:
+            beam_correction = 0.39268176
+        return _digest('qubic.namaster.workspace.v1', nside, np.asarray(mask_apo, dtype=float),
+                       self.lmin, self.lmax, self.delta_ell, self.aposize, self.apotype,
+                       bool(purify_e), bool(purify_b),
+                       None if beam_correction is None else float(beam_correction))
+
     def _binning(self):
         ells = np.arange(self.lmin, self.lmax, dtype='int32')  # Array of multipoles
         weights = 1. / self.delta_ell * np.ones_like(ells)  # Array of weights
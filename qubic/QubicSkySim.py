@@ -8,12 +8,14 @@ import pysm3.units as u
 from pysm3 import utils
 from pylab import *
 from scipy.optimize import curve_fit
-import pickle
+from scipy.spatial import cKDTree
+import multiprocessing as mp
+from collections import deque
 
 import qubic
 from qubic import camb_interface as qc
 from qubic import fibtools as ft
-from qubic.utils import progress_bar
+from qubic.fastsim_store import get_fastsim_data
 
 __all__ = ['sky', 'Qubic_sky']
 
@@ -447,23 +449,16 @@ class Qubic_sky(sky):
         ##############################################################################################################
         # Restore data for FastSimulation ############################################################################
         ##############################################################################################################
-        #### Directory for fast simulations
-        dir_fast = os.path.join(os.path.dirname(__file__), 'data', f'FastSimulator_version{version_FastSim}')
         #### Integration time assumed in FastSim files
         fastsimfile_effective_duration = 2.
 
-        with open(dir_fast + os.sep + 'DataFastSimulator_{}{}_nfsub_{}.pkl'.format(self.dictionary['config'],
-                                                                          str(self.filter_nu),
-                                                                          self.Nfout),
-                  "rb") as file:
-            DataFastSim = pickle.load(file)
-            print(file)
+        #### The FastSimulator inputs are memory-mapped and cached by fastsim_store
+        config = '{}{}'.format(self.dictionary['config'], str(self.filter_nu))
+        DataFastSim = get_fastsim_data(config, nfsub=self.Nfout, version=version_FastSim)
         # Read Coverage map
         if coverage is None:
-            DataFastSimCoverage = pickle.load(open(dir_fast + os.sep + 'DataFastSimulator_{}{}_coverage.pkl'.format(
-                                                       self.dictionary['config'],
-                                                       str(self.filter_nu)), "rb"))
-            coverage = DataFastSimCoverage['coverage']
+            ### Copied as it is modified below
+            coverage = np.array(get_fastsim_data(config, version=version_FastSim)['coverage'])
         # Read noise normalization
         if sigma_sec is None:
             #### Beware ! Initial End-To-End simulations that produced the first FastSimulator were done with
@@ -535,22 +530,114 @@ class Qubic_sky(sky):
         of this C9theta) into Cl has to be done using wrappers on camb function found in camb_interface.py of the QUBIC software:
         the functions to back and forth from ctheta to cl are: cl_2_ctheta and ctheta_2_cell. The simulation of the noise itself
         calls a function of camb_interface called simulate_correlated_map().
+        The realization is drawn from np.random.default_rng(seed) and does not use the global numpy random state.
         Parameters
         ----------
         sigma_sec
         coverage
         Nyears
         verbose
-        seed
+        seed: int, SeedSequence, Generator or None
+            Seed of the realization. If None, a new realization is drawn at each call.
         effective_variance_invcov
 
         Returns
         -------
 
+        """
+        seenpix, thnoise = self._noise_rms_maps(sigma_sec, coverage, covcut=covcut, nsub=nsub, Nyears=Nyears,
+                                                verbose=verbose,
+                                                effective_variance_invcov=effective_variance_invcov,
+                                                sub_bands_cov=sub_bands_cov)
+        if verbose:
+            if clnoise is None:
+                print('Simulating noise maps with no spatial correlation')
+            else:
+                print('Simulating noise maps with spatial correlation')
+            if nsub > 1 and sub_bands_cov is not None:
+                print('Simulating noise maps sub-bands covariance')
+        noise_maps = _simulate_noise_maps(seed, self.nside, seenpix, thnoise, clnoise=clnoise,
+                                          sub_bands_eig=_sub_bands_eig(sub_bands_cov, nsub))
+
+        if nsub == 1:
+            return noise_maps[0, :, :]
+        else:
+            return noise_maps
+
+    def create_noise_maps_batch(self, nreal, sigma_sec, coverage, covcut=0.1, nsub=1,
+                                Nyears=4, verbose=False, seed=None,
+                                effective_variance_invcov=None,
+                                clnoise=None,
+                                sub_bands_cov=None, processes=None):
+        """
+        This generates nreal realizations of the noise maps of create_noise_maps(), computed by a pool of processes.
+        The realizations are yielded in order, and at most twice as many realizations as processes are held in
+        memory, so that thousands of them can be processed or written one at a time.
+        The realization k is drawn from the k-th stream spawned from np.random.SeedSequence(seed), so that it is
+        bit-identical to create_noise_maps(..., seed=np.random.SeedSequence(seed).spawn(nreal)[k]) whatever the
+        number of processes.
+
+        Parameters
+        ----------
+        nreal: int
+            Number of realizations.
+        sigma_sec, coverage, covcut, nsub, Nyears, verbose, effective_variance_invcov, clnoise, sub_bands_cov:
+            See create_noise_maps().
+        seed: int, SeedSequence or None
+            Entropy of the realizations. If None, new realizations are drawn at each call.
+        processes: int
+            Number of worker processes. By default, the number of CPUs. With 1, the realizations are computed
+            in this process.
+
+        Yields
+        ------
+        noise_maps: array of shape (nsub, npix, 3), or (npix, 3) if nsub=1
+
+        """
+        seenpix, thnoise = self._noise_rms_maps(sigma_sec, coverage, covcut=covcut, nsub=nsub, Nyears=Nyears,
+                                                verbose=verbose,
+                                                effective_variance_invcov=effective_variance_invcov,
+                                                sub_bands_cov=sub_bands_cov)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        seeds = seed.spawn(nreal)
+        params = (self.nside, seenpix, thnoise, clnoise, _sub_bands_eig(sub_bands_cov, nsub))
+
+        def expand(maps):
+            noise_maps = np.zeros((nsub, len(coverage), 3))
+            noise_maps[:, seenpix, :] = maps
+            if nsub == 1:
+                return noise_maps[0, :, :]
+            else:
+                return noise_maps
+
+        if processes is None:
+            processes = min(nreal, mp.cpu_count())
+        if verbose:
+            print('Simulating {} noise realizations with {} processes'.format(nreal, processes))
+        if processes <= 1:
+            _init_noise_worker(params)
+            for k in range(nreal):
+                yield expand(_noise_worker(seeds[k]))
+            return
+        with mp.Pool(processes, initializer=_init_noise_worker, initargs=(params,)) as pool:
+            pending = deque()
+            for k in range(nreal):
+                pending.append(pool.apply_async(_noise_worker, (seeds[k],)))
+                if len(pending) == 2 * processes:
+                    yield expand(pending.popleft().get())
+            while pending:
+                yield expand(pending.popleft().get())
+
+    def _noise_rms_maps(self, sigma_sec, coverage, covcut=0.1, nsub=1, Nyears=4, verbose=False,
+                        effective_variance_invcov=None, sub_bands_cov=None):
+        """
+        Return the seen pixels and the (nsub, npix, 3) RMS of the I, Q and U noise in each pixel, for the
+        arguments of create_noise_maps().
+
         """
         # Seen pixels
         seenpix = (coverage / np.max(coverage)) > covcut
-        npix = seenpix.sum()
 
         # Sigma_sec for each Stokes: by default they are the same unless there is non trivial covariance
         if sub_bands_cov is None:
@@ -602,69 +689,7 @@ class Qubic_sky(sky):
                     thnoiseQ[isub, seenpix] = ideal_noise_Q[seenpix] * np.sqrt(correctionQU)
                     thnoiseU[isub, seenpix] = ideal_noise_U[seenpix] * np.sqrt(correctionQU)
 
-        noise_maps = np.zeros((nsub, len(coverage), 3))
-        if seed is not None:
-            np.random.seed(seed)
-
-        ### Simulate variance 1 maps for each sub-band independently
-        for isub in range(nsub):
-            if clnoise is None:
-                ### With no sspatial correlation
-                if verbose:
-                    if isub == 0:
-                        print('Simulating noise maps with no spatial correlation')
-                IrndFull = np.random.randn(self.npix)
-                QrndFull = np.random.randn(self.npix) * np.sqrt(2)
-                UrndFull = np.random.randn(self.npix) * np.sqrt(2)
-            else:
-                ### With spatial correlations given by cl which is the Legendre transform of the targetted C(theta)
-                ### NB: here one should not expect the variance of the obtained maps to make complete sense because
-                ### of ell space truncation. They have however the correct Cl spectrum in the relevant ell range 
-                ### (up to lmax = 2*nside)
-                if verbose:
-                    if isub == 0:
-                        print('Simulating noise maps with spatial correlation')
-                IrndFull = qc.simulate_correlated_map(self.nside, 1., clin=clnoise, verbose=False)
-                QrndFull = qc.simulate_correlated_map(self.nside, 1., clin=clnoise, verbose=False) * np.sqrt(2)
-                UrndFull = qc.simulate_correlated_map(self.nside, 1., clin=clnoise, verbose=False) * np.sqrt(2)
-            ### put them into the whole sub-bandss array
-            noise_maps[isub, seenpix, 0] = IrndFull[seenpix]
-            noise_maps[isub, seenpix, 1] = QrndFull[seenpix]
-            noise_maps[isub, seenpix, 2] = UrndFull[seenpix]
-
-        ### If there is non-diagonal noise covariance between sub-bands (spectro-imaging case)
-        if nsub > 1:
-            if sub_bands_cov is not None:
-                if verbose:
-                    print('Simulating noise maps sub-bands covariance')
-                ### We get the eigenvalues and eigenvectors of the sub-band covariance matrix divided by its 0,0 element
-                ### The reason for this si that the overall  noise is given by the input parameter sigma_sec which we do not
-                ### want to override
-
-                wI, vI = np.linalg.eig(sub_bands_cov[0] / sub_bands_cov[0][0, 0])
-                wQ, vQ = np.linalg.eig(sub_bands_cov[1] / sub_bands_cov[1][0, 0])
-                wU, vU = np.linalg.eig(sub_bands_cov[2] / sub_bands_cov[2][0, 0])
-
-                ### Multiply the maps by the sqrt(eigenvalues)
-                for isub in range(nsub):
-                    noise_maps[isub, seenpix, 0] *= np.sqrt(wI[isub])
-                    noise_maps[isub, seenpix, 1] *= np.sqrt(wQ[isub])
-                    noise_maps[isub, seenpix, 2] *= np.sqrt(wU[isub])
-                ### Apply the rotation to each Stokes Parameter separately
-
-                noise_maps[:, seenpix, 0] = np.dot(vI, noise_maps[:, seenpix, 0])
-                noise_maps[:, seenpix, 1] = np.dot(vQ, noise_maps[:, seenpix, 1])
-                noise_maps[:, seenpix, 2] = np.dot(vU, noise_maps[:, seenpix, 2])
-
-        # Now normalize the maps with the coverage behaviour and the sqrt(2) for Q and U
-        noise_maps[:, seenpix, 0] *= thnoiseI[:, seenpix]
-        noise_maps[:, seenpix, 1] *= thnoiseQ[:, seenpix]
-        noise_maps[:, seenpix, 2] *= thnoiseU[:, seenpix]
-
-        if nsub == 1:
-            return noise_maps[0, :, :]
-        else:
-            return noise_maps
+        return seenpix, np.stack([thnoiseI, thnoiseQ, thnoiseU], axis=-1)
 
     def theoretical_noise_maps(self, sigma_sec, coverage, Nyears=4, verbose=False):
         """
@@ -892,28 +917,8 @@ def map_corr_neighbtheta(themap_in, ipok_in, thetamin, thetamax, nbins, degrade=
     rthmin = np.radians(thetamin)
     rthmax = np.radians(thetamax)
     thvals = np.linspace(rthmin, rthmax, nbins + 1)
-    ns = hp.npix2nside(len(themap))
-    thesum = np.zeros(nbins)
-    thesum2 = np.zeros(nbins)
-    thecount = np.zeros(nbins)
-    if verbose: bar = progress_bar(len(ipok), 'Pixels')
-    for i in range(len(ipok)):
-        if verbose: bar.update()
-        valthis = themap[ipok[i]]
-        v = hp.pix2vec(ns, ipok[i])
-        # ipneighb_inner = []
-        ipneighb_inner = list(hp.query_disc(ns, v, np.radians(thetamin)))
-        for k in range(nbins):
-            thmin = thvals[k]
-            thmax = thvals[k + 1]
-            ipneighb_outer = list(hp.query_disc(ns, v, thmax))
-            ipneighb = ipneighb_outer.copy()
-            for l in ipneighb_inner: ipneighb.remove(l)
-            valneighb = themap[ipneighb]
-            thesum[k] += np.sum(valthis * valneighb)
-            thesum2[k] += np.sum((valthis * valneighb) ** 2)
-            thecount[k] += len(valneighb)
-            ipneighb_inner = ipneighb_outer.copy()
+    if verbose: print('Counting the pairs of {} pixels in {} bins'.format(len(ipok), nbins))
+    thesum, thesum2, thecount = _pair_sums(themap, ipok, thvals)
 
     mm = thesum / thecount
     mm2 = thesum2 / thecount
@@ -1000,3 +1005,102 @@ def get_cov_nunu(maps, coverage, nbins=20, QUsep=True, return_flat_maps=False):
         return cov_I, cov_Q, cov_U, all_fitcov, all_norm_noise, new_sub_maps
     else:
         return cov_I, cov_Q, cov_U, all_fitcov, all_norm_noise
+
+
+def _pair_sums(themap, ipok, thvals):
+    """
+    Return the sums over the pairs of pixels (ipok[i], j) of the products of their values,
+    of the squares of these products and the numbers of pairs, for the angular separations
+    in the bins ]thvals[k], thvals[k+1]] (radians). As with hp.query_disc, j runs over all the
+    pixels of the map and a pixel is paired with itself only in a bin starting at 0.
+
+    The pairs are counted with a dual KD-tree over the pixel unit vectors and cumulative
+    separations, in one pass per sum instead of a disc query per pixel and per bin.
+    """
+    ns = hp.npix2nside(len(themap))
+    vecs = np.array(hp.pix2vec(ns, np.arange(len(themap)))).T
+    tree_ok = cKDTree(vecs[ipok])
+    ### Chord lengths of the bin edges
+    radii = 2 * np.sin(thvals / 2)
+    ### The null pixels only contribute to the numbers of pairs
+    nonzero = themap != 0
+    tree_nonzero = cKDTree(vecs[nonzero])
+    values = themap[ipok], themap[nonzero]
+    out = []
+    for tree, weights in ((tree_nonzero, values),
+                          (tree_nonzero, (values[0] ** 2, values[1] ** 2)),
+                          (cKDTree(vecs), None)):
+        cumsum = np.asarray(tree_ok.count_neighbors(tree, radii, weights=weights, cumulative=True), dtype=float)
+        if thvals[0] <= 0:
+            cumsum[0] = 0
+        out.append(np.diff(cumsum))
+    return out
+
+
+def _sub_bands_eig(sub_bands_cov, nsub):
+    """
+    Return the eigenvalues and eigenvectors of the I, Q and U sub-band covariance matrices, divided by their
+    0,0 element, or None if there is no covariance between sub-bands.
+    """
+    if nsub == 1 or sub_bands_cov is None:
+        return None
+    ### The reason for the normalization is that the overall noise is given by the input parameter sigma_sec
+    ### which we do not want to override
+    return [np.linalg.eig(cov / cov[0, 0]) for cov in sub_bands_cov]
+
+
+def _simulate_noise_maps(seed, nside, seenpix, thnoise, clnoise=None, sub_bands_eig=None):
+    """
+    Return a (nsub, npix, 3) realization of the I, Q and U noise maps of RMS thnoise in the seen pixels, drawn
+    from np.random.default_rng(seed). The maps of all the sub-bands and Stokes parameters are synthesized
+    together: as white noise, or through a single spherical harmonic transform of alms with spectrum clnoise.
+    """
+    rng = np.random.default_rng(seed)
+    nsub = len(thnoise)
+    npix = 12 * nside ** 2
+    if clnoise is None:
+        ### With no spatial correlation
+        rnd = rng.standard_normal((nsub, 3, npix))
+    else:
+        ### With spatial correlations given by cl which is the Legendre transform of the targetted C(theta)
+        ### NB: here one should not expect the variance of the obtained maps to make complete sense because
+        ### of ell space truncation. They have however the correct Cl spectrum in the relevant ell range
+        ### (up to lmax = 2*nside). Same normalization as qc.simulate_correlated_map(nside, 1., clin=clnoise)
+        lmax = 2 * nside
+        ell, m = hp.Alm.getlm(lmax)
+        cl = clnoise[0:lmax + 1] / clnoise[0]
+        sigma = np.sqrt(np.where(m == 0, 1., 0.5) * cl[ell])
+        alms = rng.standard_normal((nsub * 3, len(ell))) + 1j * rng.standard_normal((nsub * 3, len(ell)))
+        alms.imag[:, m == 0] = 0
+        alms *= sigma
+        rnd = hp.alm2map(alms, nside, lmax=lmax, pol=False) * np.sqrt(4 * np.pi / npix)
+        rnd = np.reshape(rnd, (nsub, 3, npix))
+    ### Variance 1 maps for I and 2 for Q and U
+    noise_maps = rnd[:, :, seenpix].transpose(0, 2, 1)
+    noise_maps[:, :, 1:] *= np.sqrt(2)
+
+    ### If there is non-diagonal noise covariance between sub-bands (spectro-imaging case)
+    if sub_bands_eig is not None:
+        for istokes, (w, v) in enumerate(sub_bands_eig):
+            ### Multiply the maps by the sqrt(eigenvalues) and apply the rotation to each Stokes Parameter
+            noise_maps[:, :, istokes] = np.dot(v, noise_maps[:, :, istokes] * np.sqrt(w)[:, None])
+
+    # Now normalize the maps with the coverage behaviour and the sqrt(2) for Q and U
+    noise_maps *= thnoise[:, seenpix, :]
+    out = np.zeros((nsub, npix, 3))
+    out[:, seenpix, :] = noise_maps
+    return out
+
+
+_noise_params = None
+
+
+def _init_noise_worker(params):
+    global _noise_params
+    _noise_params = params
+
+
+def _noise_worker(seed):
+    nside, seenpix, thnoise, clnoise, sub_bands_eig = _noise_params
+    maps = _simulate_noise_maps(seed, nside, seenpix, thnoise, clnoise=clnoise, sub_bands_eig=sub_bands_eig)
+    return maps[:, seenpix, :]
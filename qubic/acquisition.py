@@ -1,25 +1,45 @@
 # coding: utf-8
 from __future__ import division, print_function
 
+import copy
 import healpy as hp
 import numpy as np
+import os
+import pickle
+from collections import OrderedDict
 from pyoperators import (
     BlockColumnOperator, BlockDiagonalOperator, BlockRowOperator,
     CompositionOperator, DiagonalOperator, I, IdentityOperator,
-    MPIDistributionIdentityOperator, MPI, proxy_group, ReshapeOperator,
-    rule_manager, pcg)
+    MPIDistributionIdentityOperator, MPI, Operator, ReshapeOperator,
+    SymmetricBandToeplitzOperator, asoperator, rule_manager)
+from pyoperators.utils import split
 from pyoperators.utils.mpi import as_mpi
 from pysimulators import Acquisition, FitsArray
+from pysimulators.noises import (
+    _fold_psd, _gaussian_psd_1f, _logloginterp_psd, _psd2invntt, _unfold_psd)
+from scipy.optimize import nnls
+from scipy.signal import lfilter
 from pysimulators.interfaces.healpy import (
     HealpixConvolutionGaussianOperator)
 from .data import PATH
 from .calibration import QubicCalibration
 from .samplings import create_random_pointings
+from .utils import _atomic_write, _digest
+from .mapmaking import pcg_checkpoint
 
 __all__ = ['PlanckAcquisition',
            'QubicAcquisition',
            'QubicPlanckAcquisition']
 
+INVNTT_CACHE_SIZE = 8
+# default number of TOD elements (detectors x time samples) per chunk of the
+# streamed observations
+OBSERVATION_CHUNK_SIZE = 2**20
+# number of peak sampling matrix elements (detectors x time samples x peaks)
+# per time chunk when the block-Jacobi preconditioner is assembled
+PRECONDITIONER_CHUNK_SIZE = 2**22
+_INVNTT_CACHE = OrderedDict()
+_FFTW_WISDOM_LOADED = set()
 
 
 class QubicAcquisition(Acquisition):
@@ -51,7 +71,9 @@ class QubicAcquisition(Acquisition):
                 If true, the photon noise contribution is included.
             max_nbytes : int or None, optional
                 Maximum number of bytes to be allocated for the acquisition's
-                operator.
+                operator. If the peak sampling matrix is larger, it is not
+                stored but computed on the fly, by time chunks of at most
+                this size.
             nprocs_instrument : int, optional
                 For a given sampling slice, number of procs dedicated to
                 the instrument.
@@ -73,6 +95,10 @@ class QubicAcquisition(Acquisition):
                 frequencies) or two-sided (positive and negative frequencies).
             sigma : float
                 Standard deviation of the white noise component.
+            fftw_wisdom : string, optional
+                File in which the FFTW wisdom gathered while planning the
+                transforms of the inverse noise operator is kept, so that it
+                is reused by the other processes and runs.
         """
         block = d['block']
         effective_duration = d['effective_duration']
@@ -88,8 +114,9 @@ class QubicAcquisition(Acquisition):
 
         Acquisition.__init__(
             self, instrument, sampling, scene, block=block,
-            max_nbytes=max_nbytes, nprocs_instrument=nprocs_instrument,
+            max_nbytes=None, nprocs_instrument=nprocs_instrument,
             nprocs_sampling=nprocs_sampling, comm=comm)
+        self.max_nbytes = max_nbytes
         self.photon_noise = bool(photon_noise)
         self.effective_duration = effective_duration
         self.bandwidth = bandwidth
@@ -97,6 +124,7 @@ class QubicAcquisition(Acquisition):
         self.twosided = twosided
         self.sigma = sigma
         self.forced_sigma = None
+        self.fftw_wisdom = d.get('fftw_wisdom')
 
     def get_coverage(self):
         """
@@ -274,26 +302,44 @@ class QubicAcquisition(Acquisition):
         if self.bandwidth is None and self.psd is None and self.sigma is None:
             raise ValueError('The noise model is not specified.')
 
+        sigma = self.sigma
+        if self.forced_sigma is not None:
+            self.sigma = self.forced_sigma.copy()
+
+        shapein = (len(self.instrument), len(self.sampling))
+        detector = self.instrument.detector
+        if self.effective_duration is not None:
+            nsamplings = self.sampling.comm.allreduce(len(self.sampling))
+            scale = nsamplings * self.sampling.period / (self.effective_duration * 31557600)
+        else:
+            scale = None
+
+        # the operators are memoized, since the acquisitions of a multiband
+        # instrument and the outer loops of the map-makers request the same
+        # operator many times
+        key = _digest(
+            shapein, self.sampling.period, self.sigma, detector.fknee,
+            detector.fslope, detector.ncorr, self.bandwidth, self.psd,
+            self.twosided, scale, fftw_flag)
+        if key in _INVNTT_CACHE:
+            _INVNTT_CACHE.move_to_end(key)
+            return _INVNTT_CACHE[key]
 
         print('In acquisition.py: self.forced_sigma={}'.format(self.forced_sigma))
-        print('and self.sigma is:{}'.format(self.sigma))
+        print('and self.sigma is:{}'.format(sigma))
         if self.forced_sigma is None:
             print('Using theoretical TES noises')
         else:
             print('Using self.forced_sigma as TES noises')
-            self.sigma = self.forced_sigma.copy()
 
-        shapein = (len(self.instrument), len(self.sampling))
-
-        if self.bandwidth is None and self.instrument.detector.fknee == 0:
+        if self.bandwidth is None and detector.fknee == 0:
             print('diagonal case')
 
             out = DiagonalOperator(1 / self.sigma ** 2, broadcast='rightward',
-                                   shapein=(len(self.instrument), len(self.sampling)))
-            if self.effective_duration is not None:
-                nsamplings = self.sampling.comm.allreduce(len(self.sampling))
-                out /= (nsamplings * self.sampling.period / (self.effective_duration * 31557600))
-            return out
+                                   shapein=shapein)
+            if scale is not None:
+                out /= scale
+            return _cache_invntt_operator(key, out)
 
         sampling_frequency = 1 / self.sampling.period
 
@@ -304,22 +350,26 @@ class QubicAcquisition(Acquisition):
 
         new_bandwidth = sampling_frequency / fftsize
         if self.bandwidth is not None and self.psd is not None:
+            psd = self.psd
             if self.twosided:
-                self.psd = _fold_psd(self.psd)
+                psd = _fold_psd(psd)
             f = np.arange(fftsize // 2 + 1, dtype=float) * new_bandwidth
-            p = _unfold_psd(_logloginterp_psd(f, self.bandwidth, self.psd))
+            p = _unfold_psd(_logloginterp_psd(f, self.bandwidth, psd))
         else:
-            p = _gaussian_psd_1f(fftsize, sampling_frequency, self.sigma, self.instrument.detector.fknee,
-                                 self.instrument.detector.fslope, twosided=True)
+            p = _gaussian_psd_1f(fftsize, sampling_frequency, self.sigma, detector.fknee,
+                                 detector.fslope, twosided=True)
         p[..., 0] = p[..., 1]
-        invntt = _psd2invntt(p, new_bandwidth, self.instrument.detector.ncorr, fftw_flag=fftw_flag)
+        wisdom = _load_fftw_wisdom(self.fftw_wisdom)
+        invntt = _psd2invntt(p, new_bandwidth, detector.ncorr, fftw_flag=fftw_flag)
 
         print('non diagonal case')
-        if self.effective_duration is not None:
-            nsamplings = self.sampling.comm.allreduce(len(self.sampling))
-            invntt /= (nsamplings * self.sampling.period / (self.effective_duration * 31557600))
+        if scale is not None:
+            invntt /= scale
 
-        return SymmetricBandToeplitzOperator(shapein, invntt, fftw_flag=fftw_flag, nthreads=nthreads)
+        out = SymmetricBandToeplitzOperator(shapein, invntt, fftw_flag=fftw_flag, nthreads=nthreads)
+        if self.comm.rank == 0:
+            _save_fftw_wisdom(self.fftw_wisdom, wisdom)
+        return _cache_invntt_operator(key, out)
 
     get_invntt_operator.__doc__ = Acquisition.get_invntt_operator.__doc__
 
@@ -338,17 +388,24 @@ class QubicAcquisition(Acquisition):
         nu = self.instrument.filter.nu
         return self.scene.get_unit_conversion_operator(nu)
 
-    def get_operator(self):
+    def get_operator(self, projection=None):
         """
         Return the operator of the acquisition. Note that the operator is only
         linear if the scene temperature is differential (absolute=False).
 
+        Parameters
+        ----------
+        projection : Operator, optional
+            The peak sampling operator, if it has already been computed
+            (for instance by QubicPolyAcquisition.get_projection_operators).
+
         """
         distribution = self.get_distribution_operator()
         temp = self.get_unit_conversion_operator()
         aperture = self.get_aperture_integration_operator()
         filter = self.get_filter_operator()
-        projection = self.get_projection_operator()
+        if projection is None:
+            projection = self.get_projection_operator()
         hwp = self.get_hwp_operator()
         polarizer = self.get_polarizer_operator()
         integ = self.get_detector_integration_operator()
@@ -385,20 +442,9 @@ class QubicAcquisition(Acquisition):
 
         """
         f = self.instrument.get_projection_operator
-        if len(self.block) == 1:
-            return BlockColumnOperator(
-                [f(self.sampling[b], self.scene, verbose=verbose)
-                 for b in self.block], axisout=1)
-
-        # XXX HACK
-        def callback(i):
-            p = f(self.sampling[self.block[i]], self.scene, verbose=False)
-            return p
-
-        shapeouts = [(len(self.instrument), s.stop - s.start) +
-                     self.scene.shape[1:] for s in self.block]
-        proxies = proxy_group(len(self.block), callback, shapeouts=shapeouts)
-        return BlockColumnOperator(proxies, axisout=1)
+        return BlockColumnOperator(
+            [f(self.sampling[b], self.scene, verbose=verbose,
+               max_nbytes=self.max_nbytes) for b in self.block], axisout=1)
 
     def get_add_grids_operator(self):
         """ Return operator to add signal from detector pairs. """
@@ -454,9 +500,133 @@ class QubicAcquisition(Acquisition):
 
         return tod
 
-    def tod2map(self, tod, d, cov=None):
+    def get_observation_chunks(self, map, nsamples=None, convolution=False,
+                               noiseless=False, seed=None,
+                               return_operator=False):
+        """
+        Generate the observation by time chunks, so that the full TOD of
+        shape (ndetectors, ntimes) is never allocated. The chunks can be
+        written to disk as they come, or accumulated through the transposed
+        acquisition operator (see mapmaking.tod2map_stream).
+
+        for chunk, tod in acquisition.get_observation_chunks(map):
+            ...
+
+        The noise follows the same model as get_noise, its 1/f component
+        being continuous across the chunk boundaries.
+
+        Parameters
+        ----------
+        map : I, QU or IQU maps
+            Temperature, QU or IQU maps of shapes npix, (npix, 2), (npix, 3)
+            with npix = 12 * nside**2
+        nsamples : int, optional
+            The number of time samples of the chunks. By default, a chunk
+            has about OBSERVATION_CHUNK_SIZE TOD elements.
+        convolution : boolean, optional
+            If True, the input map is first convolved by the gaussian kernel
+            approximating the synthetic beam.
+        noiseless : boolean, optional
+            If True, no noise is added to the observation.
+        seed : int or np.random.SeedSequence, optional
+            The seed of the noise realization, which does not depend on the
+            chunk length.
+        return_operator : boolean, optional
+            If True, the acquisition operator of each chunk is also yielded.
+
+        Yields
+        ------
+        chunk : slice
+            The time samples of the chunk.
+        tod : array
+            The Time-Ordered-Data of the chunk, of shape
+            (ndetectors, nsamples).
+        operator : Operator
+            The acquisition operator of the chunk, if return_operator is set.
+
+        """
+        if convolution:
+            map = self.get_convolution_peak_operator()(map)
+        noise = None if noiseless else self._get_noise_stream(seed)
+        for chunk in self._get_time_chunks(nsamples):
+            H = self._get_chunk_acquisition(chunk).get_operator()
+            tod = H(map)
+            if noise is not None:
+                tod += noise(chunk.stop - chunk.start)
+            if return_operator:
+                yield chunk, tod, H
+            else:
+                yield chunk, tod
+
+    def get_noise_chunks(self, nsamples=None, seed=None):
+        """
+        Generate the noise by time chunks, with the model of get_noise and a
+        1/f component continuous across the chunk boundaries.
+
+        Yields
+        ------
+        chunk : slice
+            The time samples of the chunk.
+        noise : array
+            The noise of the chunk, of shape (ndetectors, nsamples).
+
+        """
+        noise = self._get_noise_stream(seed)
+        for chunk in self._get_time_chunks(nsamples):
+            yield chunk, noise(chunk.stop - chunk.start)
+
+    def _get_time_chunks(self, nsamples=None):
+        """
+        Return the slices partitioning the time samples in chunks of
+        nsamples.
+
+        """
+        ntimes = len(self.sampling)
+        if nsamples is None:
+            nsamples = max(OBSERVATION_CHUNK_SIZE // len(self.instrument), 1)
+        return [slice(start, min(start + nsamples, ntimes))
+                for start in range(0, ntimes, nsamples)]
+
+    def _get_chunk_acquisition(self, chunk):
+        """
+        Return the acquisition restricted to a chunk of time samples. Unlike
+        acq[:, chunk], the sampling partition and the communicator are those
+        of a single block of the current process.
+
+        """
+        out = copy.copy(self)
+        out.sampling = self.sampling[chunk]
+        out.block = (slice(0, chunk.stop - chunk.start),)
+        return out
+
+    def _get_noise_stream(self, seed=None):
+        """
+        Return the generator of the noise by time chunks.
+
+        """
+        detector = self.instrument.detector
+        period = self.sampling.period
+        sigma_1f = detector.nep / np.sqrt(2 * period)
+        sigma = sigma_1f
+        if self.photon_noise:
+            sigma_photon = self.instrument._get_noise_photon_nep(self.scene) / np.sqrt(2 * period)
+            sigma = np.sqrt(sigma ** 2 + sigma_photon ** 2)
+        if self.effective_duration is not None:
+            nsamplings = self.sampling.comm.allreduce(len(self.sampling))
+            scale = np.sqrt(nsamplings * period /
+                            (self.effective_duration * 31557600))
+            sigma = sigma * scale
+            sigma_1f = sigma_1f * scale
+        return _NoiseStream(len(self.instrument), period, len(self.sampling),
+                            sigma, sigma_1f=sigma_1f, fknee=detector.fknee,
+                            fslope=detector.fslope, seed=seed)
+
+    def tod2map(self, tod, d, cov=None, x0=None):
         """
-        Reconstruct map from tod
+        Reconstruct map from tod. The PCG state is saved every
+        d['checkpoint_every'] iterations in the file d['checkpoint'], if it
+        is specified, from which an interrupted run is resumed. The solver
+        can be warm-started from the map x0 of a previous run.
         """
         tol = d['tol']
         maxiter = d['maxiter']
@@ -468,8 +638,14 @@ class QubicAcquisition(Acquisition):
         A = H.T * invntt * H
         b = H.T * invntt * tod
 
-        preconditioner = self.get_preconditioner(cov)
-        solution = pcg(A, b, M=preconditioner, disp=verbose, tol=tol, maxiter=maxiter)
+        if d.get('preconditioner') == 'block_jacobi':
+            preconditioner = self.get_block_jacobi_preconditioner(invntt)
+        else:
+            preconditioner = self.get_preconditioner(cov)
+        solution = pcg_checkpoint(
+            A, b, x0=x0, M=preconditioner, disp=verbose, tol=tol,
+            maxiter=maxiter, checkpoint=d.get('checkpoint'),
+            checkpoint_every=d.get('checkpoint_every', 10))
         return solution['x'], solution['nit'], solution['error']
 
     def get_preconditioner(self, cov):
@@ -481,6 +657,80 @@ class QubicAcquisition(Acquisition):
             preconditioner = None
         return preconditioner
 
+    def get_block_jacobi_preconditioner(self, invntt=None):
+        """
+        Return the block-Jacobi preconditioner of the map-making equation
+        H.T N^-1 H x = H.T N^-1 y: for each pixel, the inverse of the block
+        of H.T N^-1 H coupling its Stokes parameters. The blocks are
+        assembled in a single pass over the peak sampling matrix, N^-1 being
+        approximated by its diagonal.
+
+        Parameters
+        ----------
+        invntt : Operator, optional
+            The inverse time-time noise correlation operator. If it is not
+            diagonal, the white noise level of the detectors is used.
+
+        """
+        return _get_block_jacobi_preconditioner(
+            self.scene, [self._get_preconditioner_term(invntt)],
+            comm=self.comm)
+
+    def _get_preconditioner_term(self, invntt=None, projection=None,
+                                 weight=1, slot=0):
+        """
+        Return the factors of the acquisition operator H = G * P * R used by
+        the block-Jacobi preconditioner: the Stokes gains of the samples
+        through G, scaled by the square root of the noise weights, the peak
+        sampling operator P, the pixel gains through R and the index of the
+        map seen by the acquisition.
+
+        """
+        if projection is None:
+            projection = self.get_projection_operator(verbose=False)
+        G = [self.get_hwp_operator(), self.get_polarizer_operator(),
+             self.get_detector_integration_operator(),
+             self.instrument.get_transmission_operator(),
+             self.get_detector_response_operator()]
+        R = [self.get_distribution_operator(),
+             self.get_unit_conversion_operator(),
+             self.scene.atmosphere.transmission,
+             self.get_aperture_integration_operator(),
+             self.get_filter_operator()]
+
+        def apply(operators, x):
+            for op in operators:
+                x = asoperator(op)(x)
+            return x
+
+        shape = projection.shapeout
+        if self.scene.kind == 'I':
+            gain = apply(G, np.ones(shape))[..., None]
+        else:
+            gain = np.empty(shape)
+            for i in range(shape[-1]):
+                e = np.zeros(shape)
+                e[..., i] = 1
+                gain[..., i] = apply(G, e)
+
+        if isinstance(invntt, DiagonalOperator):
+            noise_weight = np.asarray(invntt.data, float)
+            if invntt.broadcast == 'rightward':
+                noise_weight = noise_weight.reshape(
+                    noise_weight.shape + (2 - noise_weight.ndim) * (1,))
+        elif self.sigma is not None:
+            noise_weight = np.asarray(1 / self.sigma**2, float)
+            noise_weight = noise_weight.reshape(
+                noise_weight.shape + (2 - noise_weight.ndim) * (1,))
+        else:
+            noise_weight = np.ones((1, 1))
+        gain *= weight * np.sqrt(noise_weight)[..., None]
+
+        pixel_gain = apply(R, np.ones((len(self.scene),) +
+                                      self.scene.shape[1:]))
+        pixel_gain = pixel_gain.reshape((len(self.scene), -1))
+        return gain, projection, pixel_gain, slot
+
 
 class PlanckAcquisition(object):
     def __init__(self, band, scene, true_sky=None, factor=1, fwhm=0, mask=None, convolution_operator=None):
@@ -653,3 +903,300 @@ class QubicPlanckAcquisition(object):
         if convolution:
             return obs, obs_qubic_[1]
         return obs
+
+
+def _get_block_jacobi_preconditioner(scene, terms, nslots=1, comm=None,
+                                     rcond=1e-6):
+    """
+    Return the block-Jacobi preconditioner of the map-making equation of an
+    acquisition that is the sum of terms G * P * R, each of them seeing one
+    of nslots maps. The blocks couple the Stokes parameters of the nslots
+    maps at a given pixel, and their pseudo-inverses are computed with the
+    relative cutoff rcond, so that unconstrained pixels are left untouched.
+
+    Parameters
+    ----------
+    scene : QubicScene
+        The observed scene.
+    terms : list of 4-tuples
+        The factors of the terms, as returned by
+        QubicAcquisition._get_preconditioner_term.
+    nslots : int, optional
+        The number of maps. If it is greater than one, the preconditioner
+        input has the shape (nslots,) + scene.shape.
+    comm : mpi4py.MPI.Comm, optional
+        The communicator over which the samplings are distributed.
+    rcond : float, optional
+        Cutoff for small singular values of the blocks.
+
+    """
+    npixel = len(scene)
+    ndims = len(scene.kind)
+    n = nslots * ndims
+    blocks = np.zeros((npixel, n, n))
+    ndetectors, ntimes = terms[0][1].shapeout[:2]
+    ncolmax = max(_get_projection_data(P, slice(0, 1)).shape[-1]
+                  for _, P, _, _ in terms)
+    ntimes_chunk = max(PRECONDITIONER_CHUNK_SIZE //
+                       (ndetectors * ncolmax * len(terms)), 1)
+    projection = terms[0][1]
+    if isinstance(projection, BlockColumnOperator):
+        partition = projection.partitionout[1]
+    else:
+        partition = (ntimes,)
+    chunks = []
+    start = 0
+    for nblock in partition:
+        chunks += [slice(start + s.start, start + s.stop) for s in
+                   split(nblock, int(np.ceil(nblock / ntimes_chunk)))]
+        start += nblock
+
+    for chunk in chunks:
+        # the peaks of the terms falling in the same pixel for a given
+        # sample are merged before the outer products are accumulated
+        keys = []
+        values = []
+        for gain, P, pixel_gain, slot in terms:
+            data = _get_projection_data(P, chunk)
+            gain = gain[:, chunk]
+            if ndims == 1:
+                value = (gain[..., 0, None] * data['value'])[..., None]
+            elif ndims == 2:
+                g0, g1 = [gain[..., i, None] for i in range(2)]
+                value = np.array([
+                    g0 * data['r11'] + g1 * data['r21'],
+                    g1 * data['r11'] - g0 * data['r21']]).transpose(1, 2, 3, 0)
+            else:
+                g0, g1, g2 = [gain[..., i, None] for i in range(3)]
+                value = np.array([
+                    g0 * data['r11'],
+                    g1 * data['r22'] + g2 * data['r32'],
+                    g2 * data['r22'] - g1 * data['r32']]).transpose(1, 2, 3, 0)
+            index = data['index'].astype(np.int64)
+            valid = index >= 0
+            isample = np.arange(index.shape[0] * index.shape[1]).reshape(
+                index.shape[:2] + (1,))
+            keys.append(np.broadcast_to(isample * npixel, index.shape)[valid] +
+                        index[valid])
+            index = index[valid]
+            values.append((slot, value[valid] * pixel_gain[index]))
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        merged = np.zeros((len(keys), n))
+        start = 0
+        for slot, value in values:
+            i = inverse[start:start+len(value)]
+            for c in range(ndims):
+                merged[:, slot * ndims + c] += np.bincount(
+                    i, value[:, c], len(keys))
+            start += len(value)
+        ipixel = keys % npixel
+        for a in range(n):
+            for b in range(a, n):
+                blocks[:, a, b] += np.bincount(
+                    ipixel, merged[:, a] * merged[:, b], npixel)
+
+    if comm is not None and comm.size > 1:
+        comm.Allreduce(MPI.IN_PLACE, as_mpi(blocks), op=MPI.SUM)
+    i, j = np.triu_indices(n, 1)
+    blocks[:, j, i] = blocks[:, i, j]
+    inverse = np.linalg.pinv(blocks, rcond=rcond, hermitian=True)
+
+    shape = (npixel,) + scene.shape[1:]
+    if nslots > 1:
+        shape = (nslots,) + shape
+
+    def direct(input, output):
+        x = input.reshape((nslots, npixel, ndims)).swapaxes(0, 1)
+        y = np.einsum('pab,pb->pa', inverse, x.reshape((npixel, n)))
+        output[...] = y.reshape((npixel, nslots, ndims)).swapaxes(
+            0, 1).reshape(shape)
+
+    return Operator(direct, shapein=shape, shapeout=shape, dtype=float,
+                    flags='linear,symmetric')
+
+
+def _get_projection_data(projection, chunk):
+    """
+    Return the sparse matrix data of a peak sampling operator for a chunk
+    of time samples, as an array of shape (ndetectors, ntimes, ncolmax).
+
+    """
+    if isinstance(projection, BlockColumnOperator):
+        start = 0
+        for P, nblock in zip(projection.operands,
+                             projection.partitionout[1]):
+            if start <= chunk.start and chunk.stop <= start + nblock:
+                return _get_projection_data(
+                    P, slice(chunk.start - start, chunk.stop - start))
+            start += nblock
+        raise ValueError('The time chunk overlaps several sampling blocks.')
+    ndetectors = projection.shapeout[0]
+    if hasattr(projection, 'get_chunk_operator'):
+        data = projection.get_chunk_operator(chunk).matrix.data
+        return data.reshape((ndetectors, chunk.stop - chunk.start, -1))
+    data = projection.matrix.data
+    return data.reshape((ndetectors, projection.shapeout[1], -1))[:, chunk]
+
+
+def _cache_invntt_operator(key, operator):
+    """
+    Store an inverse noise operator in the memoization cache, from which the
+    least recently used operators are evicted.
+
+    """
+    _INVNTT_CACHE[key] = operator
+    while len(_INVNTT_CACHE) > INVNTT_CACHE_SIZE:
+        _INVNTT_CACHE.popitem(last=False)
+    return operator
+
+
+def _load_fftw_wisdom(filename):
+    """
+    Import the FFTW wisdom stored in a file, once per process, and return the
+    wisdom known before planning.
+
+    """
+    import pyfftw
+    if filename is not None and filename not in _FFTW_WISDOM_LOADED and \
+       os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            pyfftw.import_wisdom(pickle.load(f))
+        _FFTW_WISDOM_LOADED.add(filename)
+    return pyfftw.export_wisdom()
+
+
+def _save_fftw_wisdom(filename, wisdom):
+    """
+    Store the FFTW wisdom in a file if it has been enriched since it was
+    loaded.
+
+    """
+    import pyfftw
+    if filename is None:
+        return
+    new_wisdom = pyfftw.export_wisdom()
+    if new_wisdom == wisdom and os.path.exists(filename):
+        return
+
+    def write(tmpname):
+        with open(tmpname, 'wb') as f:
+            pickle.dump(new_wisdom, f)
+    _atomic_write(filename, write)
+    _FFTW_WISDOM_LOADED.add(filename)
+
+
+class _NoiseStream(object):
+    """
+    Generator of a noise timeline by successive time chunks, without
+    materializing the whole timeline. The noise is the sum of a white
+    component of standard deviation sigma and of a 1/f component of power
+    spectrum sigma_1f**2 * (fknee / f)**fslope (relative to that of a white
+    noise of standard deviation sigma_1f). The latter is generated as a sum
+    of first-order autoregressive processes, whose corner frequencies are
+    log-spaced between the inverse duration of the timeline and the Nyquist
+    frequency and whose variances are fitted to the 1/f spectrum (within a
+    few per cent below a fifth of the Nyquist frequency, for slopes up to
+    1.5). The states of these processes are carried from one chunk to the
+    next and the random numbers are drawn in time order, so that the
+    timeline does not depend on the chunk lengths.
+
+    """
+    def __init__(self, ndetectors, period, ntimes, sigma, sigma_1f=0,
+                 fknee=0, fslope=1, seed=None, ncorners_per_decade=3):
+        """
+        Parameters
+        ----------
+        ndetectors : int
+            The number of detectors.
+        period : float
+            The sampling period [s].
+        ntimes : int
+            The total number of time samples, which sets the lowest frequency
+            of the 1/f spectrum.
+        sigma : float or array-like
+            Standard deviation of the white noise component, per detector.
+        sigma_1f : float or array-like, optional
+            Standard deviation of the white noise with respect to which the
+            1/f component is specified.
+        fknee : float or array-like, optional
+            The 1/f noise knee frequency [Hz].
+        fslope : float or array-like, optional
+            The 1/f noise slope.
+        seed : int or np.random.SeedSequence, optional
+            The seed of the noise realization.
+        ncorners_per_decade : int, optional
+            The number of autoregressive processes per decade of frequency.
+
+        """
+        shape = (ndetectors,)
+        fknee = np.broadcast_to(np.asarray(fknee, float), shape)
+        fslope = np.broadcast_to(np.asarray(fslope, float), shape)
+        sigma_1f = np.broadcast_to(np.asarray(sigma_1f, float), shape)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+
+        fmin = 1 / (ntimes * period)
+        fmax = 0.5 / period
+        # the lowest corner frequency is one decade below fmin, to follow
+        # the 1/f spectrum down to the longest time scale of the timeline
+        ncorners = int(np.ceil(ncorners_per_decade *
+                               np.log10(10 * fmax / fmin))) + 1
+        phi = np.exp(-2 * np.pi * period *
+                     np.logspace(np.log10(fmin / 10), np.log10(fmax),
+                                 ncorners))
+        amplitude = np.zeros((ncorners, ndetectors))
+        correlated = (fknee > 0) & (sigma_1f > 0)
+        if np.any(fslope[correlated] >= 2):
+            raise ValueError(
+                'The 1/f noise of slope greater than 2 cannot be generated by'
+                ' time chunks.')
+        for slope in np.unique(fslope[correlated]):
+            weight = _get_ar1_weights(phi, period, slope, fmin, fmax)
+            i = correlated & (fslope == slope)
+            amplitude[:, i] = np.sqrt(weight)[:, None] * \
+                sigma_1f[i] * fknee[i] ** (slope / 2)
+        keep = np.any(amplitude > 0, axis=1)
+
+        self.ndetectors = ndetectors
+        self.sigma = np.array(np.broadcast_to(sigma, shape), float)
+        self.phi = phi[keep]
+        self.amplitude = amplitude[keep]
+        seeds = seed.spawn(1 + len(self.phi))
+        self._white = np.random.default_rng(seeds[0])
+        self._generators = [np.random.default_rng(_) for _ in seeds[1:]]
+        # the processes start in their stationary distribution
+        self.state = np.array([
+            a / np.sqrt(1 - p**2) * g.standard_normal(ndetectors)
+            for p, a, g in zip(self.phi, self.amplitude, self._generators)])
+
+    def __call__(self, n):
+        """
+        Return the next n samples of the noise timeline
+        (ndetectors, n).
+
+        """
+        out = self._white.standard_normal((n, self.ndetectors)).T * \
+            self.sigma[:, None]
+        for p, a, g, state in zip(self.phi, self.amplitude, self._generators,
+                                  self.state):
+            e = g.standard_normal((n, self.ndetectors)).T * a[:, None]
+            y, _ = lfilter([1], [1, -p], e, axis=-1, zi=p * state[:, None])
+            out += y
+            state[...] = y[:, -1]
+        return np.ascontiguousarray(out)
+
+
+def _get_ar1_weights(phi, period, fslope, fmin, fmax, nfrequencies=256):
+    """
+    Return the innovation variances of the first-order autoregressive
+    processes of coefficients phi whose summed spectrum best approximates,
+    in relative terms and between fmin and fmax, that of a 1/f noise of
+    unit knee frequency and of slope fslope.
+
+    """
+    f = np.logspace(np.log10(fmin), np.log10(fmax), nfrequencies)
+    spectra = 1 / (1 - 2 * phi * np.cos(2 * np.pi * f[:, None] * period) +
+                   phi**2)
+    spectra /= f[:, None]**-fslope
+    norm = np.sqrt(np.sum(spectra**2, axis=0))
+    return nnls(spectra / norm, np.ones(nfrequencies))[0] / norm
@@ -20,6 +20,9 @@ import getdist
 from getdist import plots, MCSamples
 
 
+DEMODULATION_CHUNK_SIZE = 2**15
+
+
 def printnow(truc):
     print(truc)
     sys.stdout.flush()
@@ -41,17 +44,9 @@ def read_cal_src_data(file_list, time_offset=7200):
 def bin_per_period(period, time, invec):
     # Bins the vecors in in_list (assumed to be sampled with vector time) per period
     # we label each data sample with a period
-    period_index = ((time - time[0]) / period).astype(int)
-    # We loop on periods to measure their respective amplitude and azimuth
-    allperiods = np.unique(period_index)
-    tper = np.zeros(len(allperiods))
-    nvec = np.shape(invec)[0]
-    nsamples = len(time)
-    newvecs = np.zeros((nvec, len(allperiods)))
-    for i in range(len(allperiods)):
-        ok = (period_index == allperiods[i])
-        tper[i] = np.mean(time[ok])
-        newvecs[:, i] = np.mean(invec[:, ok], axis=1)
+    period_index, counts = _get_period_index(period, time)
+    tper = np.bincount(period_index, weights=time) / counts
+    newvecs = np.array([np.bincount(period_index, weights=v) for v in invec]) / counts
     return tper, newvecs
 
 
@@ -96,28 +91,23 @@ def return_rms_period(period, indata, others=None, verbose=False, remove_noise=F
         nTES = sh[0]
     if verbose: print('return_rms_period: nTES=',nTES)
     # We label each data sample with a period
-    period_index = ((time - time[0]) / period).astype(int)
-    # We loop on periods to measure their respective amplitude and azimuth
-    allperiods = np.unique(period_index)
-    tper = np.zeros(len(allperiods))
-    ampdata = np.zeros((nTES, len(allperiods)))
-    err_ampdata = np.zeros((nTES, len(allperiods)))
+    period_index, counts = _get_period_index(period, time)
+    nperiods = len(counts)
+    tper = np.bincount(period_index, weights=time) / counts
+    err_ampdata = np.ones((nTES, nperiods))
     if others is not None:
         newothers = bin_per_period(period, time, others)
     if verbose:
-        printnow('Calculating RMS per period for {} periods and {} TES'.format(len(allperiods), nTES))
-    for i in range(len(allperiods)):
-        ok = (period_index == allperiods[i])
-        tper[i] = np.mean(time[ok])
-        if nTES == 1:
-            mm, ss = ft.meancut(data[ok], 3)
-            ampdata[0, i] = ss
-            err_ampdata[0, i] = 1
-        else:
-            for j in range(nTES):
-                mm, ss = ft.meancut(data[j, ok], 3)
-                ampdata[j, i] = ss
-                err_ampdata[j, i] = 1
+        printnow('Calculating RMS per period for {} periods and {} TES'.format(nperiods, nTES))
+    # The sigma-clipped RMS is computed for all the periods of a block of TES at once
+    data = np.reshape(data, (nTES, -1))
+    valid, where = _get_period_blocks(period_index, counts)
+    ampdata = np.zeros((nTES, nperiods))
+    nblock = max(1, 2**24 // valid.size)
+    for j in range(0, nTES, nblock):
+        blocks = np.zeros((min(nblock, nTES - j),) + valid.shape)
+        blocks[:, where[0], where[1]] = data[j:j + nblock]
+        ampdata[j:j + nblock] = ft.sigma_clip(blocks, 3, axis=-1, mask=valid)[1]
 
     if remove_noise:
         hf_noise = hf_noise_estimate(time, data)
@@ -187,20 +177,12 @@ def scan2ang_demod(period, indata, lowcut=None, highcut=None, verbose=False):
     # ## Resample to one value per modulation period
     if verbose:
         printnow('Resampling to one value per modulation period')
-    period_index = ((indata['t_data'] - indata['t_data'][0]) / period).astype(int)
-    allperiods = np.unique(period_index)
-    newt = np.zeros(len(allperiods))
-    newaz = np.zeros(len(allperiods))
-    newel = np.zeros(len(allperiods))
-    newsb = np.zeros((nTES, len(allperiods)))
-    newdsb = np.zeros((nTES, len(allperiods)))
-    for i in range(len(allperiods)):
-        ok = period_index == allperiods[i]
-        newt[i] = np.mean(indata['t_data'][ok])
-        newaz[i] = np.mean(azd[ok])
-        newel[i] = np.mean(eld[ok])
-        newsb[:, i] = np.mean(demodulated[:, ok], axis=1)
-        newdsb[:, i] = np.std(demodulated[:, ok], axis=1) / np.sqrt(ok.sum())
+    period_index, counts = _get_period_index(period, indata['t_data'])
+    newt, (newaz, newel) = bin_per_period(period, indata['t_data'], [azd, eld])
+    newsb = np.array([np.bincount(period_index, weights=d) for d in demodulated]) / counts
+    newdsb = np.array([np.bincount(period_index, weights=(d - m[period_index]) ** 2)
+                       for d, m in zip(demodulated, newsb)])
+    newdsb = np.sqrt(newdsb / counts) / np.sqrt(counts)
 
     unbinned = {}
     unbinned['t'] = newt
@@ -387,12 +369,15 @@ def return_fit_period(period, indata, others=None, verbose=False, template=None)
 #     return timereturn, demodulated, demodulated*0+1
 
 def demodulate_JC(period, indata, indata_src, others=None, verbose=False, template=None, quadrature=False,
-                  remove_noise=False, doplot=False):
+                  remove_noise=False, doplot=False, dtype=None, chunk=DEMODULATION_CHUNK_SIZE):
     """
     Proper demodulation with quadrature method as an option: http://web.mit.edu/6.02/www/s2012/handouts/14.pdf
     In the case of quadrature demodulation, the HF noise RMS/sqrt(2) adds to the demodulated.
     The option remove_noise=True
     estimates the HF noise in the TODs and removes it from the estimate in order to attempt to debias.
+    All the TES are demodulated at once, by chunks of chunk time samples, so that the memory footprint
+    only depends on the chunk size. The demodulated TOD have the data type dtype (by default that of the
+    data, e.g. np.float32 to halve the output memory).
     """
     time = indata[0]
     data = indata[1]
@@ -407,34 +392,30 @@ def demodulate_JC(period, indata, indata_src, others=None, verbose=False, templa
         data_src_shift = np.interp(time_src - period / 2, time_src, data_src, period=period)
 
     # ## Now smooth over a period
-    import scipy.signal as scsig
     FREQ_SAMPLING = 1. / (time[1] - time[0])
     size_period = int(FREQ_SAMPLING * period) + 1
-    filter_period = np.ones((size_period,)) / size_period
-    demodulated = np.zeros_like(data)
+    if quadrature:
+        # sqrt((d * s)**2 + (d * s_shift)**2) = |d| * sqrt(s**2 + s_shift**2)
+        envelope = np.sqrt((data_src ** 2 + data_src_shift ** 2) / 2)
+
+        def product(start, stop):
+            return np.abs(data[:, start:stop]) * envelope[start:stop]
+    else:
+        def product(start, stop):
+            return data[:, start:stop] * data_src[start:stop]
     sh = np.shape(data)
-    # bar=progress_bar(sh[0], 'Filtering Detectors: ')
-    for i in range(sh[0]):
-        # bar.update()
-        if quadrature:
-            demodulated[i, :] = scsig.fftconvolve(
-                (np.sqrt((data[i, :] * data_src) ** 2 + (data[i, :] * data_src_shift) ** 2)) / np.sqrt(2),
-                filter_period, mode='same')
-        else:
-            demodulated[i, :] = scsig.fftconvolve(data[i, :] * data_src,
-                                                  filter_period, mode='same')
 
     # Remove First and last periods
     nper = 4.
     nsamples = int(nper * period / (time[1] - time[0]))
     timereturn = time[nsamples:-nsamples]
-    demodulated = demodulated[:, nsamples:-nsamples]
+    first = slice(nsamples, -nsamples).indices(sh[1])[0]
+    demodulated = np.empty((sh[0], len(timereturn)), dtype=data.dtype if dtype is None else dtype)
+    _smooth_period(product, sh[1], size_period, demodulated, first, chunk)
 
     if remove_noise:
         hf_noise = hf_noise_estimate(time, data) / np.sqrt(2)
-        var_diff = np.zeros((sh[0], len(timereturn)))
-        for k in range(sh[0]):
-            var_diff[k, :] = demodulated[k, :] ** 2 - hf_noise[k] ** 2
+        var_diff = demodulated ** 2 - hf_noise[:, None] ** 2
         demodulated = np.sqrt(np.abs(var_diff)) * np.sign(var_diff)
 
     if doplot:
@@ -467,11 +448,13 @@ def demodulate_JC(period, indata, indata_src, others=None, verbose=False, templa
 
 
 def demodulate_methods(data_in, fmod, fourier_cuts=None, verbose=False, src_data_in=None, method='demod',
-                       others=None, template=None, remove_noise=False):
+                       others=None, template=None, remove_noise=False, dtype=None,
+                       chunk=DEMODULATION_CHUNK_SIZE):
     """
     Various demodulation methods
     Others is a list of other vectors (with similar time sampling as the data to demodulate)
     that we need to sample the same way as the data.
+    The arguments dtype and chunk are those of demodulate_JC, for the methods 'demod' and 'demod_quad'.
     ____
     To filter the data before demodulation give the array fourier_cuts = [lowcut, highcut, notch].
     If both lowcut and highcut are given, a bandpass filter is applied.
@@ -511,10 +494,11 @@ def demodulate_methods(data_in, fmod, fourier_cuts=None, verbose=False, src_data
     elif method == 'fit':
         return return_fit_period(period, data, others=others, verbose=verbose, template=template)
     elif method == 'demod':
-        return demodulate_JC(period, data, src_data, others=others, verbose=verbose, template=None)
+        return demodulate_JC(period, data, src_data, others=others, verbose=verbose, template=None,
+                             dtype=dtype, chunk=chunk)
     elif method == 'demod_quad':
         return demodulate_JC(period, data, src_data, others=others, verbose=verbose, template=None,
-                             quadrature=True, remove_noise=remove_noise)
+                             quadrature=True, remove_noise=remove_noise, dtype=dtype, chunk=chunk)
     elif method == 'absolute_value':
         return np.abs(data)
 
@@ -545,13 +529,15 @@ def demodulate_old(indata, fmod, lowcut=None, highcut=None, verbose=False):
             dataf = np.reshape(dataf, (1, len(indata['data'])))
 
         # Make the product for demodulation with changing sign for data
-        product = -dataf * new_src
+        def product(start, stop):
+            return -dataf[:, start:stop] * new_src[start:stop]
+
         # Smooth it over a period
         ppp = 1. / fmod
         FREQ_SAMPLING = 1. / ((np.max(indata['t_data']) - np.min(indata['t_data'])) / len(indata['t_data']))
         size_period = int(FREQ_SAMPLING * ppp) + 1
-        filter_period = np.ones((nTES, size_period,)) / size_period
-        demodulated = scsig.fftconvolve(product, filter_period, mode='same', axes=1)
+        demodulated = np.empty(dataf.shape)
+        _smooth_period(product, dataf.shape[1], size_period, demodulated)
     return demodulated
 
 
@@ -905,21 +891,99 @@ def bin_image_elscans(x, y, data, xr, nx, TESIndex):
 
 
 def scan2hpmap(ns, azdeg, eldeg, data):
-    coadd = np.zeros(12 * ns ** 2)
-    count = np.zeros(12 * ns ** 2)
     ip = hp.ang2pix(ns, np.pi / 2 - np.radians(eldeg), np.radians(azdeg))
-    for i in range(len(azdeg)):
-        coadd[ip[i]] += data[i]
-        count[ip[i]] += 1
+    sbmap, count = bin_map(data, ip, 12 * ns ** 2, unseen_val=0)
     ok = count != 0
-    sbmap = np.zeros(12 * ns ** 2)
-    sbmap[ok] = coadd[ok] / count[ok]
     mm, ss = ft.meancut(sbmap[ok], 3)
     sbmap[ok] -= mm
     sbmap[~ok] = 0
     return sbmap
 
 
+def bin_map(data, pixels, npix, weights=None, countcut=0, unseen_val=hp.UNSEEN,
+            partial=False):
+    """
+    Average the samples of one or several detectors into map pixels.
+
+    The pixels are accumulated with np.bincount on the observed pixels only,
+    so that the cost scales with the number of samples and not with the size
+    of the map.
+
+    Parameters
+    ----------
+    data : array of shape (nsamples,) or (ndetectors, nsamples)
+        The time-ordered data.
+    pixels : integer array of shape (nsamples,)
+        The map pixel of each sample, common to all the detectors. Samples
+        with negative indices or indices greater or equal to npix are dropped.
+    npix : int
+        The number of pixels of the map.
+    weights : array broadcastable to the shape of data, optional
+        The sample weights. The pixel values are the weighted means of their
+        samples.
+    countcut : int, optional
+        The pixels with a hit count lower or equal to countcut are unseen.
+    unseen_val : float, optional
+        The value of the unseen pixels.
+    partial : bool, optional
+        If True, only the seen pixels are returned, together with their
+        indices.
+
+    Returns
+    -------
+    maps : array of shape (npix,) or (ndetectors, npix)
+        The binned maps. If partial is True, the last dimension is that of
+        the seen pixels.
+    count : integer array of shape (npix,)
+        The number of samples in each pixel. If partial is True, only that of
+        the seen pixels.
+    seen : integer array
+        The indices of the seen pixels, only returned if partial is True.
+
+    """
+    data = np.asarray(data, dtype=float)
+    pixels = np.asarray(pixels).ravel()
+    single = data.ndim == 1
+    data = np.atleast_2d(data)
+    if weights is not None:
+        weights = np.broadcast_to(weights, data.shape)
+    inside = (pixels >= 0) & (pixels < npix)
+    if not np.all(inside):
+        pixels = pixels[inside]
+        data = data[:, inside]
+        if weights is not None:
+            weights = weights[:, inside]
+
+    # the pixels are renumbered so that the accumulation arrays only span
+    # the observed part of the sky
+    observed, index = np.unique(pixels, return_inverse=True)
+    nobs = len(observed)
+    count = np.bincount(index, minlength=nobs)
+    ok = count > countcut
+    maps = np.empty((len(data), nobs))
+    for i, d in enumerate(data):
+        if weights is None:
+            maps[i] = np.bincount(index, weights=d, minlength=nobs)
+            maps[i, ok] /= count[ok]
+        else:
+            wsum = np.bincount(index, weights=weights[i], minlength=nobs)
+            maps[i] = np.bincount(index, weights=weights[i] * d,
+                                  minlength=nobs)
+            okw = ok & (wsum != 0)
+            maps[i, okw] /= wsum[okw]
+            maps[i, ok & ~okw] = unseen_val
+    if single:
+        maps = maps[0]
+
+    if partial:
+        return maps[..., ok], count[ok], observed[ok]
+    fullmaps = np.full(maps.shape[:-1] + (npix,), unseen_val)
+    fullmaps[..., observed[ok]] = maps[..., ok]
+    fullcount = np.zeros(npix, int)
+    fullcount[observed] = count
+    return fullmaps, fullcount
+
+
 def make_tod(scans, axis=1):
     tod = scans[0]
     for i in np.arange(len(scans) - 1) + 1:
@@ -1029,10 +1093,7 @@ def get_spectral_response(name, freqs, allmm_in, allss_in, nsig=3, method='demod
     #     ok = (discrim > threshold)
     #     print('Spectral Response calculated over {} TES'.format(ok.sum()))
 
-        filtershape = np.zeros(len(freqs))
-        errfiltershape = np.zeros(len(freqs))
-        for i in range(len(freqs)):
-            filtershape[i], errfiltershape[i] = ft.meancut(allfnorm[:, i], 3, disp=False, med=True)
+        filtershape, errfiltershape = ft.meancut(allfnorm, 3, disp=False, med=True, axis=0)
         # errfiltershape /= np.sqrt(ok.sum())
         # Then remove the smallest value in order to avoid negative values
         filtershape -= np.min(filtershape)
@@ -1646,16 +1707,8 @@ def coadd_flatmap(datain, az, el,
 
     if not silent:
         print('Making maps')
-    mapdata = np.zeros((nTES, nel, naz))
-    mapcount = np.zeros((nTES, nel, naz))
-
-    for i in range(nsamples):
-        mapdata[:, elindex[i], azindex[i]] += data[:, i]
-        mapcount[:, elindex[i], azindex[i]] += 1
-
-    themap = np.zeros((nTES, nel, naz))
-    ok = mapcount != 0
-    themap[ok] = mapdata[ok] / mapcount[ok]
+    themap, _ = bin_map(data, elindex * naz + azindex, nel * naz, unseen_val=0)
+    themap = themap.reshape((nTES, nel, naz))
 
     if remove_eltrend:
         for k in range(nTES):
@@ -1666,3 +1719,54 @@ def coadd_flatmap(datain, az, el,
         return themap[0, :, :], map_az, map_el
     else:
         return themap, map_az, map_el
+
+
+def _get_period_index(period, time):
+    """
+    Label each time sample with the index of its modulation period, among the
+    periods that have samples, and return the number of samples per period.
+    """
+    period_index = ((time - time[0]) / period).astype(int)
+    allperiods, period_index = np.unique(period_index, return_inverse=True)
+    return period_index, np.bincount(period_index)
+
+
+def _get_period_blocks(period_index, counts):
+    """
+    Return the mask of the valid elements of the (nperiods, max(counts))
+    array of the samples ordered by period, and the location of the samples
+    in this array.
+    """
+    order = np.argsort(period_index, kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    valid = np.zeros((len(counts), np.max(counts)), bool)
+    valid[period_index, position] = True
+    return valid, (period_index, position)
+
+
+def _smooth_period(product, nsamples, size, out, first=0, chunk=DEMODULATION_CHUNK_SIZE):
+    """
+    Smooth the TOD returned by product(start, stop), of shape (nTES, stop - start), with a
+    boxcar of size samples, as scipy.signal.fftconvolve(..., mode='same') would do, and store
+    the samples first to first + out.shape[1] in out. The boxcar sums are differences of
+    cumulative sums, which are restarted for each chunk of time samples to bound the
+    memory footprint and the rounding errors.
+    """
+    # offset of the last sample of the window with respect to the output sample
+    offset = (size - 1) // 2
+    nout = out.shape[1]
+    for start in range(0, nout, chunk):
+        stop = min(start + chunk, nout)
+        # the samples outside the TOD are zeros, so that the cumulative sum is
+        # constant there
+        a = first + start + offset + 1 - size
+        b = first + stop + offset
+        lo = max(a, 0)
+        hi = min(b, nsamples)
+        cumsum = np.zeros((len(out), b - a + 1))
+        np.cumsum(product(lo, hi), axis=1, out=cumsum[:, lo - a + 1:hi - a + 1])
+        cumsum[:, hi - a + 1:] = cumsum[:, hi - a:hi - a + 1]
+        block = out[:, start:stop]
+        np.subtract(cumsum[:, size:], cumsum[:, :-size], out=block, casting='unsafe')
+        block /= size
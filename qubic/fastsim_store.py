@@ -0,0 +1,217 @@
+"""
+Store of the FastSimulator inputs: noise profiles, noise C(theta) spectra,
+sub-band covariances and coverages.
+
+The dictionaries computed by scripts/FastSimulator/FastSim_CreateNoiseFiles.py
+are stored as uncompressed .npz files, whose members are memory-mapped one key
+at a time when they are accessed. The opened files are cached, so that the
+Qubic_sky instances of a job share the same data instead of reading the files
+again.
+
+"""
+from __future__ import division, print_function
+
+import os
+import pickle
+import struct
+import zipfile
+
+import numpy as np
+
+from qubic.data import PATH as DATA_PATH
+
+__all__ = ['FastSimData',
+           'convert_fastsim_pickle',
+           'get_fastsim_data',
+           'get_fastsim_filename',
+           'save_fastsim_data']
+
+# name of the member listing the entries which are lists of arrays
+_LISTS_KEY = '__lists__'
+
+_cache = {}
+
+
+class FastSimData(object):
+    """
+    Read-only dictionary of FastSimulator inputs, loaded lazily from a .npz
+    file (or from the pickle of former versions).
+
+    The arrays are memory-mapped, the 0-d arrays are returned as scalars and
+    the entries saved as lists of arrays are returned as lists.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._values = {}
+        self._lists = set()
+        if filename.endswith('.npz'):
+            with zipfile.ZipFile(filename) as zfile:
+                names = [_[:-4] for _ in zfile.namelist()]
+            if _LISTS_KEY in names:
+                names.remove(_LISTS_KEY)
+                self._lists = set(self._read(_LISTS_KEY).tolist())
+            self._keys = names
+        else:
+            with open(filename, 'rb') as f:
+                self._values = pickle.load(f)
+            self._keys = list(self._values.keys())
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._values:
+            value = self._read(key)
+            if key in self._lists:
+                value = list(value)
+            elif value.ndim == 0:
+                value = value.item()
+            self._values[key] = value
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.filename)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self._keys]
+
+    def keys(self):
+        return list(self._keys)
+
+    def _read(self, key):
+        with zipfile.ZipFile(self.filename) as zfile:
+            return _read_npz_member(self.filename, zfile, key + '.npy')
+
+
+def get_fastsim_filename(config, nfsub=None, version='01', directory=None):
+    """
+    Return the name of the file of FastSimulator inputs.
+
+    Parameters
+    ----------
+    config : str
+        The instrument configuration and the frequency, such as 'FI150'.
+    nfsub : int, optional
+        The number of reconstructed sub-bands. If None, the file of the
+        coverage is returned.
+    version : str, optional
+        The version of the FastSimulator files.
+    directory : str, optional
+        The directory of the files. By default, the FastSimulator_version
+        directory of the qubic data.
+
+    Returns
+    -------
+    filename : str
+        The .npz file if it exists, otherwise the .pkl file.
+
+    """
+    if directory is None:
+        directory = os.path.join(DATA_PATH, 'FastSimulator_version' + version)
+    if nfsub is None:
+        name = 'DataFastSimulator_{}_coverage'.format(config)
+    else:
+        name = 'DataFastSimulator_{}_nfsub_{}'.format(config, nfsub)
+    filename = os.path.join(directory, name + '.npz')
+    if not os.path.exists(filename) and \
+       os.path.exists(filename[:-4] + '.pkl'):
+        filename = filename[:-4] + '.pkl'
+    return filename
+
+
+def get_fastsim_data(config, nfsub=None, version='01', directory=None):
+    """
+    Return the FastSimulator inputs of a configuration, as a FastSimData.
+
+    The result is cached until the file is modified. The parameters are
+    those of get_fastsim_filename.
+
+    """
+    filename = get_fastsim_filename(config, nfsub=nfsub, version=version,
+                                    directory=directory)
+    mtime = os.stat(filename).st_mtime_ns
+    data = _cache.get(filename)
+    if data is None or data[0] != mtime:
+        data = mtime, FastSimData(filename)
+        _cache[filename] = data
+    return data[1]
+
+
+def save_fastsim_data(filename, data):
+    """
+    Save a dictionary of FastSimulator inputs as an uncompressed .npz file,
+    whose members can be memory-mapped.
+
+    Parameters
+    ----------
+    filename : str
+        The .npz file.
+    data : dict
+        The inputs. The values are scalars, arrays or lists of arrays of the
+        same shape.
+
+    """
+    arrays = {}
+    lists = []
+    for key, value in data.items():
+        if isinstance(value, list):
+            lists.append(key)
+        arrays[key] = np.asarray(value)
+        if arrays[key].dtype.hasobject:
+            raise TypeError('The FastSimulator input {!r} is not an array.'
+                            .format(key))
+    arrays[_LISTS_KEY] = np.array(lists, dtype=str)
+    np.savez(filename, **arrays)
+    _cache.pop(filename, None)
+
+
+def convert_fastsim_pickle(filename):
+    """
+    Convert a pickled dictionary of FastSimulator inputs into the .npz file
+    with the same base name, and return the name of this file.
+
+    """
+    with open(filename, 'rb') as f:
+        data = pickle.load(f)
+    out = os.path.splitext(filename)[0] + '.npz'
+    save_fastsim_data(out, data)
+    return out
+
+
+def _read_npz_member(filename, zfile, name):
+    """
+    Memory-map an uncompressed member of a .npz file, or read it otherwise.
+
+    """
+    info = zfile.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED:
+        with open(filename, 'rb') as f:
+            # local file header: the lengths of the member name and of the
+            # extra field are the last fields of its 30 bytes
+            f.seek(info.header_offset + 26)
+            namelen, extralen = struct.unpack('<HH', f.read(4))
+            f.seek(namelen + extralen, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            offset = f.tell()
+        if not dtype.hasobject and len(shape) > 0 and np.prod(shape) > 0:
+            return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                             shape=shape, order='F' if fortran_order else 'C')
+    with zfile.open(name) as f:
+        return np.lib.format.read_array(f)
@@ -402,6 +402,125 @@ def profile(xin, yin, rng=None, nbins=10, fmt=None, plot=True, dispersion=True,
                 return xc, yval, dx, dy, others
 
 
+def profile_batch(xin, yin, rng=None, nbins=10, dispersion=True, log=False, median=False):
+        """
+        Vectorized version of profile for several data sets sharing the same x values,
+        such as the TOD of all the detectors of an ASIC. The samples are sorted by bin
+        once and the statistics of all the data sets are computed by segment reductions.
+        The results are those of profile with cutbad=False.
+
+        Parameters
+        ----------
+        xin : array of shape (nsamples,)
+        yin : array of shape (nsamples,) or (ndata, nsamples)
+        rng : sequence, optional
+                The range of the bins. By default, that of the finite x values.
+        nbins : int
+                Number of bins.
+        dispersion : bool
+                If False, return the errors on the means instead of the dispersions.
+        log : bool
+                If True, the bins are logarithmically spaced.
+        median : bool
+                If True, compute the medians and not the means.
+
+        Returns
+        -------
+        xc, yval, dx, dy : arrays of shape (ndata, nbins)
+                The bin centers, values, and the x and y dispersions or errors. They are
+                set to zero for the empty bins of each data set, and yval and dy are also
+                set to zero where dy is zero.
+        """
+        x = np.asarray(xin, dtype=float)
+        y = np.asarray(yin, dtype=float)
+        if y.ndim == 1:
+                y = y[None, :]
+        if rng is None:
+                mini = np.nanmin(x)
+                maxi = np.nanmax(x)
+        else:
+                mini = rng[0]
+                maxi = rng[1]
+        if log is False:
+                xx = np.linspace(mini, maxi, nbins + 1)
+        else:
+                xx = np.logspace(np.log10(mini), np.log10(maxi), nbins + 1)
+
+        ### Bin indices: as in profile, samples on the bin edges are dropped
+        index = np.searchsorted(xx, x) - 1
+        inside = (index >= 0) & (index < nbins)
+        inside[inside] = x[inside] != xx[index[inside] + 1]
+        order = np.argsort(index[inside], kind='stable')
+        index = index[inside][order]
+        x = x[inside][order]
+        y = y[:, inside][:, order]
+        counts = np.bincount(index, minlength=nbins)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        nonempty = counts > 0
+
+        ### Masked samples are discarded by giving them a zero weight
+        valid = np.isfinite(y)
+        if not np.all(valid):
+                w = valid.astype(float)
+                y = np.where(valid, y, 0)
+        else:
+                w = None
+
+        def segment_sum(a):
+                out = np.zeros(a.shape[:-1] + (nbins,))
+                out[..., nonempty] = np.add.reduceat(a, starts[nonempty], axis=-1)
+                return out
+
+        def segment_mean(a, n):
+                if w is None:
+                        total = segment_sum(a)
+                else:
+                        total = segment_sum(w * a)
+                mean = np.zeros(np.broadcast(total, n).shape)
+                np.divide(total, n, out=mean, where=n > 0)
+                return mean
+
+        def segment_std(a, mean, n):
+                res = a - np.repeat(mean, counts, axis=-1)
+                return np.sqrt(segment_mean(res ** 2, n))
+
+        if w is None:
+                ### the x statistics are common to all the data sets
+                nn = np.broadcast_to(counts, y.shape[:-1] + (nbins,))
+                xmean = segment_mean(x, counts)
+                dx = np.array(np.broadcast_to(segment_std(x, xmean, counts), nn.shape))
+        else:
+                nn = segment_sum(w)
+                xmean = segment_mean(x, nn)
+                dx = segment_std(x, xmean, nn)
+        ymean = segment_mean(y, nn)
+        dy = segment_std(y, ymean, nn)
+        if median:
+                yval = np.zeros_like(ymean)
+                for i in np.where(nonempty)[0]:
+                        seg = y[:, starts[i]:ends[i]]
+                        if w is None:
+                                yval[:, i] = np.median(seg, axis=1)
+                        else:
+                                ### rows without valid samples keep a zero median
+                                segvalid = valid[:, starts[i]:ends[i]]
+                                rows = np.any(segvalid, axis=1)
+                                seg = np.where(segvalid[rows], seg[rows], np.nan)
+                                yval[rows, i] = np.nanmedian(seg, axis=1)
+        else:
+                yval = ymean
+        if not dispersion:
+                fact = np.sqrt(np.maximum(nn, 1))
+                dx = dx / fact
+                dy = dy / fact
+        xc = np.where(nn > 0, (xx[:-1] + xx[1:]) / 2, 0)
+        ok = (nn != 0) & (dy != 0)
+        yval[~ok] = 0
+        dy[~ok] = 0
+        return xc, yval, dx, dy
+
+
 def exponential_filter1d(input, sigma, axis=-1, output=None, mode="reflect", cval=0.0, truncate=10.0, power=1):
         """
         One-dimensional Exponential filter.
@@ -633,7 +752,73 @@ def notch_filter(data, f0, bw, fs):
         return y
 
 
-def meancut(data, nsig, med=False, disp=True):
+def sigma_clip(data, nsig, axis=None, mask=None, maxiter=None):
+        """
+        Iterative sigma-clipping, as scipy.stats.sigmaclip, of all the vectors along an
+        axis of an N-dimensional array at once. At each iteration, the elements outside
+        [mean - nsig * std, mean + nsig * std] are rejected, until no element is rejected.
+        Only the vectors that have not converged yet are processed.
+
+        Parameters
+        ----------
+        data: array like
+        nsig: float
+                Lower and upper bound factor of sigma clipping.
+        axis: int or None
+                The axis along which the vectors are clipped. If None, the flattened array
+                is clipped.
+        mask: boolean array like, optional
+                The elements to consider, broadcastable to the shape of data. By default,
+                all of them.
+        maxiter: int, optional
+                The maximum number of iterations. By default, iterate until convergence.
+
+        Returns
+        -------
+        The mean and the standard deviation of the clipped vectors, and the boolean array
+        of the elements that have not been clipped.
+
+        """
+        data = np.asarray(data)
+        if axis is None:
+                shape = data.shape
+                x = data.reshape((1, -1))
+        else:
+                x = np.moveaxis(data, axis, -1)
+                shape = x.shape
+                x = x.reshape((-1, shape[-1]))
+        if mask is None:
+                keep = np.ones(x.shape, bool)
+        else:
+                keep = np.broadcast_to(mask, data.shape)
+                if axis is not None:
+                        keep = np.moveaxis(keep, axis, -1)
+                keep = keep.reshape(x.shape).copy()
+        mean = np.zeros(len(x))
+        std = np.zeros(len(x))
+        active = np.arange(len(x))
+        niter = 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+                while len(active) > 0 and (maxiter is None or niter < maxiter):
+                        xa = x[active]
+                        ka = keep[active]
+                        n = np.sum(ka, axis=1)
+                        ma = np.sum(np.where(ka, xa, 0), axis=1) / n
+                        sa = np.sqrt(np.sum(np.where(ka, xa - ma[:, None], 0) ** 2, axis=1) / n)
+                        mean[active] = ma
+                        std[active] = sa
+                        newkeep = ka & (xa >= (ma - sa * nsig)[:, None]) & (xa <= (ma + sa * nsig)[:, None])
+                        changed = np.any(newkeep != ka, axis=1)
+                        keep[active] = newkeep
+                        active = active[changed]
+                        niter += 1
+        keep = keep.reshape(shape)
+        if axis is None:
+                return mean[0], std[0], keep
+        return mean.reshape(shape[:-1]), std.reshape(shape[:-1]), np.moveaxis(keep, -1, axis)
+
+
+def meancut(data, nsig, med=False, disp=True, axis=None):
         """
         Parameters
         ----------
@@ -645,22 +830,27 @@ def meancut(data, nsig, med=False, disp=True):
         disp: bool
                 If True, return the dispersion (STD),
                 if False, return the error on the mean (STD/sqrt(N))
+        axis: int or None
+                If given, the vectors along this axis are clipped at once and arrays
+                are returned.
         Returns
         -------
         The mean/median and the dispersion/error.
 
         """
-        dd = data.copy()
-        for i in range(10):
-                dd, mini, maxi = scipy.stats.sigmaclip(dd, low=nsig, high=nsig)
+        data = np.asarray(data)
+        mean, std, keep = sigma_clip(data, nsig, axis=axis)
         if disp:
                 sc = 1
         else:
-                sc = np.sqrt(len(dd))
+                sc = np.sqrt(np.sum(keep, axis=axis))
         if med:
-                return np.median(dd), np.std(dd) / sc
+                if axis is None:
+                        return np.median(data[keep]), std / sc
+                with np.errstate(invalid='ignore'):
+                        return np.nanmedian(np.where(keep, data, np.nan), axis=axis), std / sc
         else:
-                return np.mean(dd), np.std(dd) / sc
+                return mean, std / sc
 
 
 def weighted_mean(x, dx, dispersion=True, renorm=False):
@@ -854,28 +1044,34 @@ def fold_data(time, dd, period, nbins, lowcut=None, highcut=None,
                         fmax[i] = 1. / period * (i + 2) * (1 - margin / (i + 1))
                         fnoise[i] = 0.5 * (fmin[i] + fmax[i])
 
-        folded = np.zeros((ndet, nbins))
-        folded_nonorm = np.zeros((ndet, nbins))
-        dfolded = np.zeros((ndet, nbins))
-        dfolded_nonorm = np.zeros((ndet, nbins))
-        newdata = np.zeros((ndet, len(time)))
-        if not silent:
-                bar = progress_bar(ndet, 'Detectors ')
-        for THEPIX in range(ndet):
+        ### All the detectors are filtered at once
+        newdata = filter_data(time, np.asarray(dd, dtype=float), lowcut=lowcut, highcut=highcut, notch=notch,
+                              rebin=rebin, verbose=verbose)
+        if mode or clip is not None:
+                ### The modes and the clipped counts are computed bin by bin
+                yy = np.zeros((ndet, nbins))
+                dy = np.zeros((ndet, nbins))
                 if not silent:
-                        bar.update()
-                data = dd[THEPIX, :]
-                newdd = filter_data(time, data, lowcut=lowcut, highcut=highcut, notch=notch, rebin=rebin, verbose=verbose)
-                newdata[THEPIX,:] = newdd
-                t, yy, dx, dy, others = profile(tfold, newdd, nbins=nbins, dispersion=False, plot=False,
-                                                cutbad=False, median=median, mode=mode, clip=clip)
-                folded[THEPIX, :] = (yy - np.mean(yy)) / np.std(yy)
-                folded_nonorm[THEPIX, :] = (yy - np.mean(yy))
-                dfolded[THEPIX, :] = dy / np.std(yy)
-                dfolded_nonorm[THEPIX, :] = dy
-                
-                if return_noise_harmonics is not None:
-                        spectrum, freq = power_spectrum(time, newdd, rebin=True)
+                        bar = progress_bar(ndet, 'Detectors ')
+                for THEPIX in range(ndet):
+                        if not silent:
+                                bar.update()
+                        t, yy[THEPIX], dx, dy[THEPIX], others = profile(tfold, newdata[THEPIX], nbins=nbins,
+                                                                        dispersion=False, plot=False, cutbad=False,
+                                                                        median=median, mode=mode, clip=clip)
+        else:
+                t, yy, dx, dy = profile_batch(tfold, newdata, nbins=nbins, dispersion=False, median=median)
+                t = t[-1]
+        meanyy = np.mean(yy, axis=1)[:, None]
+        stdyy = np.std(yy, axis=1)[:, None]
+        folded = (yy - meanyy) / stdyy
+        folded_nonorm = yy - meanyy
+        dfolded = dy / stdyy
+        dfolded_nonorm = dy
+
+        if return_noise_harmonics is not None:
+                for THEPIX in range(ndet):
+                        spectrum, freq = power_spectrum(time, newdata[THEPIX], rebin=True)
                         for i in range(nharm):
                                 ok = (freq >= fmin[i]) & (freq < fmax[i])
                                 noise[THEPIX, i] = np.sqrt(np.mean(spectrum[ok]))
@@ -1177,7 +1373,7 @@ def run_asic(fpobj, idnum, Vtes, fff, dc, asic, reselect_ok=False, lowcut=0.5, h
 
         ### Fold the data at the modulation period of the fibers
         ### Signal is also badpass filtered before folding
-        folding_result = fold_data(time, dd, 1. / fff, lowcut, highcut, nbins, notch=notch)
+        folding_result = fold_data(time, dd, 1. / fff, nbins, lowcut=lowcut, highcut=highcut, notch=notch)
         folded, tt, folded_nonorm = folding_result[:3]
 
         if nointeractive:
@@ -503,11 +503,11 @@ class FringesAnalysis:
             tstart = i * stable_time + skip_rise
             tend = (i + 1) * stable_time - skip_fall
             ok = (tfold >= tstart) & (tfold < tend)
-            for j in range(self.ncycles):
-                m_points[j, i], err_m_points[j, i] = ft.meancut(droll[j, ok],
-                                                                nsig=3,
-                                                                med=median,
-                                                                disp=False)
+            m_points[:, i], err_m_points[:, i] = ft.meancut(droll[:, ok],
+                                                            nsig=3,
+                                                            med=median,
+                                                            disp=False,
+                                                            axis=1)
 
         if rm_slope_percycle:
             m_points = self.remove_slope_percycle(m_points, err_m_points, doplot=doplot)
@@ -536,10 +536,7 @@ class FringesAnalysis:
             Ncycles_to_use = self.ncycles
 
         # Average or median over all cycles
-        Mcycles = np.zeros(self.nsteps)
-        err_Mcycles = np.zeros(self.nsteps)
-        for i in range(self.nsteps):
-            Mcycles[i], err_Mcycles[i] = ft.meancut(m_points[:Ncycles_to_use, i], nsig=3, med=median, disp=False)
+        Mcycles, err_Mcycles = ft.meancut(m_points[:Ncycles_to_use, :], nsig=3, med=median, disp=False, axis=0)
 
         if speak:
             for i in range(self.nsteps):
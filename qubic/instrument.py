@@ -5,11 +5,16 @@ import cpuinfo
 import healpy as hp
 import numexpr as ne
 import numpy as np
+import operator
 import copy
+import functools
+import os
+from collections import OrderedDict
 from pyoperators import (
     Cartesian2SphericalOperator, DenseBlockDiagonalOperator, DiagonalOperator,
-    IdentityOperator, HomothetyOperator, ReshapeOperator, Rotation2dOperator,
-    Rotation3dOperator, Spherical2CartesianOperator, IntegrationTrapezeOperator)
+    IdentityOperator, HomothetyOperator, Operator, ReshapeOperator,
+    Rotation2dOperator, Rotation3dOperator, Spherical2CartesianOperator,
+    IntegrationTrapezeOperator)
 from pyoperators.utils import (
     operation_assignment, pool_threading, product, split)
 from pyoperators.utils.ufuncs import abs2
@@ -25,15 +30,26 @@ from scipy.constants import c, h, k, sigma
 from scipy.integrate import quad
 from qubic import _flib as flib
 from qubic.calibration import QubicCalibration
-from qubic.utils import _compress_mask
+from qubic.utils import _atomic_write, _compress_mask, _digest
 from qubic.ripples import ConvolutionRippledGaussianOperator, BeamGaussianRippled
 from qubic.beams import (BeamGaussian, BeamFitted, MultiFreqBeam)
 from qubic.polyacquisition import compute_freq
 from astropy.io import fits
 
-__all__ = ['QubicInstrument',
+__all__ = ['CompactProjectionOperator',
+           'OnTheFlyProjectionOperator',
+           'QubicInstrument',
            'QubicMultibandInstrument']
 
+# default number of peak directions rotated at once by the projection engine
+PROJECTION_BLOCK_SIZE = 2**20
+# default size of the time chunks of the sparse matrix from which the compact
+# projection operator is built
+PROJECTION_CHUNK_NBYTES = 2**27
+# number of photon NEP evaluations kept in memory
+PHOTON_NEP_CACHE_SIZE = 64
+_PHOTON_NEP_CACHE = OrderedDict()
+
 class Filter(object):
     def __init__(self, nu, relative_bandwidth):
         self.nu = float(nu)
@@ -56,6 +72,21 @@ def funct(x, p, n):
     return x ** p / (np.exp(x) - 1) ** n
 
 
+@functools.lru_cache(maxsize=None)
+def _get_photon_integrals(b):
+    """
+    Return the integrals from 0 to b of x^4 / (e^x - 1), x^4 / (e^x - 1)^2
+    and x^3 / (e^x - 1), which give the photon NEP and power of a thermal
+    component up to the frequency b k T / h. They only depend on the
+    temperature of the component and on the upper frequency of the band, so
+    that they are shared by all the sub-bands.
+
+    """
+    return (quad(funct, 0, b, (4, 1))[0],
+            quad(funct, 0, b, (4, 2))[0],
+            quad(funct, 0, b, (3, 1))[0])
+
+
 class QubicInstrument(Instrument):
     """
     The QubicInstrument class. It represents the instrument setup.
@@ -109,6 +140,19 @@ class QubicInstrument(Instrument):
         beam_shape: dictionary entry, string
             the shape of the primary and secondary beams:
             'gaussian', 'fitted_beam' or 'multi_freq'
+        projection_cache : string, optional
+            Directory in which the peak sampling matrices are stored, so that
+            they are memory-mapped instead of recomputed when the same
+            pointing, scene and instrument are used again.
+        projection_block_size : int, optional
+            The number of peak directions that are rotated at once by each
+            thread when the peak sampling matrix is computed.
+        projection_compact : boolean, optional
+            If true, the peak sampling matrix is stored in the compact form
+            of the CompactProjectionOperator.
+        projection_compact_dtype : string, optional
+            The dtype of the polarization angle cosines and sines in the
+            compact peak sampling matrix. The default is 'float16'.
 
         """
         self.d = d
@@ -214,6 +258,10 @@ class QubicInstrument(Instrument):
         self.synthbeam.fraction = synthbeam_fraction
         self.synthbeam.kmax = synthbeam_kmax
         self.synthbeam_file(d)
+        self.projection_cache = d.get('projection_cache')
+        self.projection_block_size = d.get('projection_block_size')
+        self.projection_compact = d.get('projection_compact', False)
+        self.projection_compact_dtype = d.get('projection_compact_dtype')
 
         layout = self._get_detector_layout(detector_ngrids, detector_nep,
                                            detector_fknee, detector_fslope,
@@ -395,7 +443,17 @@ class QubicInstrument(Instrument):
         ================================
         Return the photon noise NEP (#det,).
 
+        The NEPs are memoized for each optical configuration, since they are
+        requested by the noise generation and by the noise operators of each
+        acquisition. They are recomputed in debug mode, to print the
+        contributions of the components.
+
         """
+        if not self.debug:
+            key = self._get_noise_photon_nep_key(scene)
+            if key in _PHOTON_NEP_CACHE:
+                _PHOTON_NEP_CACHE.move_to_end(key)
+                return _PHOTON_NEP_CACHE[key].copy()
 
         noise = self.load_NEP_parameters(scene)
 
@@ -471,9 +529,33 @@ class QubicInstrument(Instrument):
         if self.debug:
             print('Total photon power =  {0:.2e} W'.format(noise.P_phot_tot.max()) +
                   ', Total photon NEP = ' + '{0:.2e}'.format(noise.NEP_tot.max()) + ' W/sqrt(Hz)')
-        
+        else:
+            _PHOTON_NEP_CACHE[key] = noise.NEP_tot.copy()
+            while len(_PHOTON_NEP_CACHE) > PHOTON_NEP_CACHE_SIZE:
+                _PHOTON_NEP_CACHE.popitem(last=False)
+
         return noise.NEP_tot
 
+    def _get_noise_photon_nep_key(self, scene):
+        """
+        Return the digest of the parameters of the photon NEP model: the sky
+        and atmosphere emission, the optical components, the filter, the
+        horns and the detector geometry and efficiency.
+
+        """
+        atmosphere = scene.atmosphere
+        beam = self.secondary_beam
+        return _digest(
+            'qubic.photon_nep.v1', scene.temperature, atmosphere.temperature,
+            atmosphere.transmission, atmosphere.emissivity,
+            self.optics.components, self.optics.focal_length, self.config,
+            self.filter.nu, self.FRBW, self.nu1, self.nu2,
+            self.nu1_up, self.nu1_down, self.nu2_up, self.nu2_down,
+            self.horn.radius, self.horn.radeff, len(self.horn),
+            self.detector.area, self.detector.center,
+            self.detector.efficiency, type(beam).__name__,
+            *[_ for item in sorted(vars(beam).items()) for _ in item])
+
     def load_NEP_parameters(self, scene):
         
         """
@@ -530,15 +612,17 @@ class QubicInstrument(Instrument):
             noise.nu = self.nu2
         noise.dnu = noise.nu * self.FRBW
         noise.S_det = self.detector.area
+        # the detector angles are derived from their centers at each access
+        theta = self.detector.theta
+        phi = self.detector.phi
         noise.omega_det = -self.detector.area / \
                     self.optics.focal_length ** 2 * \
-                    np.cos(self.detector.theta) ** 3
+                    np.cos(theta) ** 3
         # Physical horn area   
         noise.S_horns = np.pi * self.horn.radius ** 2 * len(self.horn)
         # Effective horn area, taking the number of modes into account 
         noise.S_horns_eff = np.pi * self.horn.radeff ** 2 * len(self.horn)
-        noise.sec_beam = self.secondary_beam(self.detector.theta,
-                                       self.detector.phi)
+        noise.sec_beam = self.secondary_beam(theta, phi)
         alpha = np.arctan(0.5)  # half oppening angle of the combiner
         noise.omega_comb = np.pi * (1 - np.cos(alpha) ** 2)  # to be revisited,
         # depends on the detector position
@@ -729,9 +813,7 @@ class QubicInstrument(Instrument):
             # back to back horns, as seen by the detectors through the combiner
             T = noise.temperatures[ib2b]
             b = h * noise.nu_up / k / T
-            I1 = quad(funct, 0, b, (4, 1))[0]
-            I2 = quad(funct, 0, b, (4, 2))[0]
-            K1 = quad(funct, 0, b, (3, 1))[0]
+            I1, I2, K1 = _get_photon_integrals(b)
             eta = (noise.emissivities * noise.tr_prod)[ib2b] * \
                                     self.detector.efficiency
             # Here the physical horn area S_horns must be used
@@ -797,9 +879,7 @@ class QubicInstrument(Instrument):
         if (self.filter.nu <= self.nu1_up) and (self.filter.nu >= self.nu1_down):
             T = noise.temperatures[ib2b]
             b = h * noise.nu_up / k / T
-            I1 = quad(funct, 0, b, (4, 1))[0]
-            I2 = quad(funct, 0, b, (4, 2))[0]
-            K1 = quad(funct, 0, b, (3, 1))[0]
+            I1, I2, K1 = _get_photon_integrals(b)
 
             eff_factor = np.prod(noise.transmissions[(len(names) - 4):]) * \
                          self.detector.efficiency
@@ -874,9 +954,7 @@ class QubicInstrument(Instrument):
         if (self.filter.nu <= self.nu1_up) and (self.filter.nu >= self.nu1_down):
             T = noise.temperatures[icomb]
             b = h * noise.nu_up / k / T
-            J1 = quad(funct, 0, b, (4, 1))[0]
-            J2 = quad(funct, 0, b, (4, 2))[0]
-            L1 = quad(funct, 0, b, (3, 1))[0]
+            J1, J2, L1 = _get_photon_integrals(b)
             eta = (noise.emissivities * noise.tr_prod)[icomb] * \
                                         self.detector.efficiency
             noise.P_phot[icomb] = noise.gp[icomb] * eta * (k * T) ** 4 / c ** 2 / h ** 3 * L1 * \
@@ -937,9 +1015,7 @@ class QubicInstrument(Instrument):
         if (self.filter.nu <= self.nu1_up) and (self.filter.nu >= self.nu1_down):
             T = noise.temperatures[ics]
             b = h * noise.nu_up / k / T
-            J1 = quad(funct, 0, b, (4, 1))[0]
-            J2 = quad(funct, 0, b, (4, 2))[0]
-            L1 = quad(funct, 0, b, (3, 1))[0]
+            J1, J2, L1 = _get_photon_integrals(b)
             eta = (noise.emissivities * noise.tr_prod)[ics] * \
                                             self.detector.efficiency
             
@@ -998,9 +1074,7 @@ class QubicInstrument(Instrument):
         if (self.filter.nu <= self.nu1_up) and (self.filter.nu >= self.nu1_down):
             T = noise.temperatures[idic]
             b = h * noise.nu_up / k / T
-            J1 = quad(funct, 0, b, (4, 1))[0]
-            J2 = quad(funct, 0, b, (4, 2))[0]
-            L1 = quad(funct, 0, b, (3, 1))[0]
+            J1, J2, L1 = _get_photon_integrals(b)
             eta = (noise.emissivities * noise.tr_prod)[idic] * \
                                                 self.detector.efficiency
             noise.g[idic] = noise.gp[idic] * noise.S_det * noise.omega_dichro 
@@ -1059,9 +1133,7 @@ class QubicInstrument(Instrument):
 
         T = noise.temperatures[indf]
         b = h * noise.nu_up / k / T
-        J1 = quad(funct, 0, b, (4, 1))[0]
-        J2 = quad(funct, 0, b, (4, 2))[0]
-        L1 = quad(funct, 0, b, (3, 1))[0]
+        J1, J2, L1 = _get_photon_integrals(b)
         eta = (noise.emissivities * noise.tr_prod)[indf] * \
                                             self.detector.efficiency
         noise.NEP_phot2[indf] = 2 * noise.gp[indf] * eta * (k * T) ** 5 / c ** 2 / h ** 3 * \
@@ -1109,9 +1181,7 @@ class QubicInstrument(Instrument):
 
         T = noise.temperatures[i]
         b = h * noise.nu_up / k / T
-        J1 = quad(funct, 0, b, (4, 1))[0]
-        J2 = quad(funct, 0, b, (4, 2))[0]
-        L1 = quad(funct, 0, b, (3, 1))[0]
+        J1, J2, L1 = _get_photon_integrals(b)
         eta = (noise.emissivities * noise.tr_prod)[i] * \
                                             self.detector.efficiency
         noise.NEP_phot2[i] = 2 * noise.gp[i] * eta * (k * T) ** 5 / c ** 2 / h ** 3 * \
@@ -1266,7 +1336,7 @@ class QubicInstrument(Instrument):
         sec = secondary_beam(theta, phi)
         if use_file:
            return DiagonalOperator(sr_det / sr_beam, broadcast='rightward')
-	else:
+        else:
            sec = secondary_beam(theta, phi)
            return DiagonalOperator(sr_det / sr_beam * sec, broadcast='rightward')
 
@@ -1346,11 +1416,16 @@ class QubicInstrument(Instrument):
         return ReshapeOperator((nd, nt, 1), (nd, nt)) * \
                DenseBlockDiagonalOperator(data, shapein=(nd, nt, 3))
 
-    def get_projection_operator(self, sampling, scene, verbose=True):
+    def get_projection_operator(self, sampling, scene, verbose=True,
+                                max_nbytes=None):
         """
         Return the peak sampling operator.
         Convert units from W to W/sr.
 
+        If the instrument has a projection cache directory, the sparse matrix
+        is looked up there first and memory-mapped if found, otherwise it is
+        computed and stored for later use.
+
         Parameters
         ----------
         sampling : QubicSampling
@@ -1359,30 +1434,26 @@ class QubicInstrument(Instrument):
             The observed scene.
         verbose : bool, optional
             If true, display information about the memory allocation.
+        max_nbytes : int, optional
+            Maximum number of bytes of the sparse matrix. If the matrix is
+            larger, a matrix-free OnTheFlyProjectionOperator is returned,
+            which computes it by time chunks of at most this size.
 
         """
-        horn = getattr(self, 'horn', None)
-        primary_beam = getattr(self, 'primary_beam', None)
-
-        if sampling.fix_az:
-            rotation = sampling.cartesian_horizontal2instrument
-        else:
-            rotation = sampling.cartesian_galactic2instrument
-
-        return QubicInstrument._get_projection_operator(
-            rotation, scene, self.filter.nu, self.detector.center,
-            self.synthbeam, horn, primary_beam,self.thetafits, self.phifits, 
-	    self.valfits,self.use_file,self.numpeaks,self.freqs, verbose=verbose)
-
+        return _get_projection_operators(
+            [self], sampling, scene, verbose=verbose,
+            max_nbytes=max_nbytes)[0]
 
     @staticmethod
-    def _get_projection_operator(
-            rotation, scene, nu, position, synthbeam, horn, primary_beam, 
-            thetafits, phifits, valfits, use_file, numpeaks, freqs, verbose=True):
-        ndetectors = position.shape[0]
-        ntimes = rotation.data.shape[0]
-        nside = scene.nside
+    def _get_projection_peaks(scene, nu, position, synthbeam, horn,
+                              primary_beam, thetafits, phifits, valfits,
+                              use_file, freqs):
+        """
+        Return the angles and values of the synthetic beam peaks used by the
+        peak sampling operator, either read from the synthetic beam file or
+        computed from the horn array geometry.
 
+        """
         isfreq=int(np.floor(nu/1000000000))
         frq=len(str(freqs[0]))
         
@@ -1412,11 +1483,67 @@ class QubicInstrument(Instrument):
         
         else:
             thetas, phis, vals = QubicInstrument._peak_angles(scene, nu, position, synthbeam, horn, primary_beam)
-            
-        ncolmax = thetas.shape[-1]
-        thetaphi = _pack_vector(thetas, phis)  # (ndetectors, ncolmax, 2)
+        return thetas, phis, vals
+
+    @staticmethod
+    def _get_projection_operator(
+            rotation, scene, nu, position, synthbeam, horn, primary_beam, 
+            thetafits, phifits, valfits, use_file, numpeaks, freqs,
+            verbose=True, peaks=None):
+        ndetectors = position.shape[0]
+        ntimes = rotation.data.shape[0]
+        nside = scene.nside
+
+        if peaks is None:
+            peaks = QubicInstrument._get_projection_peaks(
+                scene, nu, position, synthbeam, horn, primary_beam,
+                thetafits, phifits, valfits, use_file, freqs)
+        return QubicInstrument._get_projection_operators(
+            rotation, scene, position, synthbeam, [peaks], verbose=verbose)[0]
+
+    @staticmethod
+    def _get_projection_operators(rotation, scene, position, synthbeam, peaks,
+                                  verbose=True, block_size=None):
+        """
+        Return the peak sampling operators associated with several sets of
+        synthetic beam peaks (typically one per sub-band) seen by the same
+        detectors with the same pointing. The peak directions of all the sets
+        are rotated and converted into Healpix indices in a single pass.
+
+        Parameters
+        ----------
+        rotation : Rotation3dOperator
+            The sky-to-instrument rotation, of data shape (ntimes, 3, 3).
+        scene : QubicScene
+            The observed scene.
+        position : array of shape (ndetectors, 3)
+            The detector positions.
+        synthbeam : SyntheticBeam
+            The synthetic beam, which sets the dtype of the matrix values.
+        peaks : list of 3-tuples
+            The (theta, phi, val) peak arrays of shape (ndetectors, ncolmax),
+            as returned by _get_projection_peaks. The number of peaks may
+            differ from one set to another.
+        block_size : int, optional
+            The maximum number of (set, detector, peak, time) directions that
+            are rotated and converted into Healpix indices at once by a
+            thread. The default is PROJECTION_BLOCK_SIZE.
+
+        """
+        ndetectors = position.shape[0]
+        ntimes = rotation.data.shape[0]
+        nside = scene.nside
+        nsets = len(peaks)
+
+        ncolmaxs = [theta.shape[-1] for theta, phi, val in peaks]
+        ncolmax = max(ncolmaxs)
+        thetas = np.full((nsets, ndetectors, ncolmax), np.pi / 2)
+        phis = np.zeros((nsets, ndetectors, ncolmax))
+        for iset, (theta, phi, val) in enumerate(peaks):
+            thetas[iset, :, :ncolmaxs[iset]] = theta
+            phis[iset, :, :ncolmaxs[iset]] = phi
+        thetaphi = _pack_vector(thetas, phis)  # (nsets, ndetectors, ncolmax, 2)
         direction = Spherical2CartesianOperator('zenith,azimuth')(thetaphi)
-        e_nf = direction[:, None, :, :]
         # if (nside > 8192) or (cpuinfo.get_cpu_info().get('brand_raw')=='VirtualApple @ 2.50GHz'):
         if (nside > 8192):
             dtype_index = np.dtype(np.int64)
@@ -1429,36 +1556,49 @@ class QubicInstrument(Instrument):
         ndims = len(scene.kind)
         nscene = len(scene)
         nscenetot = product(scene.shape[:scene.ndim])
-        s = cls((ndetectors * ntimes * ndims, nscene * ndims), ncolmax=ncolmax,
-                dtype=synthbeam.dtype, dtype_index=dtype_index,
-                verbose=verbose)
+        matrices = [cls((ndetectors * ntimes * ndims, nscene * ndims),
+                        ncolmax=n, dtype=synthbeam.dtype,
+                        dtype_index=dtype_index, verbose=verbose)
+                    for n in ncolmaxs]
 
-        index = s.data.index.reshape((ndetectors, ntimes, ncolmax))
-        c2h = Cartesian2HealpixOperator(nside)
+        indices = [s.data.index.reshape((ndetectors, ntimes, n))
+                   for s, n in zip(matrices, ncolmaxs)]
         if nscene != nscenetot:
             table = np.full(nscenetot, -1, dtype_index)
             table[scene.index] = np.arange(len(scene), dtype=dtype_index)
 
-        def func_thread(i):
-            # e_nf[i] shape: (1, ncolmax, 3)
-            # e_ni shape: (ntimes, ncolmax, 3)
-            thetaphis = _pack_vector(thetas, phis)  # (ndetectors, ncolmax, 2)
-            directions = Spherical2CartesianOperator('zenith,azimuth')(thetaphis)
-            e_nf = direction[:, None, :, :]
-            e_ni = rotation.T(e_nf[i].swapaxes(0, 1)).swapaxes(0, 1)
+        # the peak directions of a block of detectors are rotated for a block
+        # of time samples with a single matrix product: for the rotation R of
+        # the instrument-to-sky frame, e_sky[t, i] = sum_j e_inst[j] R[t, j, i]
+        if block_size is None:
+            block_size = PROJECTION_BLOCK_SIZE
+        nper_detector = nsets * ncolmax * ntimes
+        ndet_block = max(block_size // nper_detector, 1)
+        ntime_block = max(min(block_size // (nsets * ncolmax), ntimes), 1)
+        rot = rotation.data.transpose(1, 0, 2)
+        blocks = [(d, t)
+                  for d in range(0, ndetectors, ndet_block)
+                  for t in range(0, ntimes, ntime_block)]
+
+        def func_block(block):
+            d = slice(block[0], min(block[0] + ndet_block, ndetectors))
+            t = slice(block[1], min(block[1] + ntime_block, ntimes))
+            nd = d.stop - d.start
+            nt = t.stop - t.start
+            e_nf = direction[:, d].reshape((-1, 3))
+            e_ni = np.dot(e_nf, rot[:, t].reshape((3, -1)))
+            e_ni = e_ni.reshape((nsets, nd, ncolmax, nt, 3))
+            ipixel = hp.vec2pix(nside, e_ni[..., 0], e_ni[..., 1],
+                                e_ni[..., 2])
             if nscene != nscenetot:
-                np.take(table, c2h(e_ni).astype(int), out=index[i])
-            else:
-                index[i] = c2h(e_ni)
+                ipixel = np.take(table, ipixel)
+            for index, ipixel_, n in zip(indices, ipixel, ncolmaxs):
+                index[d, t] = ipixel_[:, :n].swapaxes(1, 2)
 
         with pool_threading() as pool:
-            pool.map(func_thread, range(ndetectors))
+            pool.map(func_block, blocks)
 
-        if scene.kind == 'I':
-            value = s.data.value.reshape(ndetectors, ntimes, ncolmax)
-            value[...] = vals[:, None, :]
-            shapeout = (ndetectors, ntimes)
-        else:
+        if scene.kind != 'I':
             if str(dtype_index) not in ('int32', 'int64') or \
                     str(synthbeam.dtype) not in ('float32', 'float64'):
                 raise TypeError(
@@ -1466,15 +1606,21 @@ class QubicInstrument(Instrument):
                     'nd {1}.'.format(dtype_index, synthbeam.dtype))
             func = 'matrix_rot{0}d_i{1}_r{2}'.format(
                 ndims, dtype_index.itemsize, synthbeam.dtype.itemsize)
-            getattr(flib.polarization, func)(
-                rotation.data.T, direction.T, s.data.ravel().view(np.int8),
-                vals.T)
 
-            if scene.kind == 'QU':
-                shapeout = (ndetectors, ntimes, 2)
+        operators = []
+        for iset, (s, n) in enumerate(zip(matrices, ncolmaxs)):
+            vals = peaks[iset][2]
+            if scene.kind == 'I':
+                value = s.data.value.reshape(ndetectors, ntimes, n)
+                value[...] = vals[:, None, :]
+                shapeout = (ndetectors, ntimes)
             else:
-                shapeout = (ndetectors, ntimes, 3)
-        return ProjectionOperator(s, shapeout=shapeout)
+                getattr(flib.polarization, func)(
+                    rotation.data.T, direction[iset, :, :n].T,
+                    s.data.ravel().view(np.int8), vals.T)
+                shapeout = (ndetectors, ntimes, ndims)
+            operators.append(ProjectionOperator(s, shapeout=shapeout))
+        return operators
 
     def get_transmission_operator(self):
         """
@@ -1879,6 +2025,249 @@ class QubicInstrument(Instrument):
         return subset_inst
 
 
+class OnTheFlyProjectionOperator(Operator):
+    """
+    Matrix-free peak sampling operator. The pixel indices and the Stokes
+    weights of the synthetic beam peaks are computed for one chunk of time
+    samples at a time, so that the memory footprint of the operator is set
+    by the chunk size and not by the length of the acquisition.
+
+    """
+    def __init__(self, rotation, scene, position, synthbeam, peaks,
+                 max_nbytes=None, block_size=None, **keywords):
+        """
+        Parameters
+        ----------
+        rotation : Rotation3dOperator
+            The sky-to-instrument rotation, of data shape (ntimes, 3, 3).
+        scene : QubicScene
+            The observed scene.
+        position : array of shape (ndetectors, 3)
+            The detector positions.
+        synthbeam : SyntheticBeam
+            The synthetic beam, which sets the dtype of the matrix values.
+        peaks : 3-tuple
+            The (theta, phi, val) peak arrays of shape (ndetectors, ncolmax),
+            as returned by QubicInstrument._get_projection_peaks.
+        max_nbytes : int, optional
+            Maximum number of bytes of the sparse matrix of a time chunk.
+        block_size : int, optional
+            The block size of the projection engine.
+
+        """
+        ndetectors = position.shape[0]
+        ntimes = rotation.data.shape[0]
+        ndims = len(scene.kind)
+        ncolmax = peaks[0].shape[-1]
+        itemsize_index = 8 if scene.nside > 8192 else 4
+        nbytes = ndetectors * ncolmax * (
+            itemsize_index + ndims * synthbeam.dtype.itemsize)
+        if max_nbytes is None:
+            ntimes_chunk = ntimes
+        else:
+            ntimes_chunk = min(max(int(max_nbytes // nbytes), 1), ntimes)
+        if scene.kind == 'I':
+            shapeout = (ndetectors, ntimes)
+        else:
+            shapeout = (ndetectors, ntimes, ndims)
+        Operator.__init__(self, shapein=scene.shape, shapeout=shapeout,
+                          dtype=synthbeam.dtype, flags='linear', **keywords)
+        self.rotation = rotation
+        self.scene = scene
+        self.position = position
+        self.synthbeam = synthbeam
+        self.peaks = peaks
+        self.block_size = block_size
+        self.chunks = tuple(split(ntimes, int(np.ceil(ntimes / ntimes_chunk))))
+
+    def get_chunk_operator(self, chunk):
+        """
+        Return the sparse peak sampling operator of a time chunk.
+
+        """
+        rotation = DenseBlockDiagonalOperator(
+            self.rotation.data[chunk], naxesin=1, naxesout=1)
+        return QubicInstrument._get_projection_operators(
+            rotation, self.scene, self.position, self.synthbeam,
+            [self.peaks], verbose=False, block_size=self.block_size)[0]
+
+    def direct(self, input, output):
+        for chunk in self.chunks:
+            P = self.get_chunk_operator(chunk)
+            output[:, chunk] = P(input)
+
+    def transpose(self, input, output):
+        output[...] = 0
+        for chunk in self.chunks:
+            P = self.get_chunk_operator(chunk)
+            P.T(input[:, chunk], output, operation=operator.iadd)
+
+
+class CompactProjectionOperator(OnTheFlyProjectionOperator):
+    """
+    Peak sampling operator with a compact storage of its sparse matrix.
+
+    The peaks of null value, which pad the matrix rows of the detectors with
+    less significant peaks, are not stored. The peak values, which do not
+    depend on time, are stored once per detector. The pixel indices are
+    stored as uint16 if the scene has less than 65535 pixels, otherwise as
+    int16 differences between consecutive time samples when the pointing is
+    continuous enough. For the QU and IQU scenes, the polarization angle is
+    stored as its cosine and sine, by default in float16: their absolute
+    error is then less than 2**-12 and the relative error on the polarized
+    part of H(x) and H.T(y) is a few 1e-4. The storage is then 2 to 3 times
+    smaller than the sparse matrix, against 1.2 to 1.6 times with float32
+    cosines and sines.
+
+    """
+    def __init__(self, rotation, scene, position, synthbeam, peaks,
+                 max_nbytes=None, block_size=None, dtype_angle=None,
+                 **keywords):
+        """
+        Parameters
+        ----------
+        rotation : Rotation3dOperator
+            The sky-to-instrument rotation, of data shape (ntimes, 3, 3).
+        scene : QubicScene
+            The observed scene.
+        position : array of shape (ndetectors, 3)
+            The detector positions.
+        synthbeam : SyntheticBeam
+            The synthetic beam, which sets the dtype of the peak values.
+        peaks : 3-tuple
+            The (theta, phi, val) peak arrays of shape (ndetectors, ncolmax),
+            as returned by QubicInstrument._get_projection_peaks.
+        max_nbytes : int, optional
+            Maximum number of bytes of the sparse matrix of the time chunks
+            from which the compact storage is built. The default is
+            PROJECTION_CHUNK_NBYTES.
+        block_size : int, optional
+            The block size of the projection engine.
+        dtype_angle : dtype, optional
+            The dtype of the cosine and sine of the polarization angles.
+            The default is float16.
+
+        """
+        if max_nbytes is None:
+            max_nbytes = PROJECTION_CHUNK_NBYTES
+        OnTheFlyProjectionOperator.__init__(
+            self, rotation, scene, position, synthbeam, peaks,
+            max_nbytes=max_nbytes, block_size=block_size, **keywords)
+        if dtype_angle is None:
+            dtype_angle = np.float16
+        idet, ipeak = np.nonzero(peaks[2])
+        self.weight = peaks[2][idet, ipeak].astype(synthbeam.dtype)
+        npeaks = np.bincount(idet, minlength=position.shape[0])
+        self.detectors = np.flatnonzero(npeaks)
+        self.offsets = np.r_[0, np.cumsum(npeaks)][self.detectors]
+        nscene = len(scene)
+        if nscene < 2**16 - 1:
+            dtype_index = np.dtype(np.uint16)
+        elif nscene < 2**31 - 1:
+            dtype_index = np.dtype(np.int32)
+        else:
+            dtype_index = np.dtype(np.int64)
+
+        # the pixel indices, and the cosine and sine of twice the
+        # polarization angle, of shape (ntimes_chunk, npeaks) for each chunk
+        self.index = []
+        self.angle = []
+        for chunk in self.chunks:
+            data = self.get_chunk_operator(chunk).matrix.data.reshape(
+                (position.shape[0], -1, peaks[2].shape[1]))[idet, :, ipeak].T
+            index = data['index'].astype(np.int64)
+            # indices outside the scene point to an extra null pixel
+            index[index < 0] = nscene
+            self.index.append(_encode_index(index, dtype_index))
+            if scene.kind != 'I':
+                # the 2x2 rotation block of the QU or IQU matrix elements
+                c, s = ('r11', 'r21') if scene.kind == 'QU' else \
+                       ('r22', 'r32')
+                angle = np.empty(index.shape + (2,), dtype_angle)
+                angle[..., 0] = data[c] / self.weight
+                angle[..., 1] = data[s] / self.weight
+                self.angle.append(angle)
+
+    @property
+    def nbytes(self):
+        return self.weight.nbytes + \
+            sum(i.nbytes if isinstance(i, np.ndarray) else
+                i[0].nbytes + i[1].nbytes for i in self.index) + \
+            sum(a.nbytes for a in self.angle)
+
+    def direct(self, input, output):
+        output[...] = 0
+        input = np.concatenate([input, np.zeros_like(input[:1])])
+        for ichunk, chunk in enumerate(self.chunks):
+            index = _decode_index(self.index[ichunk])
+            if self.scene.kind == 'I':
+                values = input[index] * self.weight
+            else:
+                c = self.angle[ichunk][..., 0]
+                s = self.angle[ichunk][..., 1]
+                x = input[index] * self.weight[:, None]
+                values = np.empty_like(x)
+                if self.scene.kind == 'IQU':
+                    values[..., 0] = x[..., 0]
+                values[..., -2] = c * x[..., -2] - s * x[..., -1]
+                values[..., -1] = s * x[..., -2] + c * x[..., -1]
+            values = np.add.reduceat(values, self.offsets, axis=1)
+            output[self.detectors, chunk] = values.swapaxes(0, 1)
+
+    def transpose(self, input, output):
+        nscene = len(self.scene)
+        idet = np.repeat(self.detectors, np.diff(
+            np.r_[self.offsets, len(self.weight)]))
+        output[...] = 0
+        for ichunk, chunk in enumerate(self.chunks):
+            index = _decode_index(self.index[ichunk]).ravel()
+            y = input[idet, chunk].swapaxes(0, 1)
+            if self.scene.kind == 'I':
+                output += np.bincount(
+                    index, (y * self.weight).ravel(), nscene + 1)[:-1]
+                continue
+            c = self.angle[ichunk][..., 0]
+            s = self.angle[ichunk][..., 1]
+            y = y * self.weight[:, None]
+            values = [c * y[..., -2] + s * y[..., -1],
+                      c * y[..., -1] - s * y[..., -2]]
+            if self.scene.kind == 'IQU':
+                values.insert(0, y[..., 0])
+            for i, v in enumerate(values):
+                output[:, i] += np.bincount(index, v.ravel(), nscene + 1)[:-1]
+
+
+def _encode_index(index, dtype):
+    """
+    Return the pixel indices of shape (ntimes, npeaks) in compact form,
+    either as an array of given dtype or, if the dtype is wider than 16 bits
+    and the pointing is continuous, as a 2-tuple (first time sample, int16
+    differences between consecutive time samples).
+
+    """
+    if dtype.itemsize == 2 or len(index) < 2:
+        return index.astype(dtype)
+    delta = np.diff(index, axis=0)
+    if np.any(np.abs(delta) > 2**15 - 1):
+        return index.astype(dtype)
+    return index[0].astype(dtype), delta.astype(np.int16)
+
+
+def _decode_index(index):
+    """
+    Return the pixel indices stored by _encode_index as an int64 array.
+
+    """
+    if isinstance(index, np.ndarray):
+        return index.astype(np.int64)
+    first, delta = index
+    out = np.empty((len(delta) + 1, len(first)), np.int64)
+    out[0] = first
+    np.cumsum(delta, axis=0, out=out[1:])
+    out[1:] += first
+    return out
+
+
 def _argsort_reverse(a, axis=-1):
     i = list(np.ogrid[[slice(x) for x in a.shape]])
     i[axis] = a.argsort(axis)[:, ::-1]
@@ -1893,6 +2282,151 @@ def _pack_vector(*args):
     return out
 
 
+def _get_projection_cache_key(sampling, scene, nu, position, synthbeam,
+                              peaks):
+    """
+    Return the hexadecimal digest identifying a peak sampling matrix. It
+    depends on the pointing, the scene pixelisation, the filter frequency,
+    the synthetic beam model and the detector positions.
+
+    """
+    nscenetot = product(scene.shape[:scene.ndim])
+    items = ['qubic.projection.v1',
+             sampling.azimuth, sampling.elevation, sampling.pitch,
+             sampling.time, str(sampling.date_obs), sampling.latitude,
+             sampling.longitude, bool(sampling.fix_az),
+             getattr(sampling, 'rotation_step', None),
+             scene.nside, scene.kind, len(scene),
+             scene.index if len(scene) != nscenetot else None,
+             nu, synthbeam.kmax, synthbeam.fraction, str(synthbeam.dtype),
+             position] + list(peaks)
+    return _digest(*items)
+
+
+def _get_projection_operators(instruments, sampling, scene, verbose=True,
+                              max_nbytes=None):
+    """
+    Return the peak sampling operators of instruments that only differ by
+    their filter (the sub-bands of a multiband instrument). The pointing
+    rotation is computed once and shared by all the instruments, the
+    matrices found in the projection caches are memory-mapped and the
+    other ones are computed together. The matrices of the instruments with
+    the projection_compact option are stored in compact form and the other
+    matrices larger than max_nbytes are replaced by matrix-free operators.
+
+    """
+    position = instruments[0].detector.center
+    if any(not np.array_equal(q.detector.center, position)
+           for q in instruments[1:]):
+        return [_get_projection_operators([q], sampling, scene,
+                                          verbose=verbose,
+                                          max_nbytes=max_nbytes)[0]
+                for q in instruments]
+
+    peaks = [QubicInstrument._get_projection_peaks(
+                 scene, q.filter.nu, position, q.synthbeam,
+                 getattr(q, 'horn', None), getattr(q, 'primary_beam', None),
+                 q.thetafits, q.phifits, q.valfits, q.use_file, q.freqs)
+             for q in instruments]
+
+    operators = len(instruments) * [None]
+    filenames = len(instruments) * [None]
+    for i, q in enumerate(instruments):
+        cache = getattr(q, 'projection_cache', None)
+        if cache is None:
+            continue
+        key = _get_projection_cache_key(
+            sampling, scene, q.filter.nu, position, q.synthbeam, peaks[i])
+        filenames[i] = os.path.join(cache, key + '.npy')
+        if os.path.exists(filenames[i]):
+            if verbose:
+                print('Loading the projection matrix from {}.'.format(
+                    filenames[i]))
+            operators[i] = _load_projection_operator(
+                filenames[i], scene, len(q), len(sampling))
+
+    missing = [i for i, o in enumerate(operators) if o is None]
+    if len(missing) == 0:
+        return operators
+
+    if sampling.fix_az:
+        rotation = sampling.cartesian_horizontal2instrument
+    else:
+        rotation = sampling.cartesian_galactic2instrument
+
+    for i in missing:
+        q = instruments[i]
+        if getattr(q, 'projection_compact', False):
+            operators[i] = CompactProjectionOperator(
+                rotation, scene, position, q.synthbeam, peaks[i],
+                block_size=getattr(q, 'projection_block_size', None),
+                dtype_angle=getattr(q, 'projection_compact_dtype', None))
+            if verbose:
+                print('The compact projection matrix takes {} bytes.'.format(
+                    operators[i].nbytes))
+    missing = [i for i, o in enumerate(operators) if o is None]
+    if len(missing) == 0:
+        return operators
+
+    if max_nbytes is not None:
+        for i in missing:
+            P = OnTheFlyProjectionOperator(
+                rotation, scene, position, instruments[i].synthbeam, peaks[i],
+                max_nbytes=max_nbytes,
+                block_size=getattr(instruments[i], 'projection_block_size',
+                                   None))
+            if len(P.chunks) > 1:
+                if verbose:
+                    print('The projection matrix is computed on the fly by '
+                          '{} time chunks.'.format(len(P.chunks)))
+                operators[i] = P
+        missing = [i for i, o in enumerate(operators) if o is None]
+        if len(missing) == 0:
+            return operators
+
+    projections = QubicInstrument._get_projection_operators(
+        rotation, scene, position, instruments[0].synthbeam,
+        [peaks[i] for i in missing], verbose=verbose,
+        block_size=getattr(instruments[0], 'projection_block_size', None))
+    for i, P in zip(missing, projections):
+        operators[i] = P
+        if filenames[i] is not None:
+            _save_projection_operator(filenames[i], P)
+    return operators
+
+
+def _save_projection_operator(filename, projection):
+    """
+    Store the sparse data of a peak sampling operator in a .npy file, which
+    concurrent processes never memory-map partially written.
+
+    """
+    def write(tmpname):
+        with open(tmpname, 'wb') as f:
+            np.save(f, np.asarray(projection.matrix.data))
+    _atomic_write(filename, write)
+
+
+def _load_projection_operator(filename, scene, ndetectors, ntimes):
+    """
+    Return the peak sampling operator whose sparse data are memory-mapped
+    from a file written by _save_projection_operator. The mapping is
+    copy-on-write, so that in-place restrictions do not alter the file.
+
+    """
+    data = np.load(filename, mmap_mode='c')
+    cls = {'I': FSRMatrix,
+           'QU': FSRRotation2dMatrix,
+           'IQU': FSRRotation3dMatrix}[scene.kind]
+    ndims = len(scene.kind)
+    s = cls((ndetectors * ntimes * ndims, len(scene) * ndims), data=data)
+    if scene.kind == 'I':
+        shapeout = (ndetectors, ntimes)
+    else:
+        shapeout = (ndetectors, ntimes, ndims)
+    return ProjectionOperator(s, shapeout=shapeout)
+
+
 class QubicMultibandInstrument:
     """
     The QubicMultibandInstrument class
@@ -2055,6 +2589,36 @@ class QubicMultibandInstrument:
     def __len__(self):
         return len(self.subinstruments)
 
+    def get_projection_operators(self, sampling, scene, verbose=True):
+        """
+        Return the list of the sub-band peak sampling operators. The pointing
+        rotation is shared by the sub-bands and their peaks are projected
+        onto the scene in a single pass.
+
+        Parameters
+        ----------
+        sampling : QubicSampling
+            The pointing information.
+        scene : QubicScene
+            The observed scene.
+        verbose : bool, optional
+            If true, display information about the memory allocation.
+
+        """
+        return _get_projection_operators(
+            self.subinstruments, sampling, scene, verbose=verbose)
+
+    def get_noise_photon_nep(self, scene):
+        """
+        Return the photon noise NEPs of the sub-bands (#subbands, #det).
+        The sub-bands with the same optical configuration are evaluated
+        once, and the thermal integrals of the optical components, which do
+        not depend on the sub-band frequency, are shared by all of them.
+
+        """
+        return np.array([q._get_noise_photon_nep(scene)
+                         for q in self.subinstruments])
+
     def get_synthbeam(self, scene, idet=None, theta_max=45, detector_integrate=None, detpos=None):
         sb = map(lambda i: i.get_synthbeam(scene, idet, theta_max,
                                            detector_integrate=detector_integrate, detpos=detpos),
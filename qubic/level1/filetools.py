@@ -11,6 +11,7 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 utilities to write and read QUBIC Level-1 data files
 '''
 import os
+import datetime as dt
 import numpy as np
 from astropy.io import fits
 
@@ -22,16 +23,36 @@ hdr_comment['FILETYPE'] = 'File identification'
 hdr_comment['DATASET'] = 'QubicStudio dataset name'
 hdr_comment['FILENAME'] = 'name of this file'
 hdr_comment['FILEDATE'] = 'UT date this file was created'
+hdr_comment['NDET'] = 'number of detectors'
+hdr_comment['NSAMPLES'] = 'number of time samples'
 hdr_keys = hdr_comment.keys()
 
-def write_level1(fpobject,todarray,flagarray):
+# default number of time samples read at once by read_level1_chunks
+chunk_size = 2**16
+
+def write_level1(fpobject,todarray,flagarray,hk=None,filename=None):
     '''
     write a fits file with Level-1 data
+
+    The TOD and the flags are written as (ndet,nsamples) images, so that they are contiguous
+    on disk and can be memory-mapped or read by chunks (see read_level1 and read_level1_chunks).
+    The flags are the 64-bit integers defined in qubic.level1.flags, stored as 64-bit signed
+    integers without scaling.
+
+    hk is an optional dictionary of housekeeping arrays sampled on the time axis of the TOD
+    (for example: time, azimuth, elevation, HWP position, calsource interpolated to the data time axis)
     '''
-    
+    todarray = np.asarray(todarray)
+    flagarray = np.asarray(flagarray,dtype=np.uint64)
+    if todarray.ndim==1: todarray = todarray.reshape((1,-1))
+    if flagarray.ndim==1: flagarray = flagarray.reshape((1,-1))
+    if flagarray.shape!=todarray.shape:
+        print('ERROR! The flag array has shape %s instead of %s' % (flagarray.shape,todarray.shape))
+        return None
+    ndet,nsamples = todarray.shape
+
     # initialize
     filename_suffix = '_level1.fits'
-    filename = fpobject.dataset_name
     hdr = {}
     for key in hdr_keys:
         hdr[key] = None
@@ -39,7 +60,11 @@ def write_level1(fpobject,todarray,flagarray):
     hdr['FILETYPE'] = 'LEVEL1'
     hdr['FILEDATE'] = dt.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
     hdr['DATASET'] = fpobject.dataset_name    
-    hdr['FILENAME'] = filename+filename_suffix
+    if filename is None:
+        filename = fpobject.dataset_name+filename_suffix
+    hdr['FILENAME'] = os.path.basename(filename)
+    hdr['NDET'] = ndet
+    hdr['NSAMPLES'] = nsamples
 
     # Primary header
     prihdr = fits.Header()
@@ -63,13 +88,13 @@ def write_level1(fpobject,todarray,flagarray):
     # prepare the hdulist
     hdulist = [prihdu]
 
-    # HDU with the level-1 array and the flagarray
-    # formats defined at https://docs.astropy.org/en/stable/io/fits/usage/table.html
-    col1 = fits.Column(name='TODarray', format='D', unit='ADU', array=todarray)
-    col1 = fits.Column(name='flags', format='K', unit='UINT', array=flagarray)
-    cols  = fits.ColDefs([col1,col2])
-    tbhdu = fits.BinTableHDU.from_columns(cols)
-    hdulist.append(tbhdu)
+    # HDUs with the level-1 array and the flag array, one row per detector
+    todhdu = fits.ImageHDU(np.asarray(todarray,dtype=np.float64),name='TOD')
+    todhdu.header['BUNIT'] = 'ADU'
+    hdulist.append(todhdu)
+    flaghdu = fits.ImageHDU(flagarray.view(np.int64),name='FLAGS')
+    flaghdu.header['COMMENT'] = 'bit values of the 64-bit flags'
+    hdulist.append(flaghdu)
 
     # make another HDU with the housekeeping data
     # 300mK stage Temperature
@@ -81,17 +106,79 @@ def write_level1(fpobject,todarray,flagarray):
     # calsource info and value interpolated to data time axis
     # carbon fibre parameters
     # horn status
+    cols = []
+    if hk is not None:
+        for key in hk.keys():
+            val = np.asarray(hk[key],dtype=np.float64)
+            if val.shape!=(nsamples,):
+                print('ERROR! The housekeeping %s does not have %i samples' % (key,nsamples))
+                return None
+            cols.append(fits.Column(name=key, format='D', array=val))
+    hkhdu = fits.BinTableHDU.from_columns(fits.ColDefs(cols),name='HK')
+    hdulist.append(hkhdu)
     
     # write the FITS file
     thdulist = fits.HDUList(hdulist)
-    thdulist.writeto(hdr['FILENAME'],overwrite=True)
-    print('Level-1 data written to file: %s' % hdr['FILENAME'])
-    return
+    thdulist.writeto(filename,overwrite=True)
+    print('Level-1 data written to file: %s' % filename)
+    return filename
 
 
 def read_level1(filename):
     '''
     read a QUBIC Level-1 fits file
+
+    return a dictionary with the primary header, and the TOD, flags and housekeeping data.
+    The TOD and flag arrays of shape (ndet,nsamples) are memory-mapped: only the slices
+    which are used are read from disk.  The file is closed with the 'hdulist' entry.
+    '''
+    hdulist = open_level1(filename)
+    if hdulist is None: return None
+
+    level1 = {}
+    level1['hdulist'] = hdulist
+    level1['header'] = hdulist[0].header
+    level1['tod'] = hdulist['TOD'].data
+    level1['flags'] = _flags_view(hdulist['FLAGS'].data)
+    hkdata = hdulist['HK'].data
+    level1['hk'] = {}
+    if hkdata is not None:
+        for key in hkdata.names:
+            level1['hk'][key] = hkdata[key]
+    return level1
+
+
+def read_level1_chunks(filename,nsamples=None,detectors=None,start=0,stop=None):
+    '''
+    read a QUBIC Level-1 fits file by chunks of time samples
+
+    this is a generator which returns for each chunk the time slice, and the TOD and the flags
+    of the requested detectors (all of them by default) in that time slice.
+    only the chunk is read from disk, so that multi-hour datasets can be processed
+    without loading them in memory.
+    '''
+    hdulist = open_level1(filename)
+    if hdulist is None: return
+
+    if nsamples is None: nsamples = chunk_size
+    if detectors is None: detectors = slice(None)
+    ntotal = hdulist[0].header['NSAMPLES']
+    start, stop, _ = slice(start,stop).indices(ntotal)
+    tod = hdulist['TOD'].section
+    flags = hdulist['FLAGS'].section
+    try:
+        for idx in range(start,stop,nsamples):
+            chunk = slice(idx,min(idx+nsamples,stop))
+            yield chunk, \
+                np.asarray(tod[detectors,chunk]), \
+                _flags_view(np.asarray(flags[detectors,chunk]))
+    finally:
+        hdulist.close()
+
+
+def open_level1(filename):
+    '''
+    open a QUBIC Level-1 fits file with memory-mapping, after checking that it is valid
     '''
 
     if not os.path.exists(filename):
@@ -102,22 +189,29 @@ def read_level1(filename):
         print('ERROR! Not a file: %s' % filename)
         return None
 
-    hdulist = fits.open(filename)
+    hdulist = fits.open(filename,memmap=True)
     nhdu = len(hdulist)
-    if nhdu < 3:
+    if nhdu < 4:
         print('ERROR! File does not have the necessary data: %s' % filename)
+        hdulist.close()
         return None
 
     prihdr = hdulist[0].header
     if 'TELESCOP' not in prihdr.keys() or prihdr['TELESCOP']!='QUBIC':
         print('ERROR! Not a QUBIC file: %s' % filename)
+        hdulist.close()
         return None
 
     if 'FILETYPE' not in prihdr.keys() or prihdr['FILETYPE']!='LEVEL1':
         print('ERROR! Not a QUBIC Level-1 file: %s' % filename)
+        hdulist.close()
         return None
 
+    return hdulist
 
-              
-    hdulist.close()
-    return ok
+
+def _flags_view(flags):
+    '''
+    view the stored 64-bit signed integers as the unsigned flags
+    '''
+    return flags.view(flags.dtype.str.replace('i','u'))
@@ -3,19 +3,26 @@ from collections import OrderedDict
 from pyoperators import (
     MPI, asoperator, BlockColumnOperator, DiagonalOperator, PackOperator, pcg,
     proxy_group)
+from pyoperators.iterative.cg import PCGAlgorithm
+from pyoperators.iterative.core import (
+    AbnormalStopIteration, IterativeAlgorithm)
 from pyoperators.memory import ones
 from pyoperators.utils import ndarraywrap
-from pyoperators.utils.mpi import as_mpi
+from pyoperators.utils.mpi import as_mpi, timer_mpi
 from pysimulators.interfaces.healpy import HealpixLaplacianOperator
-from .utils import progress_bar
+from .utils import _atomic_write, progress_bar
 import healpy as hp
 import numpy as np
+import os
+import time
 
 __all__ = ['angular_distance_from_mask',
            'apodize_mask',
            'map2tod',
+           'pcg_checkpoint',
            'tod2map_all',
-           'tod2map_each']
+           'tod2map_each',
+           'tod2map_stream']
 
 
 def angular_distance_from_mask(mask):
@@ -148,7 +155,8 @@ def map2tod(acq, map, convolution=False, max_nbytes=None):
 
 
 def _tod2map(acq, tod, coverage_threshold, max_nbytes, callback,
-             disp_pcg, maxiter, tol, criterion, full_output, save_map, hyper):
+             disp_pcg, maxiter, tol, criterion, full_output, save_map, hyper,
+             preconditioner='diagonal'):
     # coverage normalization:
     # sum coverage = #detectors x #samplings for a uniform secondary beam
     H = acq.get_operator()
@@ -183,8 +191,11 @@ def _tod2map(acq, tod, coverage_threshold, max_nbytes, callback,
     acq_restricted = acq[..., mask]
     H = acq_restricted.get_operator()
     invNtt = acq_restricted.get_invntt_operator()
-    M = (H.T * H * np.ones(H.shapein))[..., 0]
-    preconditioner = DiagonalOperator(1/M, broadcast='rightward')
+    if preconditioner == 'block_jacobi':
+        preconditioner = acq_restricted.get_block_jacobi_preconditioner(invNtt)
+    else:
+        M = (H.T * H * np.ones(H.shapein))[..., 0]
+        preconditioner = DiagonalOperator(1/M, broadcast='rightward')
 #    preconditioner = DiagonalOperator(1/coverage[mask], broadcast='rightward')
     nsamplings = acq.sampling.comm.allreduce(len(acq.sampling))
     npixels = np.sum(mask)
@@ -244,7 +255,8 @@ def _tod2map(acq, tod, coverage_threshold, max_nbytes, callback,
 
 def tod2map_all(acquisition, tod, coverage_threshold=0.01, max_nbytes=None,
                 callback=None, disp=True, maxiter=300, tol=1e-4,
-                criterion=False, full_output=False, save_map=None, hyper=0):
+                criterion=False, full_output=False, save_map=None, hyper=0,
+                preconditioner='diagonal'):
     """
     Compute map using all detectors.
 
@@ -280,6 +292,11 @@ def tod2map_all(acquisition, tod, coverage_threshold=0.01, max_nbytes=None,
     criterion : boolean, optional
         If True, also display the criterion at each iteration. It slows down
         the solving process.
+    preconditioner : 'diagonal' or 'block_jacobi', optional
+        The diagonal preconditioner is the inverse of H.T * H * 1. The
+        block-Jacobi preconditioner inverts, for each pixel, the block of
+        H.T * invNtt * H coupling its Stokes parameters, which reduces the
+        number of iterations for the polarized scenes.
 
     Returns
     -------
@@ -290,7 +307,7 @@ def tod2map_all(acquisition, tod, coverage_threshold=0.01, max_nbytes=None,
     """
     return _tod2map(acquisition, tod, coverage_threshold, max_nbytes,
                     callback, disp, maxiter, tol, criterion, full_output,
-                    save_map, hyper)
+                    save_map, hyper, preconditioner)
 
 
 def tod2map_each(acquisition, tod, coverage_threshold=0.01, max_nbytes=None,
@@ -359,3 +376,250 @@ def tod2map_each(acquisition, tod, coverage_threshold=0.01, max_nbytes=None,
     if acquisition.scene.kind == 'I':
         return np.nan_to_num(x / n), n
     return np.nan_to_num(x / n[:, None]), n
+
+
+def tod2map_stream(chunks, writer=None):
+    """
+    Accumulate the transposed acquisition operator over the chunks of a
+    streamed observation, so that the binned map is obtained with a memory
+    bounded by the chunk size.
+
+    rhs, coverage = tod2map_stream(
+        acquisition.get_observation_chunks(map, return_operator=True))
+
+    Parameters
+    ----------
+    chunks : iterable
+        The (chunk, tod, operator) tuples, as generated by the
+        get_observation_chunks methods with return_operator=True.
+    writer : function, optional
+        User-supplied function to store the TOD, called as
+        writer(chunk, tod) for each chunk.
+
+    Returns
+    -------
+    rhs : I, QU or IQU maps
+        The sum of operator.T(tod) over the chunks.
+    coverage : array
+        The sum of the transposed operators applied to unit TOD, i.e. the
+        coverage map (of the I component for the QU or IQU maps). For the
+        I maps, rhs / coverage is the binned map.
+
+    """
+    rhs = None
+    for chunk, tod, H in chunks:
+        if writer is not None:
+            writer(chunk, tod)
+        if rhs is None:
+            rhs = np.zeros(H.shapein)
+            coverage = np.zeros(H.shapein)
+        rhs += H.T(tod)
+        coverage += H.T(np.ones(H.shapeout))
+    if rhs is None:
+        raise ValueError('The observation has no time chunk.')
+    if coverage.ndim > 1:
+        coverage = coverage[..., 0]
+    return rhs, coverage
+
+
+def pcg_checkpoint(A, b, x0=None, tol=1e-5, maxiter=300, M=None, disp=False,
+                   callback=None, checkpoint=None, checkpoint_every=10):
+    """
+    Preconditioned conjugate gradient solver of A x = b, whose state can be
+    saved on disk every few iterations, so that a run interrupted by a
+    wall-time limit can be resumed where it stopped.
+
+    output = pcg_checkpoint(A, b, [x0, tol, maxiter, M, disp, callback,
+                            checkpoint, checkpoint_every])
+
+    The state of the solver (x, the residual r, the search direction p,
+    the iteration number and the residual history) is written in the
+    checkpoint file. If this file exists when the solver is started, the
+    iterations are resumed from it and the initial guess x0 is ignored:
+    since the whole state is restored, the resumed iterations are
+    identical to those of an uninterrupted run. The file is also updated
+    when the solver stops, so that a converged run is not solved again and
+    a run which reached maxiter can be continued with a larger maxiter.
+
+    Parameters
+    ----------
+    A : Operator
+        The symmetric positive definite operator of the linear system.
+    b : array
+        Right hand side of the linear system.
+    x0 : array, optional
+        Starting guess for the solution, such as the map of a previous run
+        (warm start).
+    tol : float, optional
+        Tolerance on the relative residual ||A x - b|| / ||b||.
+    maxiter : integer, optional
+        Maximum number of iterations, including those performed before the
+        solver was resumed.
+    M : Operator, optional
+        Preconditioner for A.
+    disp : boolean, optional
+        Display of the solver's iterations, with their wall time and the time
+        spent in the MPI communications.
+    callback : function, optional
+        User-supplied function to call after each iteration. It is called as
+        callback(solver), where solver is an Algorithm instance.
+    checkpoint : str, optional
+        Name of the checkpoint file. If the operator input is distributed
+        over several MPI processes, each process uses its own file, suffixed
+        by its rank. Otherwise, the solve is assumed to be replicated on the
+        processes of MPI.COMM_WORLD: the file is written by the first process
+        and, when the solver is resumed, read by it and broadcast to the
+        others. If None, the state of the solver is not saved.
+    checkpoint_every : int, optional
+        Number of iterations between two checkpoints.
+
+    Returns
+    -------
+    output : dict
+        The same dictionary as that returned by pyoperators' pcg, whose
+        'history' entry contains, for each iteration, the relative residual
+        ('error'), the wall time ('time') and the time spent in the MPI
+        communications, as measured by pyoperators' timer_mpi
+        ('time_allreduce').
+
+    """
+    time0 = time.time()
+    algo = _CheckpointPCGAlgorithm(
+        A, b, x0=x0, tol=tol, maxiter=maxiter, M=M, disp=disp,
+        callback=callback, checkpoint=checkpoint,
+        checkpoint_every=checkpoint_every)
+    try:
+        output = algo.run()
+        success = True
+        message = ''
+    except AbnormalStopIteration as e:
+        output = algo.finalize()
+        success = False
+        message = str(e)
+    algo.save_checkpoint()
+    return {'x': output,
+            'success': success,
+            'message': message,
+            'nit': algo.niterations,
+            'error': algo.error,
+            'time': time.time() - time0,
+            'history': algo.history,
+            'algorithm': algo}
+
+
+class _CheckpointPCGAlgorithm(PCGAlgorithm):
+    """
+    PCG algorithm whose state is periodically saved in a checkpoint file and
+    which records the wall time and MPI communication time of each
+    iteration.
+
+    """
+    def __init__(self, A, b, x0=None, tol=1e-5, maxiter=300, M=None,
+                 disp=False, callback=None, checkpoint=None,
+                 checkpoint_every=10):
+        PCGAlgorithm.__init__(self, A, b, x0=x0, tol=tol, maxiter=maxiter,
+                              M=M, disp=disp, callback=callback)
+        # communicator of the processes sharing the checkpoint of a
+        # replicated solve
+        self.checkpoint_comm = None
+        if checkpoint is not None:
+            if self.comm is not None and self.comm.size > 1:
+                checkpoint = '{}.{}'.format(checkpoint, self.comm.rank)
+            elif MPI.COMM_WORLD.size > 1:
+                self.checkpoint_comm = MPI.COMM_WORLD
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.history = {'error': [], 'time': [], 'time_allreduce': []}
+
+    def initialize(self):
+        self.history = {'error': [], 'time': [], 'time_allreduce': []}
+        state = self._read_checkpoint()
+        if state is None:
+            PCGAlgorithm.initialize(self)
+            return
+        IterativeAlgorithm.initialize(self)
+        self.load_checkpoint(state)
+        if self.error < self.tol:
+            raise StopIteration('Solver reached maximum tolerance.')
+
+    def iteration(self):
+        time0 = time.time()
+        time0_mpi = timer_mpi.elapsed
+        try:
+            PCGAlgorithm.iteration(self)
+        finally:
+            self.history['error'].append(float(self.error))
+            self.history['time'].append(time.time() - time0)
+            self.history['time_allreduce'].append(
+                timer_mpi.elapsed - time0_mpi)
+        if self.niterations % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    @staticmethod
+    def callback(self):
+        if self.disp:
+            print('{:4}: {} ({:.3f}s, allreduce {:.3f}s)'.format(
+                self.niterations, self.error, self.history['time'][-1],
+                self.history['time_allreduce'][-1]))
+
+    def load_checkpoint(self, state):
+        """
+        Restore the state of the solver from the content of the checkpoint
+        file.
+
+        """
+        if state['x'].shape != self.b.shape or \
+           not np.allclose(state['b_norm'], self.b_norm, rtol=1e-8):
+            raise ValueError(
+                "The checkpoint file '{}' does not match the linear system."
+                .format(self.checkpoint))
+        self.x[...] = state['x']
+        self.r[...] = state['r']
+        self.d[...] = state['p']
+        self.delta = state['delta'][()]
+        self.error = state['error'][()]
+        self.niterations = int(state['niterations'])
+        for key in self.history:
+            self.history[key] = state['history_' + key].tolist()
+        if self.disp and (self.comm is None or self.comm.rank == 0):
+            print('Resuming the PCG from iteration {} of {}.'.format(
+                self.niterations, self.checkpoint))
+
+    def save_checkpoint(self):
+        """
+        Save the state of the solver in the checkpoint file. A job killed
+        while writing it leaves the previous checkpoint intact.
+
+        """
+        if self.checkpoint is None or not hasattr(self, 'delta'):
+            return
+        if self.checkpoint_comm is not None and self.checkpoint_comm.rank > 0:
+            return
+        history = dict(('history_' + k, np.array(v, float))
+                       for k, v in self.history.items())
+
+        def write(tmpname):
+            with open(tmpname, 'wb') as f:
+                np.savez(f, x=self.x, r=self.r, p=self.d, delta=self.delta,
+                         error=self.error, b_norm=self.b_norm,
+                         niterations=self.niterations, **history)
+        _atomic_write(self.checkpoint, write)
+
+    def _read_checkpoint(self):
+        """
+        Return the content of the checkpoint file as a dictionary, or None if
+        there is no such file. For a replicated solve, the file is read by
+        the first process and broadcast to the others.
+
+        """
+        if self.checkpoint is None:
+            return None
+        state = None
+        comm = self.checkpoint_comm
+        if (comm is None or comm.rank == 0) and \
+           os.path.exists(self.checkpoint):
+            with np.load(self.checkpoint) as data:
+                state = dict(data)
+        if comm is not None:
+            state = comm.bcast(state, root=0)
+        return state
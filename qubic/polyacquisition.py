@@ -1,6 +1,7 @@
 # coding: utf-8
 from __future__ import division
 
+import copy
 import healpy as hp
 import numpy as np
 import warnings
@@ -17,7 +18,9 @@ import qubic
 from .data import PATH
 from .acquisition import (QubicAcquisition,
                           PlanckAcquisition,
-                          QubicPlanckAcquisition)
+                          QubicPlanckAcquisition,
+                          _get_block_jacobi_preconditioner)
+from .mapmaking import pcg_checkpoint
 from .scene import QubicScene
 from .samplings import create_random_pointings, get_pointing
 
@@ -191,8 +194,26 @@ class QubicPolyAcquisition(object):
         a = self._get_average_instrument_acq()
         return a.get_noise()
 
+    def get_projection_operators(self, verbose=True):
+        """
+        Return the peak sampling operators of the subacquisitions. Unless the
+        sampling is partitioned in several blocks, they are computed together
+        so that the pointing rotation is evaluated only once for all the
+        sub-frequencies.
+
+        """
+        if len(self[0].block) != 1:
+            return [a.get_projection_operator(verbose=verbose) for a in self]
+        from .instrument import _get_projection_operators
+        projections = _get_projection_operators(
+            [a.instrument for a in self], self[0].sampling, self.scene,
+            verbose=verbose, max_nbytes=self[0].max_nbytes)
+        return [BlockColumnOperator([P], axisout=1) for P in projections]
+
     def _get_array_of_operators(self):
-        return [a.get_operator() * w for a, w in zip(self, self.weights)]
+        projections = self.get_projection_operators()
+        return [a.get_operator(projection=P) * w
+                for a, P, w in zip(self, projections, self.weights)]
 
     def get_operator_to_make_TOD(self):
         """
@@ -271,6 +292,77 @@ class QubicPolyAcquisition(object):
 
         return tod
 
+    def get_observation_chunks(self, m, nsamples=None, convolution=True,
+                               noiseless=False, seed=None,
+                               return_operator=False):
+        """
+        Generate the polychromatic TOD by time chunks, so that the full TOD
+        is never allocated. See QubicAcquisition.get_observation_chunks.
+
+        Parameters
+        ----------
+        m : np.array((N, npix, 3)) if self.scene.kind == 'IQU', else np.array((npix))
+            The input maps, as in get_observation.
+        nsamples : int, optional
+            The number of time samples of the chunks.
+        convolution : boolean, optional
+            If True, the map of each sub-frequency is convolved with its own
+            gaussian kernel and the TOD is [H1, H2, ...] * [m_conv1, ...].T.
+            Otherwise, the TOD is sum(H1, H2, ...) * m.
+        noiseless : boolean, optional
+            If True, no noise is added to the TOD.
+        seed : int or np.random.SeedSequence, optional
+            The seed of the noise realization.
+        return_operator : boolean, optional
+            If True, the operator sum(H1, H2, ...) of each chunk, used for
+            the map-making, is also yielded.
+
+        Yields
+        ------
+        chunk : slice
+            The time samples of the chunk.
+        tod : array
+            The TOD of the chunk, of shape (ndetectors, nsamples).
+        operator : Operator
+            The acquisition operator of the chunk, if return_operator is set.
+
+        """
+        if convolution:
+            m = np.array([a.get_convolution_peak_operator()(m[i])
+                          for i, a in enumerate(self)])
+        if noiseless:
+            noise = None
+        else:
+            noise = self._get_average_instrument_acq()._get_noise_stream(seed)
+        for chunk in self[0]._get_time_chunks(nsamples):
+            acq = self._get_chunk_acquisition(chunk)
+            # the sub-band operators are built once for the TOD and for the
+            # map-making operator
+            if len(acq) == 1:
+                H = acq.get_operator()
+                H_tod = H
+            else:
+                op = acq._get_array_of_operators()
+                H = np.sum(np.array(op), axis=0)
+                H_tod = BlockRowOperator(op, new_axisin=0)
+            tod = (H_tod if convolution else H)(m)
+            if noise is not None:
+                tod += noise(chunk.stop - chunk.start)
+            if return_operator:
+                yield chunk, tod, H
+            else:
+                yield chunk, tod
+
+    def _get_chunk_acquisition(self, chunk):
+        """
+        Return the polychromatic acquisition restricted to a chunk of time
+        samples.
+
+        """
+        out = copy.copy(self)
+        out.subacqs = [a._get_chunk_acquisition(chunk) for a in self]
+        return out
+
     def get_preconditioner(self, cov):
         if cov is not None:
             cov_inv = 1 / cov
@@ -280,9 +372,40 @@ class QubicPolyAcquisition(object):
             preconditioner = None
         return preconditioner
 
-    def tod2map(self, tod, d, cov=None):
+    def get_block_jacobi_preconditioner(self, invntt=None, separate=False):
+        """
+        Return the block-Jacobi preconditioner of the map-making equation,
+        whose 3x3 blocks (for an IQU scene) couple the Stokes parameters of
+        each pixel. The blocks of all the sub-acquisitions are assembled
+        together, in a single pass over their peak sampling matrices.
+
+        Parameters
+        ----------
+        invntt : Operator, optional
+            The inverse time-time noise correlation operator. If it is not
+            diagonal, the white noise level of the detectors is used.
+        separate : boolean, optional
+            If true, the preconditioner is that of the operator returned by
+            get_operator_to_make_TOD, which observes one map per
+            sub-frequency: its blocks of size len(self) * 3 also couple the
+            sub-frequencies of each pixel.
+
+        """
+        projections = self.get_projection_operators(verbose=False)
+        terms = [a._get_preconditioner_term(invntt, projection=P, weight=w,
+                                            slot=i if separate else 0)
+                 for i, (a, P, w) in enumerate(
+                     zip(self, projections, self.weights))]
+        return _get_block_jacobi_preconditioner(
+            self.scene, terms, nslots=len(self) if separate else 1,
+            comm=self[0].comm)
+
+    def tod2map(self, tod, d, cov=None, x0=None):
         """
-        Reconstruct map from tod
+        Reconstruct map from tod. The PCG state is saved every
+        d['checkpoint_every'] iterations in the file d['checkpoint'], if it
+        is specified, from which an interrupted run is resumed. The solver
+        can be warm-started from the map x0 of a previous run.
         """
         tol = d['tol']
         maxiter = d['maxiter']
@@ -293,9 +416,14 @@ class QubicPolyAcquisition(object):
         A = H.T * invntt * H
         b = H.T * invntt * tod
 
-        preconditioner = self.get_preconditioner(cov)
-        solution = pcg(A, b, M=preconditioner,
-                       disp=verbose, tol=tol, maxiter=maxiter)
+        if d.get('preconditioner') == 'block_jacobi':
+            preconditioner = self.get_block_jacobi_preconditioner(invntt)
+        else:
+            preconditioner = self.get_preconditioner(cov)
+        solution = pcg_checkpoint(
+            A, b, x0=x0, M=preconditioner, disp=verbose, tol=tol,
+            maxiter=maxiter, checkpoint=d.get('checkpoint'),
+            checkpoint_every=d.get('checkpoint_every', 10))
         return solution['x'], solution['nit'], solution['error']
 
 
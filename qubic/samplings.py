@@ -1,30 +1,30 @@
 # coding: utf-8
 from __future__ import division, print_function
 
+import functools
 import numpy as np
 from astropy.time import Time, TimeDelta
 from numpy.random import random_sample as randomu
 from pyoperators import (
-    Cartesian2SphericalOperator, Rotation3dOperator,
-    Spherical2CartesianOperator, rule_manager)
+    Cartesian2SphericalOperator, DenseBlockDiagonalOperator,
+    Rotation3dOperator, Spherical2CartesianOperator, rule_manager)
 from pyoperators.utils import deprecated, isscalarlike
 from pysimulators import (
-    CartesianEquatorial2GalacticOperator,
     CartesianEquatorial2HorizontalOperator,
-    CartesianHorizontal2EquatorialOperator,
     CartesianGalactic2EquatorialOperator,
     SamplingHorizontal,
     SphericalEquatorial2GalacticOperator,
-    SphericalGalactic2EquatorialOperator,
-    SphericalEquatorial2HorizontalOperator,
-    SphericalHorizontal2EquatorialOperator)
+    SphericalGalactic2EquatorialOperator)
 from pysimulators.interfaces.healpy import Cartesian2HealpixOperator
+from .utils import _digest
 
 __all__ = ['QubicSampling',
            'get_pointing',
            'create_random_pointings',
            'create_repeat_pointings',
            'create_sweeping_pointings',
+           'create_sweeping_pointings_deadtime',
+           'iter_sweeping_pointings',
            'equ2gal',
            'equ2hor',
            'gal2equ',
@@ -81,14 +81,28 @@ class QubicSampling(SamplingHorizontal):
         SamplingHorizontal.__init__(self, angle_hwp=angle_hwp, healpix=None,
                                     *args, **keywords)
 
+    def __getitem__(self, selection):
+        out = SamplingHorizontal.__getitem__(self, selection)
+        if out is self:
+            return out
+        # the rotation matrices of the selected samples are reused
+        selection = self._normalize_selection(selection, (len(self),))
+        rotations = {}
+        for frame, (key, data) in self.__dict__.get('_rotations', {}).items():
+            if key == self._get_rotation_key(frame):
+                data = data[selection]
+                rotations[frame] = out._get_rotation_key(frame), data
+        out._rotations = rotations
+        return out
+
     def healpix(self, nside):
-        time = self.date_obs + TimeDelta(self.time, format='sec')
+        """
+        Return the Healpix pixels of the pointing directions.
+
+        """
         c2h = Cartesian2HealpixOperator(nside)
-        e2g = CartesianEquatorial2GalacticOperator()
-        h2e = CartesianHorizontal2EquatorialOperator(
-            'NE', time, self.latitude, self.longitude)
-        rotation = c2h(e2g(h2e))
-        return rotation(self.cartesian)
+        # the pointing direction is the instrument z axis
+        return c2h(self.get_rotation_matrices('galactic')[:, 2])
 
     @property
     def cartesian_galactic2instrument(self):
@@ -96,14 +110,8 @@ class QubicSampling(SamplingHorizontal):
         Return the galactic-to-instrument transform.
 
         """
-        time = self.date_obs + TimeDelta(self.time, format='sec')
-        with rule_manager(none=False):
-            r = Rotation3dOperator("ZY'Z''", self.azimuth, 90 - self.elevation,
-                                   self.pitch, degrees=True).T * \
-                CartesianEquatorial2HorizontalOperator(
-                    'NE', time, self.latitude, self.longitude) * \
-                CartesianGalactic2EquatorialOperator()
-        return r
+        return DenseBlockDiagonalOperator(
+            self.get_rotation_matrices('galactic'), naxesin=1, naxesout=1)
 
     @property
     def cartesian_instrument2galactic(self):
@@ -112,18 +120,73 @@ class QubicSampling(SamplingHorizontal):
     @property
     def cartesian_horizontal2instrument(self):
         """
-        Return the galactic-to-instrument transform.
+        Return the horizontal-to-instrument transform.
+
         """
-        time = self.date_obs + TimeDelta(self.time, format='sec')
-        with rule_manager(none=False):
-            r = Rotation3dOperator("ZY'Z''", self.azimuth, 90 - self.elevation,
-                                   self.pitch, degrees=True).T
-        return r
+        return DenseBlockDiagonalOperator(
+            self.get_rotation_matrices('horizontal'), naxesin=1, naxesout=1)
 
     @property
     def cartesian_instrument2horizontal(self):
         return self.cartesian_horizontal2instrument.I
 
+    def get_rotation_matrices(self, frame='galactic'):
+        """
+        Return the per-sample rotation matrices from the galactic or
+        horizontal frame to the instrument frame, as a C-contiguous array of
+        shape (ntimes, 3, 3).
+
+        The matrices are computed once and stored in the sampling, which
+        they follow when it is sliced or pickled. They are recomputed when
+        the pointing, the time samples or the observation site change. If
+        the rotation_step attribute is set, the equatorial-to-horizontal
+        rotation (the Earth rotation and the precession) is evaluated on a
+        time grid of this step, in seconds, and interpolated.
+
+        Parameters
+        ----------
+        frame : 'galactic' or 'horizontal'
+            The reference frame of the sky coordinates.
+
+        """
+        if frame not in ('galactic', 'horizontal'):
+            raise ValueError("Invalid frame '{}'.".format(frame))
+        rotations = self.__dict__.get('_rotations', {})
+        key = self._get_rotation_key(frame)
+        if frame in rotations and rotations[frame][0] == key:
+            return rotations[frame][1]
+        with rule_manager(none=False):
+            r = Rotation3dOperator("ZY'Z''", self.azimuth, 90 - self.elevation,
+                                   self.pitch, degrees=True).T
+        data = np.asarray(r.data)
+        if data.ndim == 2:
+            data = np.resize(data, (len(self), 3, 3))
+        if frame == 'galactic':
+            data = np.matmul(data, _get_sky_rotation(
+                self.date_obs, self.time, self.latitude, self.longitude,
+                self.rotation_step))
+        data = np.ascontiguousarray(data)
+        data.flags.writeable = False
+        # the cache is not updated in-place, since it is shared by copies
+        rotations = dict(rotations)
+        rotations[frame] = key, data
+        self._rotations = rotations
+        return data
+
+    def _get_rotation_key(self, frame):
+        """
+        Return the digest of the parameters of the rotation matrices.
+
+        """
+        items = [frame, self.azimuth, self.elevation, self.pitch]
+        if frame == 'galactic':
+            items += [self.time, str(self.date_obs), self.latitude,
+                      self.longitude, self.rotation_step]
+        return _digest(*items)
+
+    # time step [s] of the interpolation of the sky rotation, if not None
+    rotation_step = None
+
 
 @deprecated
 class QubicPointing(QubicSampling):
@@ -137,37 +200,40 @@ def get_pointing(d):
     center = (d['RA_center'], d['DEC_center'])
 
     if d['random_pointing'] is True:
-        return create_random_pointings(center, d['npointings'], d['dtheta'], d['hwp_stepsize'],
-                                       date_obs=d['date_obs'], period=d['period'],
-                                       latitude=d['latitude'],
-                                       longitude=d['longitude'], seed=d['seed'])
+        p = create_random_pointings(center, d['npointings'], d['dtheta'], d['hwp_stepsize'],
+                                    date_obs=d['date_obs'], period=d['period'],
+                                    latitude=d['latitude'],
+                                    longitude=d['longitude'], seed=d['seed'])
 
     elif d['repeat_pointing'] is True:
-        return create_repeat_pointings(center, d['npointings'], d['dtheta'], d['nhwp_angles'],
-                                       date_obs=d['date_obs'], period=d['period'],
-                                       latitude=d['latitude'],
-                                       longitude=d['longitude'], seed=d['seed'])
+        p = create_repeat_pointings(center, d['npointings'], d['dtheta'], d['nhwp_angles'],
+                                    date_obs=d['date_obs'], period=d['period'],
+                                    latitude=d['latitude'],
+                                    longitude=d['longitude'], seed=d['seed'])
 
     elif d['sweeping_pointing'] is True:
-        return create_sweeping_pointings(center, d['duration'], d['period'],
-                                         d['angspeed'], d['delta_az'],
-                                         d['nsweeps_per_elevation'],
-                                         d['angspeed_psi'], d['maxpsi'], d['hwp_stepsize'],
-                                         date_obs=d['date_obs'],
-                                         latitude=d['latitude'],
-                                         longitude=d['longitude'],
-                                         fix_azimuth=d['fix_azimuth'], random_hwp=d['random_hwp'])
+        p = create_sweeping_pointings(center, d['duration'], d['period'],
+                                      d['angspeed'], d['delta_az'],
+                                      d['nsweeps_per_elevation'],
+                                      d['angspeed_psi'], d['maxpsi'], d['hwp_stepsize'],
+                                      date_obs=d['date_obs'],
+                                      latitude=d['latitude'],
+                                      longitude=d['longitude'],
+                                      fix_azimuth=d['fix_azimuth'], random_hwp=d['random_hwp'],
+                                      seed=d['seed'])
     elif d['sweeping_pointing_deadtime'] is True:
-        return create_sweeping_pointings_deadtime(center, d['duration'], d['period'],
-                                         d['angspeed'], d['delta_az'],
-                                         d['nsweeps_per_elevation'],
-                                         d['angspeed_psi'], d['maxpsi'], d['hwp_stepsize'],
-                                         date_obs=d['date_obs'],
-                                         latitude=d['latitude'],
-                                         longitude=d['longitude'],
-                                         fix_azimuth=d['fix_azimuth'], 
-                                         random_hwp=d['random_hwp'],
-                                         dead_time=d['dead_time'])
+        p = create_sweeping_pointings_deadtime(center, d['duration'], d['period'],
+                                      d['angspeed'], d['delta_az'],
+                                      d['nsweeps_per_elevation'],
+                                      d['angspeed_psi'], d['maxpsi'], d['hwp_stepsize'],
+                                      date_obs=d['date_obs'],
+                                      latitude=d['latitude'],
+                                      longitude=d['longitude'],
+                                      fix_azimuth=d['fix_azimuth'], 
+                                      random_hwp=d['random_hwp'],
+                                      dead_time=d['dead_time'], seed=d['seed'])
+    p.rotation_step = d.get('rotation_step')
+    return p
 
 
 def create_random_pointings(center, npointings, dtheta, hwp_stepsize, date_obs=None,
@@ -310,7 +376,7 @@ def create_repeat_pointings(center, npointings, dtheta, nhwp_angles, date_obs=No
 def create_sweeping_pointings(
         center, duration, period, angspeed, delta_az, nsweeps_per_elevation,
         angspeed_psi, maxpsi, hwp_stepsize, date_obs=None, latitude=None, longitude=None, fix_azimuth=None, 
-        random_hwp=True):
+        random_hwp=True, seed=None):
     """
     Return pointings according to the sweeping strategy:
     Sweep around the tracked FOV center azimuth at a fixed elevation, and
@@ -344,6 +410,8 @@ def create_sweeping_pointings(
     date_obs : str or astropy.time.Time, optional
         The starting date of the observation (UTC).
     random_hwp : bool
+    seed : int, np.random.SeedSequence or np.random.Generator, optional
+        The seed or the generator of the random HWP angles.
 
     Returns
     -------
@@ -352,85 +420,17 @@ def create_sweeping_pointings(
         in degrees.
 
     """
-    nsamples = int(np.ceil(duration * 3600 / period))
-    out = QubicSampling(
-        nsamples, date_obs=date_obs, period=period, latitude=latitude,
-        longitude=longitude)
-    racenter = center[0]
-    deccenter = center[1]
-    backforthdt = delta_az / angspeed * 2
-    print(backforthdt)
-
-    # compute the sweep number
-    isweeps = np.floor(out.time / backforthdt).astype(int)
-
-    # azimuth/elevation of the center of the field as a function of time
-
-    if fix_azimuth['apply']:
-        azcenter = out.time * 0 + fix_azimuth['az']
-        elcenter = out.time * 0 + fix_azimuth['el']
-    else:
-        azcenter, elcenter = equ2hor(racenter, deccenter, out.time, date_obs=out.date_obs, latitude=out.latitude,
-                                     longitude=out.longitude)
-
-    # compute azimuth offset for all time samples
-    daz = out.time * angspeed
-    daz = daz % (delta_az * 2)
-    mask = daz > delta_az
-    daz[mask] = -daz[mask] + 2 * delta_az
-    daz -= delta_az / 2
-
-    # elevation is kept constant during nsweeps_per_elevation
-    elcst = np.zeros(nsamples)
-    ielevations = isweeps // nsweeps_per_elevation
-    nelevations = ielevations[-1] + 1
-    for i in range(nelevations):
-        mask = ielevations == i
-        elcst[mask] = np.mean(elcenter[mask])
-        if fix_azimuth is not None:
-            if fix_azimuth['apply']:
-                el_step = fix_azimuth['el_step']
-                elcst[mask] = elcenter[mask] - nelevations / 2 * el_step + i * el_step
-
-    # azimuth and elevations to use for pointing
-    azptg = azcenter + daz
-    elptg = elcst
-
-    ### scan psi as well
-    pitch = out.time * angspeed_psi
-    pitch = pitch % (4 * maxpsi)
-    mask = pitch > (2 * maxpsi)
-    pitch[mask] = -pitch[mask] + 4 * maxpsi
-    pitch -= maxpsi
-
-    out.azimuth = azptg
-    out.elevation = elptg
-    out.pitch = pitch
-    if random_hwp:
-        out.angle_hwp = np.random.randint(0, int(90 / hwp_stepsize + 1), nsamples) * hwp_stepsize
-    else:
-        out.angle_hwp = np.zeros(nsamples)
-        max_sweeps = np.max(isweeps)
-        delta = int(nsamples / max_sweeps)
-        for i in range(max_sweeps):
-            out.angle_hwp[i * delta:(i + 1) * delta] = hwp_stepsize * np.mod(i, int(90 / hwp_stepsize + 1))
-
-    if fix_azimuth['apply']:
-        out.fix_az = True
-        if fix_azimuth['fix_hwp']:
-            out.angle_hwp = out.pitch * 0 + hwp_stepsize
-        if fix_azimuth['fix_pitch']:
-            out.pitch = 0
-    else:
-        out.fix_az = False
-
-    return out
+    return next(iter_sweeping_pointings(
+        center, duration, period, angspeed, delta_az, nsweeps_per_elevation,
+        angspeed_psi, maxpsi, hwp_stepsize, date_obs=date_obs,
+        latitude=latitude, longitude=longitude, fix_azimuth=fix_azimuth,
+        random_hwp=random_hwp, seed=seed))
 
 
 def create_sweeping_pointings_deadtime(
         center, duration, period, angspeed, delta_az, nsweeps_per_elevation,
         angspeed_psi, maxpsi, hwp_stepsize, date_obs=None, latitude=None, longitude=None, fix_azimuth=None, 
-        random_hwp=True, dead_time=0):
+        random_hwp=True, dead_time=0, seed=None):
     """
     Return pointings according to the sweeping strategy:
     Sweep around the tracked FOV center azimuth at a fixed elevation, and
@@ -465,6 +465,8 @@ def create_sweeping_pointings_deadtime(
         The starting date of the observation (UTC).
     random_hwp : bool
     dead_time : the dead time in seconds at the end of each scan
+    seed : int, np.random.SeedSequence or np.random.Generator, optional
+        The seed or the generator of the random HWP angles.
 
     Returns
     -------
@@ -473,86 +475,187 @@ def create_sweeping_pointings_deadtime(
         in degrees.
 
     """
-    nsamples = int(np.ceil(duration * 3600 / period))
-    out = QubicSampling(
-        nsamples, date_obs=date_obs, period=period, latitude=latitude,
-        longitude=longitude)
-    racenter = center[0]
-    deccenter = center[1]
-    backforthdt = delta_az / angspeed * 2
+    return next(iter_sweeping_pointings(
+        center, duration, period, angspeed, delta_az, nsweeps_per_elevation,
+        angspeed_psi, maxpsi, hwp_stepsize, date_obs=date_obs,
+        latitude=latitude, longitude=longitude, fix_azimuth=fix_azimuth,
+        random_hwp=random_hwp, dead_time=dead_time, seed=seed))
 
-    # compute the sweep number
-    isweeps = np.floor(out.time / (backforthdt + dead_time)).astype(int)
 
-    # azimuth/elevation of the center of the field as a function of time
+def iter_sweeping_pointings(
+        center, duration, period, angspeed, delta_az, nsweeps_per_elevation,
+        angspeed_psi, maxpsi, hwp_stepsize, date_obs=None, latitude=None,
+        longitude=None, fix_azimuth=None, random_hwp=True, dead_time=None,
+        nsamples=None, seed=None):
+    """
+    Generate the pointings of the sweeping strategy by time windows, so that
+    long scans can be produced and consumed block by block:
 
-    if fix_azimuth['apply']:
-        azcenter = out.time * 0 + fix_azimuth['az']
-        elcenter = out.time * 0 + fix_azimuth['el']
-    else:
-        azcenter, elcenter = equ2hor(racenter, deccenter, out.time, date_obs=out.date_obs, latitude=out.latitude,
-                                     longitude=out.longitude)
-
-    # compute azimuth offset for all time samples
-    time_in_scan = out.time % (backforthdt+dead_time)
-    mask_plus = time_in_scan < (backforthdt / 2)
-    mask_minus = (time_in_scan >= (backforthdt / 2)) & (time_in_scan < backforthdt)
-    mask_dead = time_in_scan >= backforthdt
-
-    daz = np.zeros(len(out.time))
-    daz[mask_plus] = time_in_scan[mask_plus] * angspeed - delta_az / 2
-    daz[mask_minus] = delta_az*1.5  -(time_in_scan[mask_minus] * (angspeed % (delta_az * 2)))
-    daz[mask_dead] = -delta_az / 2
-
-    # elevation is kept constant during nsweeps_per_elevation
-    elcst = np.zeros(nsamples)
-    ielevations = isweeps // nsweeps_per_elevation
-    nelevations = ielevations[-1] + 1
-    for i in range(nelevations):
-        mask = ielevations == i
-        elcst[mask] = np.mean(elcenter[mask])
-        if fix_azimuth is not None:
-            if fix_azimuth['apply']:
-                el_step = fix_azimuth['el_step']
-                elcst[mask] = elcenter[mask] - nelevations / 2 * el_step + i * el_step
-
-    # azimuth and elevations to use for pointing
-    azptg = azcenter + daz
-    elptg = elcst
-
-    ### scan psi as well
-    pitch = out.time * angspeed_psi
-    pitch = pitch % (4 * maxpsi)
-    mask = pitch > (2 * maxpsi)
-    pitch[mask] = -pitch[mask] + 4 * maxpsi
-    pitch -= maxpsi
-
-    out.azimuth = azptg
-    out.elevation = elptg
-    out.pitch = pitch
-    if random_hwp:
-        out.angle_hwp = np.random.randint(0, int(90 / hwp_stepsize + 1), nsamples) * hwp_stepsize
-    else:
-        out.angle_hwp = np.zeros(nsamples)
-        max_sweeps = np.max(isweeps)
-        delta = int(nsamples / max_sweeps)
-        for i in range(max_sweeps):
-            out.angle_hwp[i * delta:(i + 1) * delta] = hwp_stepsize * np.mod(i, int(90 / hwp_stepsize + 1))
-
-    if fix_azimuth['apply']:
-        out.fix_az = True
-        if fix_azimuth['fix_hwp']:
-            out.angle_hwp = out.pitch * 0 + hwp_stepsize
-        if fix_azimuth['fix_pitch']:
-            out.pitch = 0
-    else:
-        out.fix_az = False
+    for pointing in iter_sweeping_pointings(..., nsamples=86400):
+        ...
 
-    return out
+    The concatenation of the yielded samplings does not depend on the size
+    of the windows: the elevation of a phase straddling two windows and the
+    random HWP angles are the same as those of the whole scan.
+
+    Parameters
+    ----------
+    center : array-like of size 2
+        The R.A. and Declination of the center of the FOV.
+    duration : float
+        The duration of the observation, in hours.
+    period : float
+        The sampling period of the pointings, in seconds.
+    angspeed : float
+        The pointing angular speed, in deg / s.
+    delta_az : float
+        The sweeping extent in degrees.
+    nsweeps_per_elevation : int
+        The number of sweeps during a phase of constant elevation.
+    angspeed_psi : float
+        The pitch angular speed, in deg / s.
+    maxpsi : float
+        The maximum pitch angle, in degrees.
+    latitude : float, optional
+        The observer's latitude [degrees]. Default is DOMEC's.
+    longitude : float, optional
+        The observer's longitude [degrees]. Default is DOMEC's.
+    fix_azimuth : bool
+    hwp_stepsize : float
+        Step angle size for the HWP.
+    date_obs : str or astropy.time.Time, optional
+        The starting date of the observation (UTC).
+    random_hwp : bool
+    dead_time : float, optional
+        The dead time in seconds at the end of each scan. If None, the scan
+        is that of create_sweeping_pointings, otherwise that of
+        create_sweeping_pointings_deadtime.
+    nsamples : int, optional
+        The number of time samples of the windows. By default, the whole
+        scan is yielded at once.
+    seed : int, np.random.SeedSequence or np.random.Generator, optional
+        The seed or the generator of the random HWP angles.
+
+    Yields
+    ------
+    pointings : QubicSampling
+        The pointings of a time window, whose time attribute is the elapsed
+        time since the start of the scan.
+
+    """
+    rng = np.random.default_rng(seed)
+    ntimes = int(np.ceil(duration * 3600 / period))
+    if nsamples is None:
+        nsamples = ntimes
+    backforthdt = delta_az / angspeed * 2
+    sweep_duration = backforthdt if dead_time is None else backforthdt + dead_time
+
+    def get_ielevations(index):
+        isweeps = np.floor(index * period / sweep_duration).astype(int)
+        return isweeps // nsweeps_per_elevation
+
+    # the scan-wide quantities, from the last time sample
+    max_sweeps = int(np.floor((ntimes - 1) * period / sweep_duration))
+    nelevations = get_ielevations(ntimes - 1) + 1
+
+    for start in range(0, ntimes, nsamples):
+        stop = min(start + nsamples, ntimes)
+        out = QubicSampling(
+            stop - start, date_obs=date_obs, period=period,
+            latitude=latitude, longitude=longitude)
+        time = np.arange(start, stop) * period
+        out.time = time
+        ielevations = get_ielevations(np.arange(start, stop))
+
+        # azimuth/elevation of the center of the field as a function of time,
+        # over the whole phases of constant elevation of the window
+        ielevation_min = ielevations[0]
+        ielevation_max = ielevations[-1]
+        step = nsweeps_per_elevation * sweep_duration / period
+        first = max(int(np.floor(ielevation_min * step)) - 2, 0)
+        last = min(int(np.ceil((ielevation_max + 1) * step)) + 2, ntimes)
+        ielevations_phase = get_ielevations(np.arange(first, last))
+        mask = (ielevations_phase >= ielevation_min) & \
+               (ielevations_phase <= ielevation_max)
+        first += np.argmax(mask)
+        last = first + np.count_nonzero(mask)
+        ielevations_phase = ielevations_phase[mask] - ielevation_min
+        if fix_azimuth['apply']:
+            azcenter = np.full(stop - start, float(fix_azimuth['az']))
+            el_step = fix_azimuth['el_step']
+            elcst = fix_azimuth['el'] - nelevations / 2 * el_step + \
+                ielevations * el_step
+        else:
+            azcenter, elcenter = equ2hor(
+                center[0], center[1], np.arange(first, last) * period,
+                date_obs=out.date_obs, latitude=out.latitude,
+                longitude=out.longitude)
+            azcenter = azcenter[start - first:stop - first]
+            # elevation is kept constant during nsweeps_per_elevation
+            elmean = np.bincount(ielevations_phase, weights=elcenter) / \
+                np.bincount(ielevations_phase)
+            elcst = elmean[ielevations - ielevation_min]
+
+        # compute azimuth offset for all time samples
+        if dead_time is None:
+            daz = time * angspeed
+            daz = daz % (delta_az * 2)
+            mask = daz > delta_az
+            daz[mask] = -daz[mask] + 2 * delta_az
+            daz -= delta_az / 2
+        else:
+            time_in_scan = time % (backforthdt + dead_time)
+            mask_plus = time_in_scan < (backforthdt / 2)
+            mask_minus = (time_in_scan >= (backforthdt / 2)) & \
+                         (time_in_scan < backforthdt)
+            mask_dead = time_in_scan >= backforthdt
+            daz = np.zeros(len(time))
+            daz[mask_plus] = time_in_scan[mask_plus] * angspeed - delta_az / 2
+            daz[mask_minus] = delta_az * 1.5 - (
+                time_in_scan[mask_minus] * (angspeed % (delta_az * 2)))
+            daz[mask_dead] = -delta_az / 2
+
+        ### scan psi as well
+        pitch = time * angspeed_psi
+        pitch = pitch % (4 * maxpsi)
+        mask = pitch > (2 * maxpsi)
+        pitch[mask] = -pitch[mask] + 4 * maxpsi
+        pitch -= maxpsi
+
+        out.azimuth = azcenter + daz
+        out.elevation = elcst
+        out.pitch = pitch
+        nangles = int(90 / hwp_stepsize + 1)
+        if random_hwp:
+            # one double per sample, so that the draws of consecutive windows
+            # are those of the whole scan
+            out.angle_hwp = np.floor(
+                rng.random(stop - start) * nangles) * hwp_stepsize
+        else:
+            delta = int(ntimes / max_sweeps) if max_sweeps > 0 else ntimes
+            isweeps = np.arange(start, stop) // delta
+            out.angle_hwp = np.where(isweeps < max_sweeps,
+                                     hwp_stepsize * np.mod(isweeps, nangles),
+                                     0.)
+
+        if fix_azimuth['apply']:
+            out.fix_az = True
+            if fix_azimuth['fix_hwp']:
+                out.angle_hwp = out.pitch * 0 + hwp_stepsize
+            if fix_azimuth['fix_pitch']:
+                out.pitch = 0
+        else:
+            out.fix_az = False
+
+        yield out
 
 
 def _format_sphconv(a, b, date_obs=None, time=None):
-    incoords = np.empty(np.broadcast(a, b).shape + (2,))
+    if date_obs is None:
+        shape = np.broadcast(a, b).shape
+    else:
+        shape = np.broadcast(a, b, time).shape
+    incoords = np.empty(shape + (2,))
     incoords[..., 0] = a
     incoords[..., 1] = b
     if date_obs is None:
@@ -616,10 +719,9 @@ def equ2hor(ra, dec, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
     (array(135.71997181016644), array(-10.785386358099927))
 
     """
-    incoords, time = _format_sphconv(ra, dec, date_obs, time)
-    outcoords = SphericalEquatorial2HorizontalOperator(
-        'NE', time, latitude, longitude, degrees=True)(incoords)
-    return outcoords[..., 0], outcoords[..., 1]
+    lst = _get_lst(time, date_obs, longitude)
+    x = _equ2hor_cartesian(_sph2cart(ra, dec), lst, latitude)
+    return _cart2sph(x)
 
 
 def hor2equ(azimuth, elevation, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
@@ -649,10 +751,9 @@ def hor2equ(azimuth, elevation, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
     (array(1.1927080055488187e-14), array(-1.2722218725854067e-14))
 
     """
-    incoords, time = _format_sphconv(azimuth, elevation, date_obs, time)
-    outcoords = SphericalHorizontal2EquatorialOperator(
-        'NE', time, latitude, longitude, degrees=True)(incoords)
-    return outcoords[..., 0], outcoords[..., 1]
+    lst = _get_lst(time, date_obs, longitude)
+    x = _hor2equ_cartesian(_sph2cart(azimuth, elevation), lst, latitude)
+    return _cart2sph(x)
 
 
 def gal2hor(l, b, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
@@ -679,12 +780,9 @@ def gal2hor(l, b, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
     (array(50.35837815921487), array(39.212362279976155))
 
     """
-    incoords, time = _format_sphconv(l, b, date_obs, time)
-    g2e = SphericalGalactic2EquatorialOperator(degrees=True)
-    e2h = SphericalEquatorial2HorizontalOperator(
-        'NE', time, latitude, longitude, degrees=True)
-    outcoords = e2h(g2e(incoords))
-    return outcoords[..., 0], outcoords[..., 1]
+    lst = _get_lst(time, date_obs, longitude)
+    x = np.dot(_sph2cart(l, b), _GAL2EQU.T)
+    return _cart2sph(_equ2hor_cartesian(x, lst, latitude))
 
 
 def hor2gal(azimuth, elevation, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
@@ -712,9 +810,150 @@ def hor2gal(azimuth, elevation, time, date_obs=QubicSampling.DEFAULT_DATE_OBS,
     (array(4.452776554048925e-14), array(-7.63333123551244e-14))
 
     """
-    incoords, time = _format_sphconv(azimuth, elevation, date_obs, time)
-    h2e = SphericalHorizontal2EquatorialOperator(
-        'NE', time, latitude, longitude, degrees=True)
-    e2g = SphericalEquatorial2GalacticOperator(degrees=True)
-    outcoords = e2g(h2e(incoords))
-    return outcoords[..., 0], outcoords[..., 1]
+    lst = _get_lst(time, date_obs, longitude)
+    x = _hor2equ_cartesian(_sph2cart(azimuth, elevation), lst, latitude)
+    return _cart2sph(np.dot(x, _GAL2EQU))
+
+
+def _get_sky_rotation(date_obs, time, latitude, longitude, step=None):
+    """
+    Return the galactic-to-horizontal rotation matrices, of shape
+    (ntimes, 3, 3). If step is not None, they are computed on a time grid
+    of this step [s] and linearly interpolated. The error on the matrix
+    elements is about (omega * step)**2 / 8, where omega = 7.29e-5 rad/s is
+    the Earth rotation rate, i.e. 7e-8 for a 10-second step. The grid is
+    aligned on multiples of the step, so that the matrices of a subset of
+    the time samples do not depend on the other samples.
+
+    """
+    time = np.asarray(time, float)
+    if step is not None and time.size > 0:
+        kmin = int(np.floor(np.min(time) / step))
+        kmax = int(np.floor(np.max(time) / step)) + 1
+        grid = np.arange(kmin, kmax + 1) * step
+    else:
+        grid = time
+    with rule_manager(none=False):
+        r = CartesianEquatorial2HorizontalOperator(
+            'NE', date_obs + TimeDelta(grid, format='sec'), latitude,
+            longitude) * CartesianGalactic2EquatorialOperator()
+    data = np.asarray(r.data)
+    if data.ndim == 2:
+        data = np.resize(data, (len(grid), 3, 3))
+    if grid is time:
+        return data
+    x = time / step - kmin
+    index = np.minimum(x.astype(int), len(grid) - 2)
+    out = data[:-1][index]
+    delta = np.diff(data, axis=0)[index]
+    delta *= (x - index)[:, None, None]
+    out += delta
+    return out
+
+
+# galactic-to-equatorial rotation matrix
+_GAL2EQU = CartesianGalactic2EquatorialOperator().data
+
+
+@functools.lru_cache()
+def _get_jd(date_obs):
+    """
+    Return the two-part Julian date (UTC) of the start of an observation,
+    given as a string.
+
+    """
+    date_obs = Time(date_obs, scale='utc')
+    return float(np.ravel(date_obs.jd1)[0]), float(np.ravel(date_obs.jd2)[0])
+
+
+def _get_lst(time, date_obs, longitude):
+    """
+    Return the local sidereal time in radians of time samples given in
+    seconds since date_obs. The formula is that of the equatorial-horizontal
+    operators of pysimulators (Duffett-Smith 1988), evaluated without astropy
+    time arrays and with a Julian date split into its day and day fraction
+    to preserve the precision.
+
+    """
+    if isinstance(date_obs, Time):
+        jd1 = float(np.ravel(date_obs.utc.jd1)[0])
+        jd2 = float(np.ravel(date_obs.utc.jd2)[0])
+    else:
+        jd1, jd2 = _get_jd(str(date_obs))
+    # jd = jd0 + day, where jd0 is the last midnight, i.e. the last
+    # Julian date ending with .5
+    base = np.floor(jd1 - 0.5) + 0.5
+    day = (jd1 - base) + jd2 + np.asarray(time, float) / 86400
+    iday = np.floor(day)
+    T = (base + iday - 2451545) / 36525
+    gst = (6.697374558 + 2400.051336 * T + 0.000025862 * T**2) % 24
+    gst = (gst + (day - iday) * 24 * 1.002737909) % 24
+    return np.radians(((gst + np.asarray(longitude) / 15) % 24) * 15)
+
+
+def _sph2cart(a, b):
+    """
+    Return the cartesian coordinates of the spherical coordinates
+    (azimuth, elevation) or (R.A., declination), in degrees.
+
+    """
+    a = np.radians(a)
+    b = np.radians(b)
+    cosb = np.cos(b)
+    a, b, cosb = np.broadcast_arrays(a, b, cosb)
+    out = np.empty(a.shape + (3,))
+    out[..., 0] = cosb * np.cos(a)
+    out[..., 1] = cosb * np.sin(a)
+    out[..., 2] = np.sin(b)
+    return out
+
+
+def _cart2sph(x):
+    """
+    Return the spherical coordinates (azimuth, elevation) in degrees of
+    cartesian coordinates, with an azimuth in [0, 360[.
+
+    """
+    a = np.degrees(np.arctan2(x[..., 1], x[..., 0])) % 360
+    b = np.degrees(np.arctan2(x[..., 2], np.hypot(x[..., 0], x[..., 1])))
+    return a, b
+
+
+def _equ2hor_cartesian(x, lst, latitude):
+    """
+    Rotate equatorial cartesian coordinates into the 'NE' horizontal frame,
+    for the local sidereal time lst [rad] and the observer's latitude [deg].
+    The rotation is applied to the hour angle components, without forming
+    the rotation matrices.
+
+    """
+    lat = np.radians(latitude)
+    slat = np.sin(lat)
+    clat = np.cos(lat)
+    slst = np.sin(lst)
+    clst = np.cos(lst)
+    u = clst * x[..., 0] + slst * x[..., 1]
+    out = np.empty(np.broadcast(u, slat).shape + (3,))
+    out[..., 0] = clat * x[..., 2] - slat * u
+    out[..., 1] = clst * x[..., 1] - slst * x[..., 0]
+    out[..., 2] = clat * u + slat * x[..., 2]
+    return out
+
+
+def _hor2equ_cartesian(x, lst, latitude):
+    """
+    Rotate 'NE' horizontal cartesian coordinates into the equatorial frame,
+    the inverse of _equ2hor_cartesian.
+
+    """
+    lat = np.radians(latitude)
+    slat = np.sin(lat)
+    clat = np.cos(lat)
+    slst = np.sin(lst)
+    clst = np.cos(lst)
+    u = clat * x[..., 2] - slat * x[..., 0]
+    out = np.empty(np.broadcast(u, slst).shape + (3,))
+    out[..., 0] = clst * u - slst * x[..., 1]
+    out[..., 1] = slst * u + clst * x[..., 1]
+    out[..., 2] = clat * x[..., 0] + slat * x[..., 2]
+    return out
@@ -0,0 +1,70 @@
+"""
+Benchmark of qubic.equ2hor, hor2equ, gal2hor and hor2gal on random time
+samples, against the pysimulators spherical operators applied with an
+astropy Time array of the samples.
+
+Usage: python bench_coordinates.py [nsamples]
+
+"""
+from __future__ import division, print_function
+
+import sys
+
+import numpy as np
+from astropy.time import Time, TimeDelta
+from pysimulators import (
+    SphericalEquatorial2GalacticOperator,
+    SphericalEquatorial2HorizontalOperator,
+    SphericalGalactic2EquatorialOperator,
+    SphericalHorizontal2EquatorialOperator)
+
+import qubic
+from benchlib import report, timeit
+
+nsamples = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+date_obs = '2019-03-04 12:34:56'
+latitude = qubic.samplings.DOMECLAT
+longitude = qubic.samplings.DOMECLON
+rng = np.random.default_rng(0)
+
+
+def astropy_operators(name, a, b, t):
+    incoords = np.empty(a.shape + (2,))
+    incoords[..., 0] = a
+    incoords[..., 1] = b
+    times = Time(date_obs, scale='utc') + TimeDelta(t, format='sec')
+    if name.startswith('hor'):
+        operator = SphericalHorizontal2EquatorialOperator(
+            'NE', times, latitude, longitude, degrees=True)
+        if name == 'hor2gal':
+            operator = SphericalEquatorial2GalacticOperator(
+                degrees=True)(operator)
+    else:
+        operator = SphericalEquatorial2HorizontalOperator(
+            'NE', times, latitude, longitude, degrees=True)
+        if name == 'gal2hor':
+            operator = operator(SphericalGalactic2EquatorialOperator(
+                degrees=True))
+    out = operator(incoords)
+    return out[..., 0], out[..., 1]
+
+
+def kernel(name, a, b, t):
+    return getattr(qubic, name)(a, b, t, date_obs=date_obs,
+                                latitude=latitude, longitude=longitude)
+
+
+for n in (1000, nsamples):
+    a = rng.random(n) * 360
+    b = np.degrees(np.arcsin(2 * rng.random(n) - 1))
+    t = rng.random(n) * 86400 * 30
+    print('{} samples over 30 days:'.format(n))
+    for name in ('equ2hor', 'hor2equ', 'gal2hor', 'hor2gal'):
+        t_ref, out_ref = timeit(astropy_operators, name, a, b, t)
+        t_kernel, out = timeit(kernel, name, a, b, t)
+        error = np.linalg.norm(qubic.samplings._sph2cart(*out_ref) -
+                               qubic.samplings._sph2cart(*out), axis=-1)
+        report('astropy operators', t_ref, 'qubic.' + name, t_kernel)
+        print('  max error: {:.1e} arcsec'.format(
+            np.degrees(np.max(error)) * 3600))
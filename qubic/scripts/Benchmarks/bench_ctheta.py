@@ -0,0 +1,61 @@
+"""
+Benchmark of qubic.QubicSkySim.map_corr_neighbtheta, the noise angular
+correlation C(theta) of a partial map, against the query of a Healpix
+disc around each seen pixel for each angular bin.
+
+Usage: python bench_ctheta.py [nside [thetamax [nbins]]]
+
+"""
+from __future__ import division, print_function
+
+import sys
+
+import healpy as hp
+import numpy as np
+
+import qubic.QubicSkySim as qss
+from benchlib import report, timeit
+
+nside = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+thetamax = float(sys.argv[2]) if len(sys.argv) > 2 else 10.
+nbins = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+# white noise in a 20 deg radius patch, smoothed to correlate the pixels
+rng = np.random.default_rng(0)
+npix = 12 * nside ** 2
+center = hp.ang2vec(316.44761929, -58.75808063, lonlat=True)
+ipok = hp.query_disc(nside, center, np.radians(20))
+themap = hp.smoothing(rng.standard_normal(npix), fwhm=np.radians(2))
+themap[np.setdiff1d(np.arange(npix), ipok)] = 0
+
+
+def disc_queries(themap, ipok, thetamin, thetamax, nbins):
+    thvals = np.linspace(np.radians(thetamin), np.radians(thetamax), nbins + 1)
+    ns = hp.npix2nside(len(themap))
+    thesum = np.zeros(nbins)
+    thesum2 = np.zeros(nbins)
+    thecount = np.zeros(nbins)
+    for i in range(len(ipok)):
+        valthis = themap[ipok[i]]
+        v = hp.pix2vec(ns, ipok[i])
+        ipneighb_inner = list(hp.query_disc(ns, v, np.radians(thetamin)))
+        for k in range(nbins):
+            ipneighb_outer = list(hp.query_disc(ns, v, thvals[k + 1]))
+            ipneighb = ipneighb_outer.copy()
+            for l in ipneighb_inner: ipneighb.remove(l)
+            valneighb = themap[ipneighb]
+            thesum[k] += np.sum(valthis * valneighb)
+            thesum2[k] += np.sum((valthis * valneighb) ** 2)
+            thecount[k] += len(valneighb)
+            ipneighb_inner = ipneighb_outer.copy()
+    mythetas = np.degrees(thvals[:-1] + thvals[1:]) / 2
+    return mythetas, thesum / thecount
+
+
+print('nside={}, {} seen pixels, {} bins up to {} deg:'.format(
+    nside, len(ipok), nbins, thetamax))
+t_ref, (_, c_ref) = timeit(disc_queries, themap, ipok, 0, thetamax, nbins)
+t_tree, (_, c, _) = timeit(qss.map_corr_neighbtheta, themap, ipok, 0,
+                           thetamax, nbins, verbose=False)
+report('disc query per pixel and bin', t_ref, 'map_corr_neighbtheta', t_tree,
+       c_ref, c)
@@ -0,0 +1,49 @@
+"""
+Benchmark of demodulate_methods(method='rms') of qubic.demodulation_lib on
+the TOD of several TES, against a loop calling fibtools.meancut for each
+modulation period and each TES.
+
+Usage: python bench_demodulation.py [ntes [duration]]
+
+"""
+from __future__ import division, print_function
+
+import sys
+
+import numpy as np
+
+import qubic.demodulation_lib as dl
+import qubic.fibtools as ft
+from benchlib import report, timeit
+
+ntes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+duration = float(sys.argv[2]) if len(sys.argv) > 2 else 600.
+
+fsampling = 156.25
+fmod = 1.
+rng = np.random.default_rng(0)
+t = np.arange(int(duration * fsampling)) / fsampling
+data = np.sin(2 * np.pi * fmod * t) * rng.random((ntes, 1)) + \
+    0.1 * rng.standard_normal((ntes, len(t)))
+
+
+def meancut_loop(period, time, data):
+    period_index = ((time - time[0]) / period).astype(int)
+    allperiods = np.unique(period_index)
+    tper = np.zeros(len(allperiods))
+    ampdata = np.zeros((len(data), len(allperiods)))
+    for i in range(len(allperiods)):
+        ok = period_index == allperiods[i]
+        tper[i] = np.mean(time[ok])
+        for j in range(len(data)):
+            ampdata[j, i] = ft.meancut(data[j, ok], 3)[1]
+    return tper, ampdata
+
+
+print('{} TES, {} s at {} Hz, modulation at {} Hz:'.format(
+    ntes, duration, fsampling, fmod))
+t_ref, (_, amp_ref) = timeit(meancut_loop, 1 / fmod, t, data)
+t_rms, (_, amp, _) = timeit(dl.demodulate_methods, [t, data], fmod,
+                            method='rms')
+report('meancut per period and TES', t_ref,
+       "demodulate_methods(method='rms')", t_rms, amp_ref, amp)
@@ -0,0 +1,80 @@
+"""
+Benchmark of the block engine of QubicInstrument._get_projection_operators
+for the full instrument (992 detectors of the FI layout), against threads
+rotating the peaks of one detector each with the Rotation3dOperator and
+converting them with the Cartesian2HealpixOperator.
+
+Usage: python bench_projection.py [npointings] [nside]
+
+"""
+from __future__ import division, print_function
+
+import sys
+
+import numpy as np
+from pyoperators import Spherical2CartesianOperator
+from pyoperators.utils import pool_threading
+from pysimulators.interfaces.healpy import Cartesian2HealpixOperator
+
+import qubic
+from qubic.instrument import _pack_vector
+from benchlib import report, timeit
+
+npointings = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+nside = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+d = qubic.qubicdict.qubicDict()
+d.read_from_file('pipeline_demo.dict')
+d['nside'] = nside
+d['npointings'] = npointings
+d['use_synthbeam_fits_file'] = False
+d['kind'] = 'I'
+
+q = qubic.QubicInstrument(d)
+s = qubic.get_pointing(d)
+scene = qubic.QubicScene(d)
+rotation = s.cartesian_galactic2instrument
+peaks = q._get_projection_peaks(
+    scene, q.filter.nu, q.detector.center, q.synthbeam, q.horn,
+    q.primary_beam, q.thetafits, q.phifits, q.valfits, q.use_file, q.freqs)
+print('{} detectors, {} pointings, {} peaks, nside={}'.format(
+    len(q), len(s), peaks[0].shape[1], nside))
+
+
+def per_detector(ndetectors):
+    direction = Spherical2CartesianOperator('zenith,azimuth')(
+        _pack_vector(peaks[0][:ndetectors], peaks[1][:ndetectors]))
+    index = np.empty((ndetectors, len(s), peaks[0].shape[1]), np.int32)
+    c2h = Cartesian2HealpixOperator(nside)
+
+    def func_thread(i):
+        e_ni = rotation.T(direction[i, :, None, :])
+        index[i] = c2h(e_ni).T
+
+    with pool_threading() as pool:
+        pool.map(func_thread, range(ndetectors))
+    return index
+
+
+def block_engine(ndetectors, block_size=None):
+    P = q._get_projection_operators(
+        rotation, scene, q.detector.center[:ndetectors], q.synthbeam,
+        [tuple(p[:ndetectors] for p in peaks)], verbose=False,
+        block_size=block_size)[0]
+    return P.matrix.data.index.reshape((ndetectors, len(s), -1))
+
+
+t_ref, index_ref = timeit(per_detector, len(q))
+t_block, index = timeit(block_engine, len(q))
+assert np.array_equal(index_ref, index)
+report('per-detector threads', t_ref, 'block engine', t_block)
+
+print('\nScaling with the number of detectors:')
+for ndetectors in (124, 248, 496, 992):
+    t, _ = timeit(block_engine, ndetectors)
+    print('{:4} detectors: {:.2f}s'.format(ndetectors, t))
+
+print('\nBlock size:')
+for block_size in (2**16, 2**18, 2**20, 2**22):
+    t, _ = timeit(block_engine, len(q), block_size)
+    print('{:8}: {:.2f}s'.format(block_size, t))
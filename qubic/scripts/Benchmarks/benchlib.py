@@ -0,0 +1,34 @@
+"""
+Timing and reporting helpers of the benchmark scripts.
+
+"""
+from __future__ import division, print_function
+
+import time
+
+import numpy as np
+
+
+def timeit(func, *args, **keywords):
+    """
+    Call func(*args, **keywords) and return its wall time and its output.
+
+    """
+    t0 = time.time()
+    out = func(*args, **keywords)
+    return time.time() - t0, out
+
+
+def report(name_ref, t_ref, name, t, expected=None, actual=None):
+    """
+    Print the wall times of a reference path and of its replacement, and
+    the maximum relative difference between their outputs, if given.
+
+    """
+    width = max(len(name_ref), len(name)) + 1
+    print('  {:{}} {:.3g} s'.format(name_ref + ':', width, t_ref))
+    print('  {:{}} {:.3g} s (x{:.1f})'.format(name + ':', width, t,
+                                              t_ref / t))
+    if expected is not None:
+        print('  max relative difference: {:.1e}'.format(
+            np.max(np.abs(actual - expected)) / np.max(np.abs(expected))))
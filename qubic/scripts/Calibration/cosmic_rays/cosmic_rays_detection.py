@@ -15,7 +15,6 @@ from tqdm import tqdm
 from numba import njit
 from typing import Type
 import multiprocessing as mp
-from multiprocessing.shared_memory import SharedMemory
 
 from scipy.stats import linregress
 from scipy.optimize import curve_fit
@@ -28,8 +27,10 @@ import matplotlib.gridspec as gridspec
 from qubicpack.qubicfp import qubicfp
 import qubicpack.pixel_translation as pt
 
-# dictionary containing the information needed by all processes to read data into shared memory
-# (parent and child process communicate only through shared memory (mediator))
+from qubic.sharedtod import SharedArray, TODPool
+
+# dictionary containing the information needed by all processes to read the memory-mapped data
+# (parent and child process only exchange the references of the (ntes, nsamples) arrays)
 SHARED_INFO = {"src_dir": '',
                "dst_dir": '',
                "logfname": '',
@@ -38,8 +39,9 @@ SHARED_INFO = {"src_dir": '',
                "time_fname": '',
                "signals_fname": '',
                "signals_clean_fname": '',
+               "tes_keys_fname": '',
+               "tes_keys": [],
                'thermometers': [4, 36, 68, 100],
-               "time_shm": {},
                "n_knots": 7,
                "t_knots": Type[np.ndarray],
                "coeff": 5,
@@ -186,7 +188,7 @@ def check_mode(mode: str, to_analyze: list[str], tes_keys: list[str]) -> list[st
         - a sequence for TES sequence
 
     tes_keys: list[str]
-        keys related to the signals of the TES present in the .npz files
+        keys related to the signals of the TES present in the .npy files
 
     Returns
     -------
@@ -266,7 +268,7 @@ def make_result_dir(src_path: str, dst_path: str, args: argparse.Namespace = Non
 
     dst_path: str
         folder where two sub-folders are created:
-        1. input, which contains the .npy (time) and .npz (signals of all TES) files;
+        1. input, which contains the .npy files of the time and of the (ntes, nsamples) signals;
         2. output, which contains the .json file of the taus;
 
     args: argparse.Namespace
@@ -306,7 +308,8 @@ def make_result_dir(src_path: str, dst_path: str, args: argparse.Namespace = Non
                         force=True)
 
 
-def export_data(src_path: str, time_fname: str, signal_raw_fname: str, mask: list[list[int]] = None):
+def export_data(src_path: str, time_fname: str, signal_raw_fname: str, tes_keys_fname: str,
+                mask: list[list[int]] = None) -> list[str]:
     """
      Reads the data using qubicfp() and exports the time and signals of the TES with their respective signs.
      If the mask is null, all TES are considered valid
@@ -320,17 +323,25 @@ def export_data(src_path: str, time_fname: str, signal_raw_fname: str, mask: lis
          path to the file containing time
 
      signal_raw_fname: str
-         path to the file containing the signals
+         path to the .npy file containing the (ntes, nsamples) signals
+
+     tes_keys_fname: str
+         path to the .npy file containing the TES index of each row of the signals
 
      mask: list[list[int]], None
          the mask with the indices of valid TES converted to integers;
          if the mask is None: all TES are considered valid and positive
+
+     Returns
+     ------
+     list[str]:
+         keys of the available TES to be analyzed, in the order of the rows of the signals
      """
 
     # if the time file and the file containing the signals exist,
     # it returns the keys associated with the TES that can be analyzed
-    if os.path.isfile(time_fname) and os.path.isfile(signal_raw_fname):
-        return np.load(signal_raw_fname).files
+    if all(map(os.path.isfile, [time_fname, signal_raw_fname, tes_keys_fname])):
+        return list(map(str, np.load(tes_keys_fname)))
 
     print("Exporting data via qubicfp (thermometers will be analyzed but not displayed on the focal plane)...")
 
@@ -342,10 +353,10 @@ def export_data(src_path: str, time_fname: str, signal_raw_fname: str, mask: lis
     # saves the shifted time array
     np.save(time_fname, qubic[0] - qubic[0][0])
 
-    # contains the indices saved in the mask, excluding -1 (keys of the .npz file)
+    # contains the indices saved in the mask, excluding -1
     keys = []
-    # contains the signals with reversed signs
-    masked = []
+    # contains the signs of the signals
+    signs = []
 
     mask = mask or [list(range(qubic[1].shape[0]))]
 
@@ -358,26 +369,29 @@ def export_data(src_path: str, time_fname: str, signal_raw_fname: str, mask: lis
             continue
         for tes in mask[row]:
             # save the TES indices
-            keys.append(str(tes))
-            # save the TES signal with the corresponding sign.
+            keys.append(tes)
             # The row of positive TES has index zero, so you have (-1)^0 * TES signal.
             # That of the negative TES has index 1, so you have (-1)^1 * TES signal
-            masked.append((-1) ** row * qubic[1][tes])
+            signs.append((-1) ** row)
 
-    # saves the signals in the .npz file
-    np.savez(signal_raw_fname, **dict(zip(keys, masked)))
+    # saves the signals with the corresponding sign in a (ntes, nsamples) .npy file
+    with SharedArray((len(keys), qubic[1].shape[1]), dtype=qubic[1].dtype, filename=signal_raw_fname) as signals:
+        for index, (tes, sign) in enumerate(zip(keys, signs)):
+            signals[index] = sign * qubic[1][tes]
+    np.save(tes_keys_fname, keys)
 
+    return list(map(str, keys))
 
-def configure_data(src_path: str, dst_path: str, mask: list[list[int]] | None) -> SharedMemory:
+
+def configure_data(src_path: str, dst_path: str, mask: list[list[int]] | None) -> list[str]:
     """
-    Configuration for data export and the saving point of the exported files
-    (.npy and .npz format)
+    Configuration for data export and the saving point of the exported files (.npy format)
 
     Parameters
     ---------
     dst_path: str
         folder where two sub-folders are created:
-            1. input, which contains the .npy (time) and .npz (signals of all TES) files;
+            1. input, which contains the .npy files of the time and of the (ntes, nsamples) signals;
             2. output, which contains the .json file of the taus;
 
     src_path: str
@@ -388,11 +402,11 @@ def configure_data(src_path: str, dst_path: str, mask: list[list[int]] | None) -
 
     Returns
     ------
-    SharedMemory
-        the object that manages the shared memory of the time
+    list[str]:
+        keys of the available TES to be analyzed, in the order of the rows of the signals
     """
 
-    logger.info('path where the input and output folders of the preprocessed data are located (npy, npz files + taus, '
+    logger.info('path where the input and output folders of the preprocessed data are located (npy files + taus, '
                 'plots): %s', dst_path)
     logger.info('folder containing sky scan data in .fits format: %s', src_path)
 
@@ -409,13 +423,15 @@ def configure_data(src_path: str, dst_path: str, mask: list[list[int]] | None) -
     logger.info('output dir created')
 
     SHARED_INFO['time_fname'] = os.path.join(SHARED_INFO['src_dir'], "times_raw.npy")
-    SHARED_INFO['signals_fname'] = os.path.join(SHARED_INFO['src_dir'], "signals_raw.npz")
-    SHARED_INFO['signals_clean_fname'] = os.path.join(SHARED_INFO['src_dir'], "signals_clean.npz")
+    SHARED_INFO['signals_fname'] = os.path.join(SHARED_INFO['src_dir'], "signals_raw.npy")
+    SHARED_INFO['signals_clean_fname'] = os.path.join(SHARED_INFO['src_dir'], "signals_clean.npy")
+    SHARED_INFO['tes_keys_fname'] = os.path.join(SHARED_INFO['src_dir'], "tes_keys.npy")
     SHARED_INFO['taus_fname'] = os.path.join(SHARED_INFO['dst_dir'], f"crd_taus__{src_path.split(os.sep)[-1]}.json")
 
     logger.info('time file path: %s', SHARED_INFO['time_fname'])
     logger.info('raw signal file path: %s', SHARED_INFO['signals_fname'])
     logger.info('signal clean file path: %s', SHARED_INFO['signals_clean_fname'])
+    logger.info('tes keys file path: %s', SHARED_INFO['tes_keys_fname'])
     logger.info('taus file path: %s', SHARED_INFO['taus_fname'])
 
     SHARED_INFO['plots_dir'] = os.path.join(SHARED_INFO['dst_dir'], "plots")
@@ -424,87 +440,36 @@ def configure_data(src_path: str, dst_path: str, mask: list[list[int]] | None) -
     os.makedirs(SHARED_INFO['plots_dir'], exist_ok=True)
     logger.info('plots dir created')
 
-    # list containing the path to the folder containing the data, the path to which to export the time and signal data
-    args = [src_path, SHARED_INFO['time_fname'], SHARED_INFO['signals_fname']]
-    logger.info('args for data exporting: %s', args)
-
-    export_data(src_path=src_path, time_fname=SHARED_INFO['time_fname'],
-                signal_raw_fname=SHARED_INFO['signals_fname'],
-                mask=mask)
+    SHARED_INFO['tes_keys'] = export_data(src_path=src_path, time_fname=SHARED_INFO['time_fname'],
+                                          signal_raw_fname=SHARED_INFO['signals_fname'],
+                                          tes_keys_fname=SHARED_INFO['tes_keys_fname'],
+                                          mask=mask)
 
-    signal_time = np.load(SHARED_INFO['time_fname'])
+    signal_time = np.load(SHARED_INFO['time_fname'], mmap_mode='r')
     SHARED_INFO['t_knots'] = np.linspace(signal_time[1], signal_time[-2], SHARED_INFO['n_knots'])
 
     logger.info('t_knots: %s', SHARED_INFO['t_knots'])
 
-    # once the time and signal data have been exported, allocate the shared memory for the time data
-    time_shm = create_shared_memory(data=signal_time,
-                                    name='time_shm',
-                                    shm_name='np_time_shared')
-
-    logger.info('time array saved in shared memory')
-
-    return time_shm
-
-
-def create_shared_memory(data, name: str, shm_name: str) -> SharedMemory:
-    """
-    Create a block of shared memory in which to save the information contained in "data"
-
-    Parameters
-    ---------
-
-    data: np.ndarray
-        data to be saved in the shared memory
-
-    name: str
-        key, present in SHARED_INFO, associated with the corresponding dictionary
-
-    shm_name: str
-        shared memory block identifier
-
-    Returns
-    ------
-
-    SharedMemory
-        object that manages the shared block of memory
+    return SHARED_INFO['tes_keys']
 
-    """
-
-    SHARED_INFO[name]["name"] = shm_name
-    SHARED_INFO[name]["size"] = size = data.nbytes
-    SHARED_INFO[name]["shape"] = shape = data.shape
-    SHARED_INFO[name]["dtype"] = dtype = data.dtype
-
-    # 1. create the shared memory block
-    try:
-        shm = SharedMemory(create=True, size=size, name=shm_name)
-    except FileExistsError:
-        logger.warning(f"Shared Memory '%s' already exist. Be aware of side effects", shm_name)
-        return SharedMemory(name=shm_name)
-
-    # 2. create a generic vector that can connect to the shared memory block
-    dst = np.ndarray(shape=shape, dtype=dtype, buffer=shm.buf)  # shm.buf: link to the shared block of memory
-
-    # 3. copy the data to dst
-    dst[:] = data[:]
-
-    return shm
 
-
-def interpolated_signal(data: tuple) -> np.ndarray:
+def interpolated_signal(signal_raw: np.ndarray, times_raw: SharedArray, knots: np.ndarray) -> np.ndarray:
     """
     Signal interpolation with a third degree function (atmosphere drift removal).
     Refer to: https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.LSQUnivariateSpline.html
 
     Parameters
     ---------
-    data: tuple
-        n_tes: int
-            TES number
+    signal_raw: np.ndarray
+        raw signal of the TES (row of the memory-mapped signals)
+
+    times_raw: SharedArray
+        memory-mapped time array
 
-        shared_info: dict
-            dictionary containing the information needed by all processes to read data into shared memory
+    knots: np.ndarray
+        interior knots of the spline. Must be in ascending order.
+        Knots must satisfy the Schoenberg-Whitney conditions:
+        there must be a subset of data points x[j] such that t[j] < x[j] < t[j+k+1], for j=0, 1,...,n-k-2.
 
     Returns
     ------
@@ -512,25 +477,7 @@ def interpolated_signal(data: tuple) -> np.ndarray:
         signal cleaned from the atmospheric drift
     """
 
-    n_tes, shared_info = data
-
-    # interior knots of the spline. Must be in ascending order.
-    # Knots must satisfy the Schoenberg-Whitney conditions:
-    # there must be a subset of data points x[j] such that t[j] < x[j] < t[j+k+1], for j=0, 1,...,n-k-2.
-    knots = shared_info["t_knots"]
-
-    # access information relating to the time shm shared memory block
-    t_name, t_size, t_shape, t_dtype = shared_info["time_shm"].values()
-
-    # retrieve object that manages shared memory
-    time_shm = SharedMemory(name=t_name)
-
-    # create a generic array able to connect to the shared memory block
-    times_raw = np.ndarray(shape=t_shape, dtype=t_dtype,
-                           buffer=time_shm.buf)  # shm.buf: link to the shared block of memory
-
-    # load the raw signal of the TES to analyze
-    signal_raw = np.load(shared_info['signals_fname'])[n_tes]
+    times_raw = times_raw[:]
 
     # LSQUnivariateSpline object representing a least squares fit
     fit = LSQUnivariateSpline(times_raw, signal_raw, knots)
@@ -538,9 +485,15 @@ def interpolated_signal(data: tuple) -> np.ndarray:
     return signal_raw - fit(times_raw)
 
 
-def save_interp_signals() -> list[str]:
+def save_interp_signals(pool: TODPool) -> list[str]:
     """
-    Create a file in .npz format in which saves the signals cleaned by the atmosphere (s_clean)
+    Create a memory-mapped .npy file in which the workers directly write
+    the signals cleaned by the atmosphere (s_clean), row by row.
+
+    Parameters
+    ---------
+    pool: TODPool
+        pool of worker processes
 
     Returns
     ------
@@ -548,33 +501,26 @@ def save_interp_signals() -> list[str]:
         keys of the available TES to be analyzed
     """
 
-    # load the file containing the signal data
-    signals = np.load(SHARED_INFO['signals_fname'])
-    logger.info("%s signals will be exported in .npz format", len(signals))
-
-    # check if the file containing the leased data exists, otherwise doesn't create it every time
+    # check if the file containing the cleaned data exists, otherwise doesn't create it every time
     if os.path.isfile(SHARED_INFO['signals_clean_fname']):
         logger.info("the file '%s' already exist. Skipping", SHARED_INFO['signals_clean_fname'])
-        return signals.files
+        return SHARED_INFO['tes_keys']
 
     print('Saving signals cleaned from the atmospheric drift...')
 
-    # mp.Pool is the manager of child processes
-    with mp.Pool() as pool:
-        # imap() accepts a function and the arguments to pass to the function (respects the input order in output).
-        # arguments are packaged as a single argument
-
-        res = pool.imap(interpolated_signal,
-                        zip(signals.files, [SHARED_INFO] * len(signals)),
-                        chunksize=max(2, len(signals) // mp.cpu_count()))
+    # each worker only reads the row of the TES it processes
+    with SharedArray.open(SHARED_INFO['signals_fname']) as signals, \
+            SharedArray.open(SHARED_INFO['time_fname']) as times_raw:
+        logger.info("%s signals will be exported in .npy format", len(signals))
+        fname = SHARED_INFO['signals_clean_fname']
+        with SharedArray(signals.shape, dtype=np.float64, filename=fname + '.part') as signals_clean:
+            for _ in pool.map_rows(interpolated_signal, signals, args=(times_raw, SHARED_INFO['t_knots']),
+                                   out=signals_clean):
+                pass
+        # the file is only renamed once complete, so that an interrupted run is not reused
+        os.replace(fname + '.part', fname)
 
-        # create the .npz file in which I save the fitted signal of each TES
-        # numpy sees the .npz file as a list of .npy files [('arr_0', <array_0>), ('arr_1', <array_1>), ...]
-        # the asterisk unpacks the generic res iterator containing the fitted signals of each TES
-        np.savez(SHARED_INFO['signals_clean_fname'], **dict(zip(signals.files, res)))
-
-    # logger.info("the file '%s' has been created", SHARED_INFO['signals_clean_fname'])
-    return signals.files
+    return SHARED_INFO['tes_keys']
 
 
 def exp_decay(t: np.ndarray, a: int, b: int, c: float) -> np.ndarray:
@@ -991,9 +937,65 @@ def get_candidates(s_clean: np.ndarray,
     return candidates
 
 
+def get_tes_taus(s_clean: np.ndarray, time_raw: SharedArray, shared_info: dict) -> list[tuple]:
+    """
+    Search the candidates of a TES, filter them and fit their time constants.
+    It runs in a worker process, which only reads the row of the TES.
+
+    Parameters
+    ----------
+    s_clean: np.ndarray
+        signal of the TES cleaned from the atmospheric drift
+
+    time_raw: SharedArray
+        memory-mapped time array
+
+    shared_info: dict
+        dictionary containing the parameters of the analysis
+
+    Returns
+    ------
+    list[tuple]:
+        time constant and its uncertainty, start and end indices and fit parameters of the valid candidates
+    """
+
+    s_clean = np.asarray(s_clean)
+    s_std = s_clean.std()
+    std_mask = np.where(s_clean > shared_info['coeff'] * s_std + s_clean.mean())[0]
+
+    if not std_mask.size:
+        return []
+
+    # the parameter offset is necessary because, when I execute the candidate filter,
+    # I retrieve the data for each candidate starting from the entire signal and time arrays
+    candidates = get_candidates(
+        s_clean=s_clean[std_mask[0]: std_mask[-1] + 3 * shared_info['points_exp_decrease']],
+        std_mask=std_mask - std_mask[0], points_exp_decrease=shared_info["points_exp_decrease"],
+        offset=std_mask[0])
+
+    # from here onwards, consider as a candidate the linear vertical growth
+    # followed by exponential decreasing trend
+    candidates = [c for c in candidates
+                  if candidate_filter(time_raw[c[0]: c[1]], s_clean[c[0]: c[1]],
+                                      shared_info['points_vertical_trend'], shared_info['slope'])]
+
+    data = []
+    for candidate in candidates:
+        # fit every valid candidate: a, b, c, std(tau)
+        fit = get_fit_candidate(time_raw[candidate[0]: candidate[1]], s_clean[candidate[0]: candidate[1]], s_std)
+
+        # saves the time constants and their corresponding start and end indices
+        # of the candidate if the time constant is different from None
+        if tau := get_time_constant(fit):
+            data.append((tau, [int(candidate[0]), int(candidate[1])], fit))
+
+    return data
+
+
 def get_taus(tes_keys: list[str],
              mode: str,
-             to_analyze: list[str]) -> dict[int, dict[str, list[float]]]:
+             to_analyze: list[str],
+             pool: TODPool) -> dict[int, dict[str, list[float]]]:
     """
     Return TESs time constants
 
@@ -1008,6 +1010,9 @@ def get_taus(tes_keys: list[str],
     to_analyze: list[str]
         TES to analyze
 
+    pool: TODPool
+        pool of worker processes, each of them analyzing whole TES
+
     Returns
     ------
     dict[int, dict[str, list[float]]]:
@@ -1021,109 +1026,40 @@ def get_taus(tes_keys: list[str],
     all_taus_found = 0
     taus_per_tes = dict()
 
-    time_raw = np.load(SHARED_INFO["time_fname"])
-    signals = np.load(SHARED_INFO["signals_clean_fname"])
+    with SharedArray.open(SHARED_INFO["time_fname"]) as time_raw, \
+            SharedArray.open(SHARED_INFO["signals_clean_fname"]) as signals:
 
-    # mp.Pool is the manager of child processes
-    with mp.Pool() as pool:
-
-        for n_tes in tqdm(iter_, ncols=100, file=sys.stdout, desc="Progress", unit='tes'):  # colour='WHITE',
-
-            s_clean = signals[n_tes]
-            s_std = s_clean.std()
-            std_mask = np.where(s_clean > SHARED_INFO['coeff'] * s_std + s_clean.mean())[0]
-
-            if std_mask.size:
-
-                # the parameter offset is necessary because, when I execute the candidate filter,
-                # I retrieve the data for each candidate starting from the entire signal and time arrays
-                candidates = get_candidates(
-                    s_clean=s_clean[std_mask[0]: std_mask[-1] + 3 * SHARED_INFO['points_exp_decrease']],
-                    std_mask=std_mask - std_mask[0], points_exp_decrease=SHARED_INFO["points_exp_decrease"],
-                    offset=std_mask[0])
-
-                if candidates:
-
-                    chunksize = max(2, len(candidates) // mp.cpu_count())
-
-                    # from here onwards, consider as a candidate the linear vertical growth
-                    # followed by exponential decreasing trend
-                    tm_candidates = list(map(lambda c: time_raw[c[0]: c[1]], candidates))
-                    sig_candidates = list(map(lambda c: s_clean[c[0]: c[1]], candidates))
-
-                    candidates = multiprocess_filter(pool=pool,
-                                                     candidates=candidates,
-                                                     function=candidate_filter,
-                                                     args=zip(tm_candidates,
-                                                              sig_candidates,
-                                                              [SHARED_INFO['points_vertical_trend']] * len(candidates),
-                                                              [SHARED_INFO['slope']] * len(candidates)),
-                                                     chunksize=chunksize)
-
-                    chunksize = max(2, len(candidates) // mp.cpu_count())
+        results = pool.map_rows(get_tes_taus, signals, rows=[tes_keys.index(n_tes) for n_tes in iter_],
+                                args=(time_raw, SHARED_INFO), chunksize=1)
 
-                    # fit every valid candidate
-                    tm_candidates = map(lambda c: time_raw[c[0]:c[1]], candidates)
-                    sig_candidates = map(lambda c: s_clean[c[0]:c[1]], candidates)
+        for n_tes, data in tqdm(zip(iter_, results), total=len(iter_), ncols=100, file=sys.stdout,
+                                desc="Progress", unit='tes'):  # colour='WHITE',
 
-                    # matrix containing n candidates rows and 4 columns (a,b,c, std(tau))
-                    fit_matrix = pool.starmap(get_fit_candidate,
-                                              zip(tm_candidates, sig_candidates, [s_std] * len(candidates)),
-                                              chunksize)
+            if data:
+                n_tes = int(n_tes)
+                all_taus_found += len(data)
+                tes, asic = get_tes_asic_from_index(n_tes)
 
-                    # save the taus of the candidates in the list
-                    if taus := pool.map(get_time_constant, fit_matrix, chunksize=chunksize):
+                taus_per_tes[n_tes] = {'taus': [row[0][0] for row in data]}
+                taus_per_tes[n_tes]['tes'] = [tes, asic]
+                taus_per_tes[n_tes]['sigma'] = [row[0][1] for row in data]
+                taus_per_tes[n_tes]['indexes'] = [row[1] for row in data]
+                taus_per_tes[n_tes]['exp fit params'] = [row[2][:-1].tolist() for row in data]
 
-                        # saves the time constants and their corresponding start and end indices
-                        # of the candidate if the time constant is different from None
-                        if data := list(filter(lambda x: x[0], zip(taus, candidates, fit_matrix))):
+                logger.info("#Tes (index): %s | #Time constants: %s", n_tes, len(data))
 
-                            n_tes = int(n_tes)
-                            all_taus_found += len(taus)
-                            tes, asic = get_tes_asic_from_index(n_tes)
+        # filter the candidate's time constant based on the time constant of the TES
+        # taus_per_tes.extend(multiprocess_filter(pool=pool,
+        #                                         candidates=taus,
+        #                                         func=tau_filter,
+        #                                         args=zip(taus,
+        #                                                  [SHARED_INFO['tau_coeff']] * len(taus),
+        #                                                  [SHARED_INFO['epsilon']] * len(taus)),
+        #                                         chunksize=chunksize))
 
-                            taus_per_tes[n_tes] = {'taus': [row[0][0] for row in data]}
-                            taus_per_tes[n_tes]['tes'] = [tes, asic]
-                            taus_per_tes[n_tes]['sigma'] = [row[0][1] for row in data]
-                            taus_per_tes[n_tes]['indexes'] = [row[1] for row in data]
-                            taus_per_tes[n_tes]['exp fit params'] = [row[2][:-1].tolist() for row in data]
-
-                            logger.info("#Tes (index): %s | #Time constants: %s", n_tes, len(taus))
-
-                # filter the candidate's time constant based on the time constant of the TES
-                # taus_per_tes.extend(multiprocess_filter(pool=pool,
-                #                                         candidates=taus,
-                #                                         func=tau_filter,
-                #                                         args=zip(taus,
-                #                                                  [SHARED_INFO['tau_coeff']] * len(taus),
-                #                                                  [SHARED_INFO['epsilon']] * len(taus)),
-                #                                         chunksize=chunksize))
-
-        logger.info("Number of time constants for all TESs: %s", all_taus_found)
-
-        return taus_per_tes
-
-
-def release_share_memory():
-    """
-    It frees shared memory
-    """
-
-    for key in SHARED_INFO:
-        #  check that the memory freeing operations are carried out only in the presence of shared memory portions
-        if 'shm' in key and 'name' in SHARED_INFO[key]:
-            # access the shared memory block
-            try:
-                shm = SharedMemory(name=SHARED_INFO[key]['name'])
-                # close access to shared memory block for process calling .close()
-                shm.close()
-                # release shared memory
-                shm.unlink()
-                logger.info("released shared memory for '%s'", SHARED_INFO[key]['name'])
-                SHARED_INFO[key] = dict()
+    logger.info("Number of time constants for all TESs: %s", all_taus_found)
 
-            except FileNotFoundError:
-                logger.exception("Error releasing shared memory for '%s': ", SHARED_INFO[key]['name'])
+    return taus_per_tes
 
 
 def get_tes_asic_from_index(tes: int) -> tuple[int, int]:
@@ -1170,9 +1106,10 @@ def plot_tau_candidates(fig: plt.Figure, taus: dict, shared_info: dict, n_tes: s
         TES index in the range [0, 255]
     """
 
-    # load the entire time and signal of the TES
+    # load the entire time and the signal of the TES
     time_raw = np.load(shared_info['time_fname'])
-    clean_signal = np.load(shared_info['signals_clean_fname'])[n_tes]
+    clean_signal = np.load(shared_info['signals_clean_fname'],
+                           mmap_mode='r')[shared_info['tes_keys'].index(n_tes)]
 
     # calculate the mean and standard deviation of the signal
     s_std = clean_signal.std()
@@ -1480,7 +1417,7 @@ def find_cosmic_rays(src_path: str,
 
     dst_path: str
         folder where two folders are created:
-            1. Input, which contains the .npy (time) and .npz (signals of all TES) files;
+            1. Input, which contains the .npy files of the time and of the (ntes, nsamples) signals;
             2. Output, which contains the .txt file of the taus;
 
     mode: str
@@ -1496,7 +1433,7 @@ def find_cosmic_rays(src_path: str,
         path to the mask file, containing the information of the TES sign
 
     remove_files: bool
-        remove .npy and .npz after analysis
+        remove the .npy files after analysis
 
     Returns
     -------
@@ -1507,21 +1444,21 @@ def find_cosmic_rays(src_path: str,
     # start = tm.perf_counter()
     logger.info("configuration of all the necessary variables")
 
-    # configuration of saving point of the exported files (.npy and .npz format)
+    # configuration of saving point of the exported files (.npy format)
     _ = configure_data(src_path=src_path, dst_path=dst_path, mask=check_mask(mask_fname=mask_fname))
 
-    logger.info("export clean signals from atmospheric drift")
+    with TODPool() as pool:
+        logger.info("export clean signals from atmospheric drift")
 
-    # export clean signals in .npz format
-    tes_keys = save_interp_signals()
-    release_share_memory()
+        # the workers write the clean signals in a memory-mapped .npy file
+        tes_keys = save_interp_signals(pool)
 
-    logger.info("search for the time constants of all TESs")
+        logger.info("search for the time constants of all TESs")
 
-    # dictionary whose keys are the number of TESs and whose values are
-    # a list containing the time constants of the related TES
-    start = tm.perf_counter()
-    taus_per_tes = get_taus(tes_keys=tes_keys, mode=mode, to_analyze=list(map(str, to_analyze)))
+        # dictionary whose keys are the number of TESs and whose values are
+        # a list containing the time constants of the related TES
+        start = tm.perf_counter()
+        taus_per_tes = get_taus(tes_keys=tes_keys, mode=mode, to_analyze=list(map(str, to_analyze)), pool=pool)
 
     end = tm.perf_counter()
     execution_time = f"Time to process signals: {end - start:.2f}[s]"
@@ -1548,7 +1485,7 @@ def find_cosmic_rays(src_path: str,
             os.remove(file)
 
         os.rmdir(SHARED_INFO['src_dir'])
-        logger.info('.npy and .npz files removed')
+        logger.info('.npy files removed')
 
         if not os.listdir(SHARED_INFO['plots_dir']):
             os.rmdir(SHARED_INFO['plots_dir'])
@@ -1581,7 +1518,7 @@ if __name__ == "__main__":
 
     mask_help = """mask that filters the valid TES signals to be saved (with the relative sign). 
         So if a TES is negative, its signal will be exported by changing its sign. 
-        The mask is used before exporting files in .npy and .npz format, so it will have no effect on existing files."""
+        The mask is used before exporting the .npy files, so it will have no effect on existing files."""
 
     parser.add_argument('-m', '--mask',
                         type=pathlib.Path,
@@ -1616,7 +1553,7 @@ if __name__ == "__main__":
 
     parser.add_argument('-rf', '--remove_files',
                         action='store_true',
-                        help='remove .npy and .npz files after the analysis has been completed')
+                        help='remove the .npy files after the analysis has been completed')
 
     args = parser.parse_args()
 
@@ -1635,8 +1572,8 @@ if __name__ == "__main__":
     if len(datasets) >= 2 and not remove_files:
         warning = """\033[91mWarning!
                 You have selected more than two datasets to analyze, and you haven't requested 
-                the removal of .npy and .npz files. Keep in mind that analyzing a single dataset generates .npy and .npz files 
-                that will take up approximately 9 GB of space in total! Do you want to MAINTAIN all the .npy and .npz files 
+                the removal of .npy files. Keep in mind that analyzing a single dataset generates .npy files 
+                that will take up approximately 9 GB of space in total! Do you want to MAINTAIN all the .npy files 
                 that will be created (NOT recommended action)? [y/n]\033[0m """
 
         remove_files = input(warning).lower() != 'y'
@@ -1668,7 +1605,6 @@ if __name__ == "__main__":
 
         except Exception:
             logger.exception("Exception while executing find_cosmic_rays")
-            release_share_memory()
 
     write_dict_to_json(os.path.join(dst_path, 'candidates_per_dataset.json'), results, indent=4)
 
@@ -4,12 +4,12 @@ import sys
 import os
 import numpy as np
 from scipy.optimize import curve_fit
-import pickle
 
 # Specific qubic modules
 from qubicpack.utilities import Qubic_DataDir
 from qubic import QubicSkySim as qss
 from qubic import camb_interface as qc
+from qubic.fastsim_store import save_fastsim_data
 
 # ### To run that script: $ python FastSim_CreateNoiseFiles.py config alpha signoise
 
@@ -235,7 +235,7 @@ for nfsub in all_nf:
     plt.close()
     plt.show()
 
-    # ============== Save pickle files for the Fast Simulator ======================
+    # ============== Save npz files for the Fast Simulator ======================
     # ############## Comment this is you don't want to overwrite files ! #########################
 
     data = {'nfsub': nfsub,
@@ -246,9 +246,9 @@ for nfsub in all_nf:
             'signoise': float(sys.argv[3]),
             'effective_variance_invcov': myfitcovs,
             'clnoise': clth_tosave}
-    name = 'DataFastSimulator_' + config + '_nfsub_{}.pkl'.format(nfsub)
-    pickle.dump(data, open(global_dir + 'doc/FastSimulator/Data/' + name, "wb"))
+    name = 'DataFastSimulator_' + config + '_nfsub_{}.npz'.format(nfsub)
+    save_fastsim_data(global_dir + 'doc/FastSimulator/Data/' + name, data)
 
 datacov = {'coverage': coverage}
-name = 'DataFastSimulator_' + config + '_coverage.pkl'
-pickle.dump(datacov, open(global_dir + 'doc/FastSimulator/Data/' + name, "wb"))
+name = 'DataFastSimulator_' + config + '_coverage.npz'
+save_fastsim_data(global_dir + 'doc/FastSimulator/Data/' + name, datacov)
@@ -0,0 +1,233 @@
+from __future__ import division, print_function
+
+import multiprocessing as mp
+import numpy as np
+
+__all__ = ['SharedArray',
+           'TODPool']
+
+
+class SharedArray(object):
+    """
+    Array whose buffer is shared between processes, either as a block of
+    shared memory or as a memory-mapped .npy file.
+
+    Pickling a SharedArray only transmits the reference to its buffer, so
+    that a (ntes, nsamples) TOD can be handed to worker processes, which
+    then only read and write the rows they process.
+
+    Example
+    -------
+    >>> with SharedArray.from_array(tod) as shared:
+    ...     with TODPool() as pool:
+    ...         rms = list(pool.map_rows(np.std, shared))
+
+    """
+    def __init__(self, shape, dtype=np.float64, filename=None):
+        """
+        Allocate a shared array.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            The shape of the array.
+        dtype : dtype, optional
+            The data type of the array.
+        filename : str, optional
+            If specified, the array is stored in this .npy file and memory
+            mapped. Otherwise, it is stored in a block of shared memory, which
+            is released by the close method of the array that created it.
+
+        """
+        shape = tuple(np.atleast_1d(shape).astype(int))
+        dtype = np.dtype(dtype)
+        if filename is None:
+            from multiprocessing.shared_memory import SharedMemory
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            self._shm = SharedMemory(create=True, size=max(nbytes, 1))
+            self.name = self._shm.name
+            data = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        else:
+            self._shm = None
+            self.name = None
+            data = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                             shape=shape)
+        self.filename = filename
+        self.mode = 'r+'
+        self.data = data
+        self._owner = True
+
+    @classmethod
+    def from_array(cls, array, filename=None):
+        """
+        Return a shared copy of an array.
+
+        Parameters
+        ----------
+        array : array-like
+            The array to be copied.
+        filename : str, optional
+            The .npy file of the shared array, if it is memory mapped.
+
+        """
+        array = np.asarray(array)
+        out = cls(array.shape, dtype=array.dtype, filename=filename)
+        out.data[...] = array
+        return out
+
+    @classmethod
+    def open(cls, filename, mode='r'):
+        """
+        Share an existing .npy file, without copying it.
+
+        Parameters
+        ----------
+        filename : str
+            The .npy file.
+        mode : {'r', 'r+'}, optional
+            The memory-map mode of the file.
+
+        """
+        out = cls.__new__(cls)
+        out._shm = None
+        out.name = None
+        out.filename = filename
+        out.mode = mode
+        out.data = np.load(filename, mmap_mode=mode)
+        out._owner = False
+        return out
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __reduce__(self):
+        return _attach, (self.name, self.filename, self.mode, self.shape,
+                         self.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release the buffer of the array. The block of shared memory is freed
+        if this array created it.
+
+        """
+        if self.data is None:
+            return
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+        self.data = None
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
+
+
+class TODPool(object):
+    """
+    Pool of worker processes applying a function to the rows of shared
+    arrays, such as the TOD of the detectors.
+
+    The tasks only carry the references of the shared arrays and the row
+    indices, so that the data are never copied between the processes.
+
+    """
+    def __init__(self, processes=None):
+        """
+        Parameters
+        ----------
+        processes : int, optional
+            The number of worker processes. By default, the number of CPUs.
+
+        """
+        from multiprocessing import resource_tracker
+        # the workers must share the resource tracker of this process, so
+        # that they do not release the shared memory blocks they attach to
+        resource_tracker.ensure_running()
+        self.processes = processes or mp.cpu_count()
+        self.pool = mp.Pool(self.processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Terminate the worker processes. """
+        self.pool.terminate()
+        self.pool.join()
+
+    def map_rows(self, func, data, rows=None, args=(), out=None,
+                 chunksize=None):
+        """
+        Iterate over the results of func(data[row], *args), computed by the
+        worker processes, in the order of the rows.
+
+        Parameters
+        ----------
+        func : callable
+            A picklable function, i.e. defined at the top level of a module.
+        data : SharedArray
+            The shared array whose rows are processed.
+        rows : sequence of int, optional
+            The indices of the rows. By default, all of them.
+        args : tuple, optional
+            The other arguments of func.
+        out : SharedArray, optional
+            If specified, the results are stored by the workers in the
+            corresponding rows of out and the iteration yields None.
+        chunksize : int, optional
+            The number of rows per task. By default, the rows are spread
+            evenly over the workers.
+
+        """
+        if rows is None:
+            rows = range(len(data))
+        if chunksize is None:
+            chunksize = max(1, len(rows) // (4 * self.processes))
+        tasks = ((func, data, row, args, out) for row in rows)
+        return self.pool.imap(_apply_row, tasks, chunksize=chunksize)
+
+
+def _attach(name, filename, mode, shape, dtype):
+    out = SharedArray.__new__(SharedArray)
+    out.name = name
+    out.filename = filename
+    out.mode = mode
+    out._owner = False
+    if name is None:
+        out._shm = None
+        out.data = np.load(filename, mmap_mode=mode)
+    else:
+        from multiprocessing.shared_memory import SharedMemory
+        out._shm = SharedMemory(name=name)
+        out.data = np.ndarray(shape, dtype=dtype, buffer=out._shm.buf)
+    return out
+
+
+def _apply_row(task):
+    func, data, row, args, out = task
+    result = func(data[row], *args)
+    if out is None:
+        return result
+    out[row] = result
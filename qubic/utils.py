@@ -1,6 +1,7 @@
 from __future__ import division, print_function
 
 from progressbar import ProgressBar, Bar, ETA, Percentage
+import hashlib
 import numpy as np
 import signal
 import traceback
@@ -119,3 +120,50 @@ def _uncompress_mask(mask):
     return np.array(l, bool)
 
 
+def _digest(*items):
+    """
+    Return the hexadecimal SHA-1 digest of a sequence of arrays and of
+    objects identified by their representation.
+
+    """
+    h = hashlib.sha1()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            item = np.ascontiguousarray(item)
+            h.update(str((item.dtype, item.shape)).encode())
+            h.update(item.view(np.uint8))
+        else:
+            h.update(repr(item).encode())
+    return h.hexdigest()
+
+
+def _atomic_write(filename, write, suffix=''):
+    """
+    Write a file by calling write(tmpname) on a temporary name and renaming
+    it, so that concurrent processes never read a partially written file and
+    an interrupted write leaves the previous file intact. The directory of
+    the file is created if needed and the temporary file is removed if the
+    write fails.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file.
+    write : callable
+        The function writing the file whose name is its argument.
+    suffix : str, optional
+        The suffix of the temporary name, for writers that require a file
+        extension.
+
+    """
+    path = os.path.dirname(filename)
+    if path != '':
+        os.makedirs(path, exist_ok=True)
+    tmpname = '{}.{}.tmp{}'.format(filename, os.getpid(), suffix)
+    try:
+        write(tmpname)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
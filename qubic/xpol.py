@@ -1,11 +1,20 @@
 from __future__ import division
 
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import healpy as hp
 import numpy as np
-import pysimulators._flib as flib
+
+from . import _flib as flib
+from .utils import _atomic_write, _digest
 
 __all__ = ['Xpol']
 
+XPOL_CACHE_SIZE = 4
+_XPOL_CACHE = OrderedDict()
+
 
 class Xpol(object):
     """
@@ -18,9 +27,10 @@ class Xpol(object):
     ell_binned = xpol.ell_binned
     biased, unbiased = xpol.get_spectra(map)
     biased, unbiased = xpol.get_spectra(map1, map2)
+    biased, unbiased = xpol.get_spectra([map1, map2, map3])
 
     """
-    def __init__(self, mask, lmin, lmax, delta_ell):
+    def __init__(self, mask, lmin, lmax, delta_ell, cache=None):
         """
         Parameters
         ----------
@@ -33,6 +43,11 @@ class Xpol(object):
             the last l bin is lesser or equal to this value.
         delta_ell :
             The l bin width.
+        cache : str, optional
+            Directory in which the mode-coupling kernel and its binned
+            inverse are stored, so that they are read instead of recomputed
+            for the same mask and binning. They are also kept in memory for
+            the last XPOL_CACHE_SIZE masks and binnings.
 
         """
         mask = np.asarray(mask)
@@ -43,15 +58,35 @@ class Xpol(object):
         if lmax < lmin:
             raise ValueError('Input lmax is less than lmin.')
         delta_ell = int(delta_ell)
-        wl = hp.anafast(mask)[:lmax+1]
         self.mask = mask
         self.lmin = lmin
         self.lmax = lmax
         self.delta_ell = delta_ell
-        self.wl = wl
         self.ell_binned, self._p, self._q = self._bin_ell()
-        mll_binned = self._get_Mll()
-        self.mll_binned_inv = np.linalg.inv(mll_binned)
+        self.cache = cache
+        key = _digest('qubic.xpol.v1', mask, lmin, lmax, delta_ell)
+        filename = None
+        if cache is not None:
+            filename = os.path.join(cache, 'xpol_{}.npz'.format(key))
+        if key in _XPOL_CACHE:
+            _XPOL_CACHE.move_to_end(key)
+            self.wl, self._mll_blocks, self.mll_binned_inv = _XPOL_CACHE[key]
+        elif filename is not None and os.path.exists(filename):
+            with np.load(filename) as data:
+                self.wl = data['wl']
+                self._mll_blocks = tuple(data['mll_blocks'])
+                self.mll_binned_inv = data['mll_binned_inv']
+        else:
+            self.wl = hp.anafast(mask)[:lmax+1]
+            self._mll_blocks = self._get_Mll_blocks()
+            mll_binned = self._get_Mll()
+            self.mll_binned_inv = np.linalg.inv(mll_binned)
+        if filename is not None and not os.path.exists(filename):
+            _save_mll(filename, self.wl, self._mll_blocks,
+                      self.mll_binned_inv)
+        _XPOL_CACHE[key] = self.wl, self._mll_blocks, self.mll_binned_inv
+        while len(_XPOL_CACHE) > XPOL_CACHE_SIZE:
+            _XPOL_CACHE.popitem(last=False)
 
     def bin_spectra(self, spectra):
         """
@@ -66,7 +101,7 @@ class Xpol(object):
         fact_binned = 2 * np.pi / (self.ell_binned * (self.ell_binned + 1))
         return np.dot(spectra[..., :self.lmax+1], self._p.T) * fact_binned
 
-    def get_spectra(self, map1, map2=None):
+    def get_spectra(self, map1, map2=None, nthreads=None):
         """
         Return biased and Xpol-debiased estimations of the power spectra of
         a Healpix map or of the cross-power spectra if *map2* is provided.
@@ -80,42 +115,78 @@ class Xpol(object):
         l bin may be less than lmax. The central value of the bins can be
         obtained through the attribute `xpol.ell_binned`.
 
+        A stack of maps, such as Monte-Carlo realisations, can also be given.
+        The pseudo spectra of the maps are then computed by parallel threads
+        and debiased together.
+
         Parameters
         ----------
-        map1 : Nx3 or 3xN array
+        map1 : Nx3 or 3xN array, or stack of such arrays
             The I, Q, U Healpix maps.
-        map2 : Nx3 or 3xN array, optional
+        map2 : Nx3 or 3xN array, or stack of such arrays, optional
             The I, Q, U Healpix maps.
+        nthreads : int, optional
+            The number of threads computing the pseudo spectra of a stack of
+            maps. By default, the number of CPUs.
 
         Returns
         -------
-        biased : float array of shape (6, lmax+1)
+        biased : float array of shape ([nmaps,] 6, lmax+1)
             The anafast's pseudo (cross-) power spectra for TT, EE, BB, TE, EB,
             TB. The corresponding l values are given by `np.arange(lmax + 1)`.
 
-        unbiased : float array of shape (6, nbins)
+        unbiased : float array of shape ([nmaps,] 6, nbins)
             The Xpol's (cross-) power spectra for TT, EE, BB, TE, EB, TB.
             The corresponding l values are given by `xpol.ell_binned`.
 
         """
-        map1 = np.asarray(map1)
-        if map1.shape[-1] == 3:
-            map1 = map1.T
-        if map2 is None:
-            biased = hp.anafast(map1 * self.mask, pol=True)
+        map1 = self._as_stack(map1)
+        squeeze = map1.ndim == 2
+        if squeeze:
+            map1 = map1[None]
+        if map2 is not None:
+            map2 = self._as_stack(map2)
+            if map2.ndim == 2:
+                map2 = map2[None]
+            if len(map2) != len(map1):
+                raise ValueError('The stacks of maps do not have the same '
+                                 'length.')
+
+        def anafast(i):
+            if map2 is None:
+                cls = hp.anafast(map1[i] * self.mask, pol=True)
+            else:
+                cls = hp.anafast(map1[i] * self.mask, map2[i] * self.mask,
+                                 pol=True)
+            return np.array([cl[:self.lmax+1] for cl in cls])
+
+        if len(map1) == 1:
+            biased = anafast(0)[None]
         else:
-            map2 = np.asarray(map2)
-            if map2.shape[-1] == 3:
-                map2 = map2.T
-            biased = hp.anafast(map1 * self.mask, map2 * self.mask, pol=True)
-        biased = np.array([cl[:self.lmax+1] for cl in biased])
+            with ThreadPoolExecutor(nthreads) as executor:
+                biased = np.array(list(executor.map(anafast,
+                                                    range(len(map1)))))
         binned = self.bin_spectra(biased)
         fact_binned = self.ell_binned * (self.ell_binned + 1) / (2 * np.pi)
         binned *= fact_binned
-        unbiased = np.dot(self.mll_binned_inv, binned.ravel()).reshape(6, -1)
+        unbiased = np.dot(binned.reshape(len(binned), -1),
+                          self.mll_binned_inv.T).reshape(binned.shape)
         unbiased /= fact_binned
+        if squeeze:
+            return biased[0], unbiased[0]
         return biased, unbiased
 
+    @staticmethod
+    def _as_stack(maps):
+        """
+        Return the maps as a (3, N) or (nmaps, 3, N) array.
+
+        """
+        maps = np.asarray(maps)
+        if maps.shape[-1] == 3:
+            maps = np.swapaxes(maps, -1, -2)
+        return maps
+
     def _bin_ell(self):
         nbins = (self.lmax - self.lmin + 1) // self.delta_ell
         start = self.lmin + np.arange(nbins) * self.delta_ell
@@ -134,6 +205,8 @@ class Xpol(object):
         return ell_binned, p, q
 
     def _get_Mll_blocks(self):
+        if getattr(self, '_mll_blocks', None) is not None:
+            return self._mll_blocks
         TT_TT, EE_EE, EE_BB, TE_TE, EB_EB, ier = flib.xpol.mll_blocks_pol(
             self.lmax, self.wl)
         if ier > 0:
@@ -168,3 +241,16 @@ class Xpol(object):
         out[4*n:5*n, 4*n:5*n] = TE_TE
         out[5*n:6*n, 5*n:6*n] = EB_EB
         return out
+
+
+def _save_mll(filename, wl, mll_blocks, mll_binned_inv):
+    """
+    Store the mask spectrum, the mode-coupling kernel blocks and the binned
+    inverse of an Xpol object.
+
+    """
+    def write(tmpname):
+        with open(tmpname, 'wb') as f:
+            np.savez(f, wl=wl, mll_blocks=np.array(mll_blocks),
+                     mll_binned_inv=mll_binned_inv)
+    _atomic_write(filename, write)
@@ -0,0 +1,26 @@
+import os
+import pytest
+
+from qubic.utils import _atomic_write
+
+
+def test_atomic_write(tmp_path):
+    directory = tmp_path / 'cache'
+    filename = str(directory / 'file.txt')
+
+    def write(tmpname):
+        with open(tmpname, 'w') as f:
+            f.write('first')
+
+    def write_fail(tmpname):
+        with open(tmpname, 'w') as f:
+            f.write('partial')
+        raise IOError('disk full')
+
+    _atomic_write(filename, write)
+    assert os.listdir(str(directory)) == ['file.txt']
+    with pytest.raises(IOError):
+        _atomic_write(filename, write_fail)
+    assert os.listdir(str(directory)) == ['file.txt']
+    with open(filename) as f:
+        assert f.read() == 'first'
@@ -0,0 +1,70 @@
+import healpy as hp
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from qubic.demodulation_lib import bin_map, coadd_flatmap
+
+
+def _bin_map_loop(data, pixels, npix, countcut):
+    mymap = np.zeros((len(data), npix))
+    mapcount = np.zeros(npix)
+    for i in range(data.shape[1]):
+        mymap[:, pixels[i]] += data[:, i]
+        mapcount[pixels[i]] += 1
+    unseen = mapcount <= countcut
+    mymap[:, unseen] = hp.UNSEEN
+    mymap[:, ~unseen] /= mapcount[~unseen]
+    return mymap, mapcount
+
+
+def test_bin_map():
+    rng = np.random.default_rng(0)
+    nside = 16
+    npix = 12 * nside ** 2
+    nsamples = 5000
+    data = rng.standard_normal((3, nsamples))
+    pixels = hp.ang2pix(nside, rng.random(nsamples) * 60,
+                        rng.random(nsamples) * 30, lonlat=True)
+
+    for countcut in (0, 2):
+        expected, expected_count = _bin_map_loop(data, pixels, npix, countcut)
+        maps, count = bin_map(data, pixels, npix, countcut=countcut)
+        assert_same(maps, expected)
+        assert_same(count, expected_count)
+        maps, count = bin_map(data[1], pixels, npix, countcut=countcut)
+        assert_same(maps, expected[1])
+
+        # partial sky
+        maps, count, seen = bin_map(data, pixels, npix, countcut=countcut,
+                                    partial=True)
+        assert_same(seen, np.where(expected_count > countcut)[0])
+        assert_same(maps, expected[:, seen])
+        assert_same(count, expected_count[seen])
+
+    # weighted means and pixels outside the map
+    weights = rng.random(nsamples)
+    weights[pixels == pixels[0]] = 0
+    maps, count = bin_map(data, pixels, npix, weights=weights)
+    expected = _bin_map_loop(data * weights, pixels, npix, 0)[0] / \
+        _bin_map_loop(weights[None, :], pixels, npix, 0)[0]
+    seen = count > 0
+    seen[pixels[0]] = False
+    assert_same(maps[:, seen], expected[:, seen])
+    assert np.all(maps[:, ~seen] == hp.UNSEEN)
+    shifted = np.where(pixels == pixels[1], npix, pixels)
+    maps, count = bin_map(data, shifted, npix)
+    assert count[pixels[1]] == 0
+    assert np.all(maps[:, pixels[1]] == hp.UNSEEN)
+
+    # flat maps
+    az = rng.random(nsamples) * 10
+    el = 45 + rng.random(nsamples) * 10
+    themap, map_az, map_el = coadd_flatmap(
+        data.copy(), az, el, azmin=1, azmax=9, elmin=46, elmax=54, naz=8,
+        nel=8, silent=True, remove_eltrend=False)
+    assert themap.shape == (3, 8, 8)
+    iaz = (az - 1).astype(int)
+    iel = (el - 46).astype(int)
+    for iy, ix in ((0, 0), (3, 5), (7, 7)):
+        ok = (iaz == ix) & (iel == iy)
+        assert_same(themap[:, iy, ix], np.mean(data[:, ok], axis=1))
@@ -0,0 +1,49 @@
+import numpy as np
+
+from astropy.time import Time, TimeDelta
+from pysimulators import (
+    SphericalEquatorial2GalacticOperator,
+    SphericalEquatorial2HorizontalOperator,
+    SphericalGalactic2EquatorialOperator,
+    SphericalHorizontal2EquatorialOperator)
+from qubic import equ2hor, gal2hor, hor2equ, hor2gal
+from qubic.samplings import _sph2cart
+
+
+def test_coordinates():
+    rng = np.random.default_rng(0)
+    n = 1000
+    a = rng.random(n) * 360
+    b = np.degrees(np.arcsin(2 * rng.random(n) - 1))
+    t = rng.random(n) * 86400 * 30
+    date_obs = '2019-03-04 12:34:56'
+    latitude, longitude = -24.18, -66.47
+    times = Time(date_obs, scale='utc') + TimeDelta(t, format='sec')
+    e2h = SphericalEquatorial2HorizontalOperator(
+        'NE', times, latitude, longitude, degrees=True)
+    h2e = SphericalHorizontal2EquatorialOperator(
+        'NE', times, latitude, longitude, degrees=True)
+    operators = {
+        equ2hor: e2h,
+        hor2equ: h2e,
+        gal2hor: e2h(SphericalGalactic2EquatorialOperator(degrees=True)),
+        hor2gal: SphericalEquatorial2GalacticOperator(degrees=True)(h2e)}
+    incoords = np.array([a, b]).T
+    for func, operator in operators.items():
+        expected = operator(incoords)
+        for d in (date_obs, Time(date_obs, scale='utc')):
+            out = func(a, b, t, date_obs=d, latitude=latitude,
+                       longitude=longitude)
+            assert np.all((out[0] >= 0) & (out[0] < 360))
+            # the astropy Julian dates are accurate to ~5e-5 s
+            error = np.linalg.norm(
+                _sph2cart(*out) - _sph2cart(expected[:, 0], expected[:, 1]),
+                axis=-1)
+            assert np.max(error) < np.radians(1e-3 / 3600)
+
+    # broadcasting of the coordinates against the time samples
+    az, el = equ2hor(10., -50., t, date_obs=date_obs)
+    assert az.shape == el.shape == (n,)
+    ra, dec = hor2equ(az, el, t, date_obs=date_obs)
+    assert np.allclose(ra, 10, rtol=0, atol=1e-9)
+    assert np.allclose(dec, -50, rtol=0, atol=1e-9)
@@ -0,0 +1,38 @@
+import healpy as hp
+import numpy as np
+import pytest
+
+qss = pytest.importorskip('qubic.QubicSkySim')
+
+
+def _loop_pair_sums(themap, ipok, thetamin, thetamax, nbins):
+    thvals = np.linspace(np.radians(thetamin), np.radians(thetamax), nbins + 1)
+    ns = hp.npix2nside(len(themap))
+    thesum = np.zeros(nbins)
+    thecount = np.zeros(nbins)
+    for ip in ipok:
+        v = hp.pix2vec(ns, ip)
+        inner = set(hp.query_disc(ns, v, np.radians(thetamin)))
+        for k in range(nbins):
+            outer = set(hp.query_disc(ns, v, thvals[k + 1]))
+            ipneighb = list(outer - inner)
+            thesum[k] += np.sum(themap[ip] * themap[ipneighb])
+            thecount[k] += len(ipneighb)
+            inner = outer
+    return thesum / thecount
+
+
+def test_map_corr_neighbtheta():
+    nside = 16
+    rng = np.random.default_rng(0)
+    themap = rng.standard_normal(12 * nside ** 2)
+    ipok = hp.query_disc(nside, hp.ang2vec(0, -60, lonlat=True), np.radians(30))
+    themap[np.setdiff1d(np.arange(len(themap)), ipok)] = 0
+    for thetamin in (0, 3):
+        expected = _loop_pair_sums(themap, ipok, thetamin, 20, 8)
+        th, cth, errs = qss.map_corr_neighbtheta(themap, ipok, thetamin, 20, 8,
+                                                 verbose=False)
+        assert np.allclose(th, np.linspace(thetamin, 20, 9)[:-1] +
+                           (20 - thetamin) / 16)
+        assert np.allclose(cth, expected, rtol=1e-10, atol=1e-14)
+        assert np.all(np.isfinite(errs))
@@ -0,0 +1,66 @@
+import numpy as np
+import scipy.signal as scsig
+
+import qubic.fibtools as ft
+from qubic.demodulation_lib import (
+    DEMODULATION_CHUNK_SIZE, bin_per_period, demodulate_JC, return_rms_period)
+
+
+def test_return_rms_period():
+    rng = np.random.default_rng(0)
+    period = 1.
+    time = 3 + np.arange(3000) / 156.25
+    data = rng.standard_normal((4, len(time)))
+    data[:, ::37] += 20
+    others = np.array([time * 2, np.sin(time)])
+
+    tper, ampdata, err_ampdata, newothers = return_rms_period(
+        period, (time, data), others=others)
+    period_index = ((time - time[0]) / period).astype(int)
+    allperiods = np.unique(period_index)
+    assert ampdata.shape == err_ampdata.shape == (4, len(allperiods))
+    assert np.all(err_ampdata == 1)
+    for i, p in enumerate(allperiods):
+        ok = period_index == p
+        assert np.allclose(tper[i], np.mean(time[ok]))
+        assert np.allclose(newothers[1][:, i], np.mean(others[:, ok], axis=1))
+        for j in range(len(data)):
+            assert np.allclose(ampdata[j, i], ft.meancut(data[j, ok], 3)[1],
+                               rtol=1e-12)
+
+    tper_single, ampdata_single, _ = return_rms_period(period,
+                                                       (time, data[2]))
+    assert np.allclose(tper_single, tper)
+    assert np.allclose(ampdata_single, ampdata[2])
+    assert np.allclose(bin_per_period(period, time, others)[1], newothers[1])
+
+
+def test_demodulate_JC():
+    rng = np.random.default_rng(1)
+    period = 1.
+    time = np.arange(5000) / 156.25
+    src = np.sin(2 * np.pi * time / period)
+    data = rng.random((3, 1)) * src + 0.1 * rng.standard_normal((3, len(time)))
+    filter_period = np.ones(int(156.25 * period) + 1) / (
+        int(156.25 * period) + 1)
+    nsamples = int(4 * period * 156.25)
+    for quadrature in (False, True):
+        if quadrature:
+            src_shift = np.interp(time - period / 2, time, src, period=period)
+            product = np.sqrt((data * src) ** 2 + (data * src_shift) ** 2) / \
+                np.sqrt(2)
+        else:
+            product = data * src
+        expected = np.array([scsig.fftconvolve(p, filter_period, mode='same')
+                             for p in product])[:, nsamples:-nsamples]
+        for chunk in (100, DEMODULATION_CHUNK_SIZE):
+            t, demodulated, err = demodulate_JC(
+                period, (time, data), (time, src), quadrature=quadrature,
+                chunk=chunk)
+            assert np.allclose(t, time[nsamples:-nsamples])
+            assert np.allclose(demodulated, expected, rtol=0, atol=1e-12)
+        t, demodulated, err = demodulate_JC(
+            period, (time, data[0]), (time, src), quadrature=quadrature,
+            dtype=np.float32)
+        assert demodulated.dtype == np.float32
+        assert np.allclose(demodulated, expected[0], rtol=0, atol=1e-6)
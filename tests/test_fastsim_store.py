@@ -0,0 +1,49 @@
+import os
+import pickle
+import numpy as np
+
+from qubic.fastsim_store import (
+    convert_fastsim_pickle, get_fastsim_data, get_fastsim_filename,
+    save_fastsim_data)
+
+
+def test_fastsim_store(tmp_path):
+    rng = np.random.default_rng(0)
+    data = {'nfsub': 2,
+            'signoise': 75.,
+            'CovI': rng.random((2, 2)),
+            'effective_variance_invcov': [rng.random((3, 10)),
+                                          rng.random((3, 10))],
+            'clnoise': rng.random(100)}
+    directory = str(tmp_path)
+    filename = os.path.join(directory, 'DataFastSimulator_FI150_nfsub_2.pkl')
+    with open(filename, 'wb') as f:
+        pickle.dump(data, f)
+    assert get_fastsim_filename('FI150', 2, directory=directory) == filename
+    assert get_fastsim_data('FI150', 2, directory=directory)['signoise'] == 75
+
+    assert convert_fastsim_pickle(filename) == filename[:-4] + '.npz'
+    assert get_fastsim_filename('FI150', 2, directory=directory) == \
+        filename[:-4] + '.npz'
+    out = get_fastsim_data('FI150', 2, directory=directory)
+    assert out is get_fastsim_data('FI150', 2, directory=directory)
+    assert sorted(out.keys()) == sorted(data)
+    assert out['nfsub'] == 2 and isinstance(out['nfsub'], int)
+    assert isinstance(out['clnoise'], np.memmap)
+    assert np.array_equal(out['clnoise'], data['clnoise'])
+    assert np.array_equal(out['CovI'], data['CovI'])
+    assert isinstance(out['effective_variance_invcov'], list)
+    for a, b in zip(out['effective_variance_invcov'],
+                    data['effective_variance_invcov']):
+        assert np.array_equal(a, b)
+
+    # the coverage file, and the files of the package
+    save_fastsim_data(os.path.join(directory,
+                                   'DataFastSimulator_FI150_coverage.npz'),
+                      {'coverage': np.arange(12.)})
+    assert np.array_equal(
+        get_fastsim_data('FI150', directory=directory)['coverage'],
+        np.arange(12))
+    data = get_fastsim_data('FI150', 3)
+    assert data['nfsub'] == 3
+    assert np.shape(data['effective_variance_invcov']) == (3, 3, 1000)
@@ -0,0 +1,57 @@
+import numpy as np
+
+from qubic.fibtools import filter_data, fold_data, profile, profile_batch
+
+
+def test_profile_batch():
+    rng = np.random.default_rng(0)
+    x = rng.random(2000) * 10
+    y = rng.standard_normal((4, 2000)) + np.sin(x)
+    y[1, :30] = np.nan
+    y[2, (x > 3) & (x < 4)] = np.nan
+    y[3, (x > 6) & (x < 7)] = 1.
+    x[5] = np.nan
+    for median in (False, True):
+        for dispersion in (False, True):
+            xc, yval, dx, dy = profile_batch(
+                x, y, rng=[0, 10], nbins=10, dispersion=dispersion,
+                median=median)
+            for i in range(len(y)):
+                expected = profile(x, y[i], rng=[0, 10], nbins=10,
+                                   dispersion=dispersion, plot=False,
+                                   cutbad=False, median=median)
+                for actual, e in zip((xc[i], yval[i], dx[i], dy[i]),
+                                     expected):
+                    assert np.allclose(actual, e, rtol=1e-12, atol=1e-14)
+    assert np.all(xc[2, 3] == 0)
+    assert yval[3, 6] == 0
+
+
+def test_fold_data():
+    rng = np.random.default_rng(1)
+    time = np.arange(20000) / 100.
+    period = 1.7
+    dd = np.sin(2 * np.pi * time / period)[None, :] + \
+        rng.standard_normal((5, len(time)))
+    notch = np.array([[5., 0.1, 2]])
+    result = fold_data(time, dd, period, 30, lowcut=0.05, highcut=10,
+                       notch=notch, median=True, return_error=True,
+                       silent=True)
+    folded, t, folded_nonorm, dfolded, dfolded_nonorm, newdata = result
+    for i in range(len(dd)):
+        newdd = filter_data(time, dd[i], lowcut=0.05, highcut=10,
+                            notch=notch, rebin=None)
+        assert np.allclose(newdata[i], newdd, rtol=0, atol=1e-12)
+        tt, yy, dx, dy, _ = profile(time % period, newdd, nbins=30,
+                                    dispersion=False, plot=False,
+                                    cutbad=False, median=True)
+        assert np.allclose(t, tt)
+        assert np.allclose(folded[i], (yy - np.mean(yy)) / np.std(yy))
+        assert np.allclose(folded_nonorm[i], yy - np.mean(yy))
+        assert np.allclose(dfolded[i], dy / np.std(yy))
+        assert np.allclose(dfolded_nonorm[i], dy)
+
+    # the clipped profiles are still computed bin by bin
+    folded_clip = fold_data(time, dd, period, 30, lowcut=0.05, highcut=10,
+                            notch=notch, median=True, clip=3, silent=True)[0]
+    assert np.allclose(folded_clip, folded)
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+
+from qubic import QubicAcquisition, QubicInstrument, QubicScene, get_pointing
+from qubic.qubicdict import qubicDict
+
+
+def test_invntt_cache(tmp_path):
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 16
+    config['npointings'] = 100
+    config['use_synthbeam_fits_file'] = False
+    config['photon_noise'] = False
+    config['fftw_wisdom'] = str(tmp_path / 'fftw.wisdom')
+    sampling = get_pointing(config)
+    scene = QubicScene(config)
+
+    def get_invntt(fknee):
+        config['detector_fknee'] = fknee
+        instrument = QubicInstrument(config)[::100]
+        acquisition = QubicAcquisition(instrument, sampling, scene, config)
+        return acquisition.get_invntt_operator()
+
+    invntt = get_invntt(0)
+    assert get_invntt(0) is invntt
+    invntt = get_invntt(0.1)
+    assert get_invntt(0.1) is invntt
+    assert get_invntt(0.2) is not invntt
+    assert os.path.exists(config['fftw_wisdom'])
+
+    # the memoized operator is that of the noise model
+    x = np.random.standard_normal(invntt.shapein)
+    config['detector_fknee'] = 0.1
+    instrument = QubicInstrument(config)[::100]
+    acquisition = QubicAcquisition(instrument, sampling, scene, config)
+    acquisition.effective_duration = 3
+    expected = acquisition.get_invntt_operator()
+    assert expected is not invntt
+    y = expected(x)
+    assert np.allclose(invntt(x) * 3 / 4, y, atol=1e-12 * np.max(np.abs(y)))
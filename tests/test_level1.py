@@ -0,0 +1,44 @@
+import numpy as np
+
+from qubic.level1.filetools import (
+    read_level1, read_level1_chunks, write_level1)
+from qubic.level1.flags import set_flag
+
+
+class _FocalPlane(object):
+    dataset_name = '2020-01-01_00.00.00__test'
+
+
+def test_level1(tmp_path):
+    rng = np.random.default_rng(0)
+    ndet, nsamples = 8, 1000
+    tod = rng.standard_normal((ndet, nsamples))
+    flags = np.zeros((ndet, nsamples), dtype=np.uint64)
+    flags[2, 100:200] = set_flag('cosmic ray', 0)
+    flags[5, -10:] = set_flag('saturation', 0)
+    hk = {'time': np.arange(nsamples) / 156.25,
+          'azimuth': rng.random(nsamples) * 360}
+    filename = str(tmp_path / 'test_level1.fits')
+    assert write_level1(_FocalPlane(), tod, flags, hk=hk,
+                        filename=filename) == filename
+
+    level1 = read_level1(filename)
+    assert level1['header']['NDET'] == ndet
+    assert level1['header']['NSAMPLES'] == nsamples
+    assert np.array_equal(level1['tod'], tod)
+    assert level1['flags'].dtype.kind == 'u'
+    assert np.array_equal(level1['flags'], flags)
+    for key in hk:
+        assert np.array_equal(level1['hk'][key], hk[key])
+    level1['hdulist'].close()
+
+    detectors = [1, 2, 5]
+    chunks = list(read_level1_chunks(filename, nsamples=300,
+                                     detectors=detectors, start=50))
+    assert [_[0] for _ in chunks] == [slice(50, 350), slice(350, 650),
+                                      slice(650, 950), slice(950, 1000)]
+    assert np.array_equal(np.hstack([_[1] for _ in chunks]),
+                          tod[detectors, 50:])
+    assert np.array_equal(np.hstack([_[2] for _ in chunks]),
+                          flags[detectors, 50:])
+    assert read_level1(str(tmp_path / 'missing.fits')) is None
@@ -0,0 +1,49 @@
+import numpy as np
+import scipy.stats
+
+from qubic.fibtools import meancut, sigma_clip
+
+
+def _meancut(data, nsig, med=False, disp=True):
+    dd, mini, maxi = scipy.stats.sigmaclip(data, low=nsig, high=nsig)
+    sc = 1 if disp else np.sqrt(len(dd))
+    return np.median(dd) if med else np.mean(dd), np.std(dd) / sc
+
+
+def test_meancut():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((3, 40, 200))
+    data[..., ::17] += 8
+    data[1, 2, 5] = 1e3
+    for med in (False, True):
+        for disp in (False, True):
+            expected = _meancut(np.ravel(data), 3, med=med, disp=disp)
+            assert np.allclose(meancut(data, 3, med=med, disp=disp),
+                               expected, rtol=1e-12)
+            for axis in (0, 1, -1):
+                vectors = np.moveaxis(data, axis, -1)
+                expected = np.array([
+                    _meancut(v, 3, med=med, disp=disp)
+                    for v in vectors.reshape((-1, vectors.shape[-1]))])
+                m, s = meancut(data, 3, med=med, disp=disp, axis=axis)
+                assert m.shape == s.shape == vectors.shape[:-1]
+                assert np.allclose(m.ravel(), expected[:, 0], rtol=1e-12)
+                assert np.allclose(s.ravel(), expected[:, 1], rtol=1e-12)
+
+
+def test_sigma_clip():
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((5, 100))
+    data[:, 0] = 50
+    mask = np.ones(100, bool)
+    mask[50:] = False
+    mean, std, keep = sigma_clip(data, 3, axis=1, mask=mask)
+    assert keep.shape == data.shape
+    assert not np.any(keep[:, 50:]) and not np.any(keep[:, 0])
+    for i in range(5):
+        clipped = scipy.stats.sigmaclip(data[i, :50], 3, 3)[0]
+        assert np.allclose(mean[i], np.mean(clipped))
+        assert np.allclose(std[i], np.std(clipped))
+    # a single iteration only rejects the outliers of the initial dispersion
+    mean, std, keep = sigma_clip(data, 3, axis=1, maxiter=1)
+    assert np.allclose(std, np.std(data, axis=1))
@@ -0,0 +1,30 @@
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from qubic import QubicMultibandInstrument, QubicScene, get_pointing
+from qubic.qubicdict import qubicDict
+
+
+def test_multiband_projection():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 64
+    config['npointings'] = 30
+    config['use_synthbeam_fits_file'] = False
+    config['MultiBand'] = True
+    config['nf_sub'] = 3
+    config['type_instrument'] = 'two'
+
+    instrument = QubicMultibandInstrument(config).detector_subset(
+        np.arange(8))
+    sampling = get_pointing(config)
+    scene = QubicScene(config)
+
+    projections = instrument.get_projection_operators(
+        sampling, scene, verbose=False)
+    assert len(projections) == len(instrument)
+    for q, P in zip(instrument, projections):
+        expected = q.get_projection_operator(sampling, scene, verbose=False)
+        assert P.shapeout == expected.shapeout
+        for name in expected.matrix.data.dtype.names:
+            assert_same(P.matrix.data[name], expected.matrix.data[name])
@@ -0,0 +1,42 @@
+import os
+import healpy as hp
+import numpy as np
+import pytest
+
+pytest.importorskip('pymaster')
+from qubic.NamasterLib import Namaster
+
+
+def test_namaster_workspaces(tmp_path):
+    nside = 32
+    npix = 12 * nside ** 2
+    mask = np.zeros(npix)
+    mask[hp.query_disc(nside, hp.ang2vec(0, -60, lonlat=True),
+                       np.radians(30))] = 1
+    rng = np.random.default_rng(0)
+    maps = [rng.standard_normal((3, npix)) for _ in range(3)]
+    cache = str(tmp_path / 'workspaces')
+
+    namaster = Namaster(mask, 20, 2 * nside, 10, aposize=5.,
+                        workspace_cache=cache)
+    ell, spectra, w = namaster.get_spectra_batch([m.copy() for m in maps],
+                                                 verbose=False)
+    assert spectra.shape == (3, len(ell), 4)
+    assert len(os.listdir(cache)) == 3
+    assert namaster.get_spectra(maps[0].copy(), verbose=False)[2] is w
+
+    # the workspaces are read from the cache by a new object
+    expected = Namaster(mask, 20, 2 * nside, 10, aposize=5.)
+    other = Namaster(mask, 20, 2 * nside, 10, aposize=5.,
+                     workspace_cache=cache)
+    for m, spec in zip(maps, spectra):
+        assert np.allclose(expected.get_spectra(m.copy(), verbose=False)[1],
+                           spec)
+        assert np.allclose(other.get_spectra(m.copy(), verbose=False)[1],
+                           spec)
+
+    # another purification gives other workspaces
+    _, _, w2 = namaster.get_spectra(maps[0].copy(), purify_b=False,
+                                    verbose=False)
+    assert w2 is not w
+    assert len(os.listdir(cache)) == 6
@@ -0,0 +1,42 @@
+import healpy as hp
+import numpy as np
+import pytest
+
+qss = pytest.importorskip('qubic.QubicSkySim')
+
+
+def test_create_noise_maps_batch():
+    nside = 16
+    npix = 12 * nside ** 2
+    sky = qss.Qubic_sky.__new__(qss.Qubic_sky)
+    sky.nside = nside
+    sky.npix = npix
+    coverage = np.zeros(npix)
+    ipok = hp.query_disc(nside, hp.ang2vec(0, -60, lonlat=True),
+                         np.radians(30))
+    coverage[ipok] = np.linspace(1, 2, len(ipok))
+    cov = np.array([[1, 0.3, 0.1], [0.3, 1.2, 0.2], [0.1, 0.2, 0.9]])
+    clnoise = np.exp(-np.arange(100) / 10)
+    keywords = dict(covcut=0.1, nsub=3, clnoise=clnoise,
+                    sub_bands_cov=[cov, cov, cov])
+
+    maps = np.array(list(sky.create_noise_maps_batch(
+        4, 1., coverage, seed=0, processes=1, **keywords)))
+    assert maps.shape == (4, 3, npix, 3)
+    seenpix = coverage / np.max(coverage) > 0.1
+    assert np.all(maps[:, :, ~seenpix] == 0)
+    assert np.all(maps[:, :, seenpix] != 0)
+    # the realizations do not depend on the number of processes
+    assert np.array_equal(maps, list(sky.create_noise_maps_batch(
+        4, 1., coverage, seed=0, processes=2, **keywords)))
+    seeds = np.random.SeedSequence(0).spawn(4)
+    for k in range(4):
+        assert np.array_equal(maps[k], sky.create_noise_maps(
+            1., coverage, seed=seeds[k], **keywords))
+    assert not np.array_equal(maps[0], maps[1])
+
+    maps = np.array(list(sky.create_noise_maps_batch(
+        2, 1., coverage, seed=1, processes=1)))
+    assert maps.shape == (2, npix, 3)
+    assert np.array_equal(maps[1], sky.create_noise_maps(
+        1., coverage, seed=np.random.SeedSequence(1).spawn(2)[1]))
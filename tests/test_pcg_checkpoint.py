@@ -0,0 +1,99 @@
+import os
+import types
+import numpy as np
+
+import qubic.mapmaking
+from pyoperators import MPI, asoperator
+from pyoperators.utils.testing import assert_same
+from qubic import (
+    QubicAcquisition, QubicInstrument, QubicScene, get_pointing,
+    pcg_checkpoint)
+from qubic.qubicdict import qubicDict
+
+
+def test_pcg_checkpoint(tmp_path):
+    np.random.seed(0)
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 16
+    config['npointings'] = 60
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'I'
+    config['photon_noise'] = False
+    acquisition = QubicAcquisition(QubicInstrument(config)[::20],
+                                   get_pointing(config), QubicScene(config),
+                                   config)
+    H = acquisition.get_operator()
+    invntt = acquisition.get_invntt_operator()
+    M = acquisition.get_block_jacobi_preconditioner(invntt)
+    A = H.T * invntt * H
+    b = H.T * invntt * H(np.random.random_sample(H.shapein))
+    expected = pcg_checkpoint(A, b, M=M, tol=1e-4, maxiter=100)
+    assert expected['success']
+    assert len(expected['history']['time']) == expected['nit']
+    assert len(expected['history']['time_allreduce']) == expected['nit']
+
+    # interrupted run, resumed from its checkpoint
+    checkpoint = str(tmp_path / 'pcg.npz')
+    solution = pcg_checkpoint(A, b, M=M, tol=1e-4, maxiter=8,
+                              checkpoint=checkpoint, checkpoint_every=3)
+    assert not solution['success']
+    assert os.path.exists(checkpoint)
+    solution = pcg_checkpoint(A, b, M=M, tol=1e-4, maxiter=100,
+                              checkpoint=checkpoint, checkpoint_every=3)
+    assert solution['nit'] == expected['nit']
+    assert_same(solution['x'], expected['x'])
+    assert_same(solution['history']['error'], expected['history']['error'])
+
+    # the checkpoint of a converged run is not solved again
+    solution = pcg_checkpoint(A, b, M=M, tol=1e-4, maxiter=100,
+                              checkpoint=checkpoint)
+    assert solution['nit'] == expected['nit']
+
+    # warm start from a previous map
+    solution = pcg_checkpoint(A, b, M=M, x0=expected['x'], tol=1e-4,
+                              maxiter=100)
+    assert solution['nit'] == 0
+
+    config['tol'] = 1e-4
+    config['maxiter'] = 100
+    config['verbose'] = False
+    config['preconditioner'] = 'block_jacobi'
+    config['checkpoint'] = str(tmp_path / 'tod2map.npz')
+    x, nit, error = acquisition.tod2map(H(expected['x']), config)
+    assert os.path.exists(config['checkpoint'])
+
+
+def test_pcg_checkpoint_replicated(tmp_path, monkeypatch):
+    # the MPI processes solve the same system: only the first one writes the
+    # checkpoint, which is broadcast to the others when resuming
+    rng = np.random.default_rng(0)
+    q = rng.standard_normal((40, 40))
+    A = asoperator(q.dot(q.T) + 0.1 * np.eye(40))
+    b = rng.standard_normal(40)
+    expected = pcg_checkpoint(A, b, tol=1e-8, maxiter=200)
+    checkpoint = str(tmp_path / 'pcg.npz')
+    broadcast = {}
+
+    def bcast(obj, root=0):
+        if obj is not None:
+            broadcast['obj'] = obj
+        return broadcast.get('obj')
+
+    def set_rank(rank):
+        monkeypatch.setattr(qubic.mapmaking, 'MPI', types.SimpleNamespace(
+            COMM_WORLD=types.SimpleNamespace(rank=rank, size=2, bcast=bcast),
+            IN_PLACE=MPI.IN_PLACE))
+
+    for rank in (1, 0):
+        set_rank(rank)
+        solution = pcg_checkpoint(A, b, tol=1e-8, maxiter=5,
+                                  checkpoint=checkpoint, checkpoint_every=2)
+        assert not solution['success']
+        assert os.listdir(str(tmp_path)) == ([] if rank else ['pcg.npz'])
+    for rank in (0, 1):
+        set_rank(rank)
+        solution = pcg_checkpoint(A, b, tol=1e-8, maxiter=200,
+                                  checkpoint=checkpoint, checkpoint_every=2)
+        assert solution['nit'] == expected['nit']
+        assert_same(solution['x'], expected['x'])
@@ -0,0 +1,31 @@
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from qubic import QubicMultibandInstrument, QubicScene
+from qubic.qubicdict import qubicDict
+
+
+def test_photon_nep():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nf_sub'] = 4
+    config['use_synthbeam_fits_file'] = False
+    scene = QubicScene(config)
+    for nu in (150e9, 220e9):
+        config['filter_nu'] = nu
+        instrument = QubicMultibandInstrument(config)
+        nep = instrument.get_noise_photon_nep(scene)
+        assert nep.shape == (len(instrument), len(instrument[0]))
+        for q, n in zip(instrument, nep):
+            # debug mode bypasses the memoization
+            q.debug = True
+            expected = q._get_noise_photon_nep(scene)
+            q.debug = False
+            # the summations may be rounded differently between two runs
+            assert_same(n, expected, rtol=100)
+            out = q._get_noise_photon_nep(scene)
+            out[...] = 0
+            assert_same(q._get_noise_photon_nep(scene), expected, rtol=100)
+
+    scene.temperature = 300
+    assert not np.allclose(instrument.get_noise_photon_nep(scene), nep, atol=0)
@@ -0,0 +1,71 @@
+import numpy as np
+
+from qubic import QubicAcquisition, QubicInstrument, QubicScene, get_pointing
+from qubic.acquisition import _get_block_jacobi_preconditioner
+from qubic.qubicdict import qubicDict
+
+
+def test_block_jacobi_preconditioner():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 16
+    config['npointings'] = 60
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'IQU'
+    config['photon_noise'] = False
+    acquisition = QubicAcquisition(QubicInstrument(config)[::40],
+                                   get_pointing(config), QubicScene(config),
+                                   config)
+    invntt = acquisition.get_invntt_operator()
+    M = acquisition.get_block_jacobi_preconditioner(invntt)
+    H = acquisition.get_operator()
+    A = H.T * invntt * H
+
+    # reference diagonal blocks of H.T invntt H, for well-covered pixels
+    rng = np.random.default_rng(0)
+    x = rng.random(M.shapein)
+    y = M(x)
+    coverage = A(np.ones(A.shapein))[:, 0]
+    ipixels = np.argsort(coverage)[::-1][:5]
+    for ipixel in ipixels:
+        block = np.empty((3, 3))
+        for i in range(3):
+            e = np.zeros(A.shapein)
+            e[ipixel, i] = 1
+            block[:, i] = A(e)[ipixel]
+        assert np.allclose(y[ipixel], np.linalg.solve(block, x[ipixel]),
+                           rtol=1e-10, atol=0)
+
+
+def test_block_jacobi_preconditioner_qu():
+    # 2x2 blocks of a term G * P * R, with random Stokes and pixel gains
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 16
+    config['npointings'] = 60
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'QU'
+    scene = QubicScene(config)
+    P = QubicInstrument(config)[::40].get_projection_operator(
+        get_pointing(config), scene, verbose=False)
+    rng = np.random.default_rng(0)
+    gain = rng.random(P.shapeout)
+    pixel_gain = rng.random(scene.shape) + 0.5
+    M = _get_block_jacobi_preconditioner(scene, [(gain, P, pixel_gain, 0)])
+
+    def A(x):
+        y = np.sum(gain * P(pixel_gain * x), axis=-1)
+        return pixel_gain * P.T(gain * y[..., None])
+
+    x = rng.random(M.shapein)
+    y = M(x)
+    index = P.matrix.data.index
+    hits = np.bincount(index[index >= 0], minlength=len(scene))
+    for ipixel in np.argsort(hits)[::-1][:5]:
+        block = np.empty((2, 2))
+        for i in range(2):
+            e = np.zeros(scene.shape)
+            e[ipixel, i] = 1
+            block[:, i] = A(e)[ipixel]
+        assert np.allclose(y[ipixel], np.linalg.solve(block, x[ipixel]),
+                           rtol=1e-10, atol=0)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from pysimulators.interfaces.healpy import Cartesian2HealpixOperator
+from qubic import QubicInstrument, QubicScene, get_pointing
+from qubic.qubicdict import qubicDict
+
+
+def test_projection_block():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 64
+    config['npointings'] = 30
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'IQU'
+    sampling = get_pointing(config)
+    scene = QubicScene(config)
+
+    config['projection_block_size'] = 100
+    instrument = QubicInstrument(config)[::50]
+    P = instrument.get_projection_operator(sampling, scene, verbose=False)
+    config['projection_block_size'] = None
+    instrument = QubicInstrument(config)[::50]
+    expected = instrument.get_projection_operator(sampling, scene,
+                                                  verbose=False)
+    for name in expected.matrix.data.dtype.names:
+        assert_same(P.matrix.data[name], expected.matrix.data[name])
+
+    # per-detector rotation of the peak directions
+    thetas, phis, vals = instrument._peak_angles(
+        scene, instrument.filter.nu, instrument.detector.center,
+        instrument.synthbeam, instrument.horn, instrument.primary_beam)
+    direction = np.array([np.sin(thetas) * np.cos(phis),
+                          np.sin(thetas) * np.sin(phis),
+                          np.cos(thetas)]).transpose(1, 2, 0)
+    rotation = sampling.cartesian_galactic2instrument
+    c2h = Cartesian2HealpixOperator(scene.nside)
+    index = P.matrix.data.index.reshape(
+        (len(instrument), len(sampling), -1))
+    for idet in range(len(instrument)):
+        e_ni = rotation.T(direction[idet, :, None, :])
+        assert_same(index[idet], c2h(e_ni).T.astype(index.dtype))
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from qubic import QubicInstrument, QubicScene, get_pointing
+from qubic.qubicdict import qubicDict
+
+
+def get_config(cache):
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 64
+    config['npointings'] = 30
+    config['use_synthbeam_fits_file'] = False
+    config['projection_cache'] = cache
+    return config
+
+
+def test_projection_cache(tmp_path):
+    config = get_config(str(tmp_path))
+    instrument = QubicInstrument(config)[:8]
+    sampling = get_pointing(config)
+    scene = QubicScene(config)
+
+    P = instrument.get_projection_operator(sampling, scene, verbose=False)
+    files = os.listdir(str(tmp_path))
+    assert len(files) == 1
+
+    P2 = instrument.get_projection_operator(sampling, scene, verbose=False)
+    assert isinstance(P2.matrix.data.base, np.memmap)
+    assert P2.shapein == P.shapein
+    assert P2.shapeout == P.shapeout
+    assert_same(P2.matrix.data.index, P.matrix.data.index)
+    assert_same(P2.matrix.data.r11, P.matrix.data.r11)
+    assert_same(P2.matrix.data.r32, P.matrix.data.r32)
+
+    sampling.pitch = sampling.pitch + 1
+    instrument.get_projection_operator(sampling, scene, verbose=False)
+    assert len(os.listdir(str(tmp_path))) == 2
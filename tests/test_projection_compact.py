@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from qubic import CompactProjectionOperator, QubicInstrument, QubicScene
+from qubic import get_pointing
+from qubic.qubicdict import qubicDict
+
+
+@pytest.mark.parametrize('kind', ['I', 'QU', 'IQU'])
+@pytest.mark.parametrize('dtype_angle', [None, 'float32'])
+def test_projection_compact(kind, dtype_angle):
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 64
+    config['npointings'] = 30
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = kind
+    sampling = get_pointing(config)
+    scene = QubicScene(config)
+    expected = QubicInstrument(config)[::50].get_projection_operator(
+        sampling, scene, verbose=False)
+    config['projection_compact'] = True
+    config['projection_compact_dtype'] = dtype_angle
+    P = QubicInstrument(config)[::50].get_projection_operator(
+        sampling, scene, verbose=False)
+    assert isinstance(P, CompactProjectionOperator)
+    ratio = 1.1 if kind == 'QU' and dtype_angle == 'float32' else 1.5
+    assert P.nbytes < expected.matrix.data.nbytes / ratio
+
+    # reference products from the sparse matrix of the peak sampling
+    data = expected.matrix.data
+    x = np.random.random_sample(scene.shape)
+    y = np.random.random_sample(expected.shapeout)
+    if kind == 'I':
+        Hx = np.sum(data.value * x[data.index], axis=-1)
+        HTy = np.bincount(data.index.ravel(),
+                          (data.value * y.reshape(-1, 1)).ravel(), len(x))
+    elif kind == 'QU':
+        Q, U = x[data.index].T.swapaxes(1, 2)
+        Hx = np.array([np.sum(data.r11 * Q - data.r21 * U, axis=-1),
+                       np.sum(data.r21 * Q + data.r11 * U, axis=-1)]).T
+        y = y.reshape(-1, 1, 2)
+        HTy = np.array([
+            np.bincount(data.index.ravel(), w.ravel(), len(x))
+            for w in (data.r11 * y[..., 0] + data.r21 * y[..., 1],
+                      data.r11 * y[..., 1] - data.r21 * y[..., 0])]).T
+    else:
+        I, Q, U = x[data.index].T.swapaxes(1, 2)
+        Hx = np.array([np.sum(data.r11 * I, axis=-1),
+                       np.sum(data.r22 * Q - data.r32 * U, axis=-1),
+                       np.sum(data.r32 * Q + data.r22 * U, axis=-1)]).T
+        y = y.reshape(-1, 1, 3)
+        HTy = np.array([
+            np.bincount(data.index.ravel(), w.ravel(), len(x))
+            for w in (data.r11 * y[..., 0],
+                      data.r22 * y[..., 1] + data.r32 * y[..., 2],
+                      data.r22 * y[..., 2] - data.r32 * y[..., 1])]).T
+    Hx = Hx.reshape(expected.shapeout)
+    # the polarization angles are stored in float16 by default
+    rtol = 1e-3 if kind != 'I' and dtype_angle is None else 1e-5
+    assert np.allclose(P(x), Hx, rtol=rtol, atol=rtol * np.abs(Hx).max())
+    assert np.allclose(P.T(y.reshape(expected.shapeout)), HTy, rtol=rtol,
+                       atol=rtol * np.abs(HTy).max())
+
+
+def test_projection_compact_delta():
+    # pointings in a small field of a scene of more than 2**16 pixels: the
+    # indices are stored as (first time sample, int16 differences)
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 128
+    config['npointings'] = 30
+    config['repeat_pointing'] = False
+    config['random_pointing'] = True
+    config['dtheta'] = 1.
+    config['use_synthbeam_fits_file'] = False
+    config['projection_compact'] = True
+    config['projection_compact_dtype'] = 'float32'
+    sampling = get_pointing(config)
+    sampling.pitch = 0
+    scene = QubicScene(config)
+    P = QubicInstrument(config)[::50].get_projection_operator(
+        sampling, scene, verbose=False)
+    assert all(isinstance(index, tuple) for index in P.index)
+    arrays = [P.weight] + P.angle
+    for first, delta in P.index:
+        arrays += [first, delta]
+    assert P.nbytes == sum(a.nbytes for a in arrays)
+
+    config['projection_compact'] = False
+    expected = QubicInstrument(config)[::50].get_projection_operator(
+        sampling, scene, verbose=False)
+    x = np.random.random_sample(scene.shape)
+    Hx = expected(x)
+    assert np.allclose(P(x), Hx, rtol=1e-5, atol=1e-5 * np.abs(Hx).max())
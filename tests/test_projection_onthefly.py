@@ -0,0 +1,54 @@
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from qubic import (
+    OnTheFlyProjectionOperator, QubicAcquisition, QubicInstrument, QubicScene,
+    get_pointing)
+from qubic.qubicdict import qubicDict
+
+
+def test_projection_onthefly():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 64
+    config['npointings'] = 30
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'IQU'
+    instrument = QubicInstrument(config)[::50]
+    sampling = get_pointing(config)
+    scene = QubicScene(config)
+
+    expected = instrument.get_projection_operator(sampling, scene,
+                                                  verbose=False)
+    P = instrument.get_projection_operator(
+        sampling, scene, verbose=False,
+        max_nbytes=expected.matrix.data.nbytes // 5)
+    assert isinstance(P, OnTheFlyProjectionOperator)
+    assert len(P.chunks) > 1
+    assert P.shapein == expected.shapein
+    assert P.shapeout == expected.shapeout
+    data = expected.matrix.data.reshape((len(instrument), len(sampling), -1))
+    for chunk in P.chunks:
+        chunk_data = P.get_chunk_operator(chunk).matrix.data
+        for name in data.dtype.names:
+            assert_same(chunk_data[name].reshape(data[:, chunk].shape),
+                        data[:, chunk][name])
+
+    # the chunked direct and transpose operations
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal(P.shapein)
+    y = rng.standard_normal(P.shapeout)
+    assert_same(P(x), expected(x))
+    # the transpose sums the chunks in another order than the full matrix
+    yt = expected.T(y)
+    atol = 1e-14 * np.max(np.abs(yt))
+    assert np.allclose(P.T(y), yt, rtol=0, atol=atol)
+    out = rng.standard_normal(P.shapein)
+    P.T(y, out)
+    assert np.allclose(out, yt, rtol=0, atol=atol)
+
+    config['max_nbytes'] = expected.matrix.data.nbytes // 5
+    acquisition = QubicAcquisition(instrument, sampling, scene, config)
+    assert len(acquisition.block) == 1
+    P = acquisition.get_projection_operator(verbose=False)
+    assert isinstance(P, OnTheFlyProjectionOperator)
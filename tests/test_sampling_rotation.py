@@ -0,0 +1,60 @@
+import pickle
+import numpy as np
+
+from astropy.time import TimeDelta
+from pyoperators import Rotation3dOperator, rule_manager
+from pyoperators.utils.testing import assert_same
+from pysimulators import (
+    CartesianEquatorial2HorizontalOperator,
+    CartesianGalactic2EquatorialOperator)
+from qubic import get_pointing
+from qubic.qubicdict import qubicDict
+
+
+def _get_rotation(sampling):
+    time = sampling.date_obs + TimeDelta(sampling.time, format='sec')
+    with rule_manager(none=False):
+        r = Rotation3dOperator(
+            "ZY'Z''", sampling.azimuth, 90 - sampling.elevation,
+            sampling.pitch, degrees=True).T * \
+            CartesianEquatorial2HorizontalOperator(
+                'NE', time, sampling.latitude, sampling.longitude) * \
+            CartesianGalactic2EquatorialOperator()
+    return r.data
+
+
+def test_sampling_rotation():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['npointings'] = 300
+    config['period'] = 0.5
+    sampling = get_pointing(config)
+    expected = _get_rotation(sampling)
+    data = sampling.get_rotation_matrices()
+    assert data.shape == (len(sampling), 3, 3)
+    assert data.flags.c_contiguous
+    assert_same(data, expected, atol=10)
+    assert sampling.get_rotation_matrices() is data
+    assert sampling.cartesian_galactic2instrument.data is data
+
+    # slices and pickles keep the matrices
+    sub = sampling[10:50]
+    assert_same(sub.get_rotation_matrices(), expected[10:50], atol=10)
+    assert sub.__dict__['_rotations']['galactic'][0] == \
+        sub._get_rotation_key('galactic')
+    sampling = pickle.loads(pickle.dumps(sampling))
+    assert sampling.__dict__['_rotations']['galactic'][0] == \
+        sampling._get_rotation_key('galactic')
+
+    # the matrices are recomputed when the pointing changes
+    sampling.azimuth += 1
+    assert_same(sampling.get_rotation_matrices(), _get_rotation(sampling),
+                atol=10)
+
+    # interpolation of the sky rotation
+    config['rotation_step'] = 10.
+    sampling = get_pointing(config)
+    assert sampling.rotation_step == 10
+    data = sampling.get_rotation_matrices()
+    assert np.max(np.abs(data - expected)) < 1e-7
+    assert_same(sampling[10:50].get_rotation_matrices(), data[10:50])
@@ -0,0 +1,39 @@
+import os
+import pickle
+import numpy as np
+
+from qubic.sharedtod import SharedArray, TODPool
+
+
+def _detrend(row, degree):
+    x = np.arange(len(row))
+    return row - np.polyval(np.polyfit(x, row, degree), x)
+
+
+def test_sharedtod(tmp_path):
+    rng = np.random.default_rng(0)
+    tod = rng.standard_normal((6, 1000)) + np.arange(1000) * 0.01
+    expected = np.array([_detrend(row, 1) for row in tod])
+    filename = os.path.join(str(tmp_path), 'tod.npy')
+    np.save(filename, tod)
+
+    with TODPool(processes=2) as pool:
+        for data in (SharedArray.from_array(tod), SharedArray.open(filename)):
+            with data:
+                copy = pickle.loads(pickle.dumps(data))
+                assert np.all(copy[2] == tod[2])
+                copy.close()
+                result = list(pool.map_rows(_detrend, data, args=(1,)))
+                assert np.allclose(result, expected)
+
+                # the results are written by the workers in a shared array
+                for outfile in (None, os.path.join(str(tmp_path), 'out.npy')):
+                    with SharedArray(data.shape, filename=outfile) as out:
+                        out[...] = 0
+                        assert list(pool.map_rows(
+                            _detrend, data, rows=[1, 4], args=(1,),
+                            out=out)) == [None, None]
+                        assert np.allclose(out[[1, 4]], expected[[1, 4]])
+                        assert np.all(out[[0, 2, 3, 5]] == 0)
+                    if outfile is not None:
+                        assert np.allclose(np.load(outfile)[1], expected[1])
@@ -0,0 +1,59 @@
+import numpy as np
+
+from qubic import (
+    create_sweeping_pointings, create_sweeping_pointings_deadtime,
+    get_pointing, iter_sweeping_pointings)
+from qubic.qubicdict import qubicDict
+
+
+def test_sweeping_pointings():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['random_pointing'] = False
+    config['repeat_pointing'] = False
+    config['sweeping_pointing'] = True
+    config['duration'] = 0.5
+    config['period'] = 0.5
+    config['random_hwp'] = True
+    args = ((config['RA_center'], config['DEC_center']), config['duration'],
+            config['period'], config['angspeed'], config['delta_az'],
+            config['nsweeps_per_elevation'], config['angspeed_psi'],
+            config['maxpsi'], config['hwp_stepsize'])
+    keywords = dict(date_obs=config['date_obs'], latitude=config['latitude'],
+                    longitude=config['longitude'],
+                    fix_azimuth=config['fix_azimuth'])
+    names = 'time', 'azimuth', 'elevation', 'pitch', 'angle_hwp'
+
+    expected = get_pointing(config)
+    assert len(expected) == 3600
+    # reproducible random HWP angles. The vectorized trigonometric functions
+    # may round the elements differently depending on their memory alignment
+    sampling = create_sweeping_pointings(
+        *args, seed=np.random.default_rng(config['seed']), **keywords)
+    for name in names:
+        assert np.allclose(getattr(sampling, name), getattr(expected, name),
+                           rtol=0, atol=1e-10)
+    # the elevation is constant during the sweeps of a phase
+    isweeps = np.floor(expected.time / (2 * config['delta_az'] /
+                                        config['angspeed'])).astype(int)
+    ielevations = isweeps // config['nsweeps_per_elevation']
+    for i in np.unique(ielevations):
+        assert np.ptp(expected.elevation[ielevations == i]) == 0
+
+    for random_hwp in (True, False):
+        for dead_time in (None, 5):
+            if dead_time is None:
+                expected = create_sweeping_pointings(
+                    *args, random_hwp=random_hwp, seed=0, **keywords)
+            else:
+                expected = create_sweeping_pointings_deadtime(
+                    *args, random_hwp=random_hwp, dead_time=dead_time,
+                    seed=0, **keywords)
+            chunks = list(iter_sweeping_pointings(
+                *args, random_hwp=random_hwp, dead_time=dead_time,
+                nsamples=1000, seed=0, **keywords))
+            assert [len(_) for _ in chunks] == [1000, 1000, 1000, 600]
+            for name in names:
+                assert np.allclose(
+                    np.concatenate([getattr(_, name) for _ in chunks]),
+                    getattr(expected, name), rtol=0, atol=1e-10)
@@ -0,0 +1,97 @@
+import numpy as np
+
+from pyoperators.utils.testing import assert_same
+from qubic import (
+    QubicAcquisition, QubicInstrument, QubicMultibandInstrument,
+    QubicPolyAcquisition, QubicScene, get_pointing, tod2map_stream)
+from qubic.qubicdict import qubicDict
+
+
+def test_tod_stream():
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 16
+    config['npointings'] = 50
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'IQU'
+    config['photon_noise'] = False
+    acquisition = QubicAcquisition(QubicInstrument(config)[::50],
+                                   get_pointing(config), QubicScene(config),
+                                   config)
+    H = acquisition.get_operator()
+    np.random.seed(0)
+    sky = np.random.standard_normal(H.shapein)
+
+    # the noise realization does not depend on the chunk length
+    expected = np.hstack([n for _, n in acquisition.get_noise_chunks(
+        nsamples=50, seed=1)])
+    assert expected.shape == H.shapeout
+    noise = np.hstack([n for _, n in acquisition.get_noise_chunks(
+        nsamples=7, seed=1)])
+    assert_same(noise, expected)
+
+    # noiseless chunks
+    tod = np.zeros(H.shapeout)
+    for chunk, t in acquisition.get_observation_chunks(
+            sky, nsamples=7, noiseless=True):
+        tod[:, chunk] = t
+    assert_same(tod, H(sky))
+
+    # accumulation of the transposed operator
+    tod = np.zeros(H.shapeout)
+
+    def writer(chunk, t):
+        tod[:, chunk] = t
+
+    rhs, coverage = tod2map_stream(acquisition.get_observation_chunks(
+        sky, nsamples=7, seed=1, return_operator=True), writer=writer)
+    assert_same(tod, H(sky) + expected)
+    expected = H.T(tod)
+    assert np.allclose(rhs, expected, rtol=0,
+                       atol=1e-12 * np.max(np.abs(expected)))
+    expected = H.T(np.ones(H.shapeout))[:, 0]
+    assert np.allclose(coverage, expected, rtol=0,
+                       atol=1e-12 * np.max(expected))
+
+
+def test_tod_stream_poly(monkeypatch):
+    config = qubicDict()
+    config.read_from_file('pipeline_demo.dict')
+    config['nside'] = 16
+    config['npointings'] = 20
+    config['use_synthbeam_fits_file'] = False
+    config['kind'] = 'IQU'
+    config['photon_noise'] = False
+    config['MultiBand'] = True
+    config['nf_sub'] = 2
+    instrument = QubicMultibandInstrument(config).detector_subset(
+        np.arange(8))
+    acquisition = QubicPolyAcquisition(instrument, get_pointing(config),
+                                       QubicScene(config), config)
+    np.random.seed(0)
+    sky = np.random.standard_normal((2,) + acquisition.scene.shape)
+    sky_convolved = np.array([a.get_convolution_peak_operator()(sky[i])
+                              for i, a in enumerate(acquisition)])
+    expected = acquisition.get_operator_to_make_TOD()(sky_convolved)
+    H = acquisition.get_operator()
+
+    # the sub-band projections are computed once per chunk
+    ncalls = []
+    get_projection_operators = QubicPolyAcquisition.get_projection_operators
+
+    def counter(self, verbose=True):
+        ncalls.append(1)
+        return get_projection_operators(self, verbose=verbose)
+
+    monkeypatch.setattr(QubicPolyAcquisition, 'get_projection_operators',
+                        counter)
+    tod = np.zeros(H.shapeout)
+    nchunks = 0
+    for chunk, t, H_chunk in acquisition.get_observation_chunks(
+            sky, nsamples=7, noiseless=True, return_operator=True):
+        tod[:, chunk] = t
+        assert H_chunk.shapeout == t.shape
+        nchunks += 1
+    assert len(ncalls) == nchunks
+    assert np.allclose(tod, expected, rtol=0,
+                       atol=1e-12 * np.max(np.abs(expected)))
@@ -0,0 +1,42 @@
+import os
+import healpy as hp
+import numpy as np
+
+import qubic.xpol
+from qubic import Xpol
+
+
+def test_xpol_cache(tmp_path):
+    nside = 16
+    npix = 12 * nside ** 2
+    mask = np.zeros(npix, bool)
+    mask[hp.query_disc(nside, hp.ang2vec(0, -60, lonlat=True),
+                       np.radians(40))] = True
+    cache = str(tmp_path / 'xpol')
+
+    qubic.xpol._XPOL_CACHE.clear()
+    expected = Xpol(mask, 4, 2 * nside, 4)
+    xpol = Xpol(mask, 4, 2 * nside, 4, cache=cache)
+    assert xpol.mll_binned_inv is expected.mll_binned_inv
+    assert len(os.listdir(cache)) == 1
+    qubic.xpol._XPOL_CACHE.clear()
+    xpol = Xpol(mask, 4, 2 * nside, 4, cache=cache)
+    assert np.array_equal(xpol.wl, expected.wl)
+    assert np.array_equal(xpol.mll_binned_inv, expected.mll_binned_inv)
+
+    rng = np.random.default_rng(0)
+    maps1 = rng.standard_normal((5, 3, npix))
+    maps2 = rng.standard_normal((5, npix, 3))
+    biased, unbiased = xpol.get_spectra(maps1, nthreads=2)
+    assert biased.shape == (5, 6, 2 * nside + 1)
+    assert unbiased.shape == (5, 6, len(xpol.ell_binned))
+    cross = xpol.get_spectra(maps1, maps2, nthreads=2)
+    for i in range(5):
+        b, u = expected.get_spectra(maps1[i].T)
+        assert np.allclose(biased[i], b, rtol=1e-12, atol=0)
+        assert np.allclose(unbiased[i], u, rtol=1e-10,
+                           atol=1e-12 * np.max(np.abs(u)))
+        b, u = expected.get_spectra(maps1[i], maps2[i])
+        assert np.allclose(cross[0][i], b, rtol=1e-12, atol=0)
+        assert np.allclose(cross[1][i], u, rtol=1e-10,
+                           atol=1e-12 * np.max(np.abs(u)))